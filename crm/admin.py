@@ -1,44 +1,101 @@
 from django.contrib import admin
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.forms import Script
+from django.urls import reverse
+
+from . import autocomplete
 from .models import Company, Contact, Lead, Deal, Activity
+from .pagination import EstimatedCountPaginator
+
+AUTOCOMPLETE_URLS = {model: f'{entity}_autocomplete' for entity, (model, *_) in autocomplete.SOURCES.items()}
+
+class AutocompleteFilter(admin.RelatedFieldListFilter):
+    # A related-field filter for tables too big to list as filter links: only
+    # the current choice is loaded, and static/js/autocomplete.js looks up
+    # others through the CRM's autocomplete endpoints.
+    template = 'admin/crm/autocomplete_filter.html'
+
+    def field_choices(self, field, request, model_admin):
+        selected = [pk for pk in self.lookup_val or [] if pk.isdigit()]
+        if not selected:
+            return []
+        return [(obj.pk, str(obj)) for obj in field.related_model._default_manager.filter(pk__in=selected)]
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        self.autocomplete_url = reverse(AUTOCOMPLETE_URLS[self.field.related_model])
+        # The script swaps the placeholder for the picked pk.
+        self.pick_query = changelist.get_query_string({self.lookup_kwarg: '__pk__'}, [self.lookup_kwarg_isnull])
+        yield from super().choices(changelist)
+
+class AdminPaginator(EstimatedCountPaginator):
+    # The changelist prints its count as a plain number, so filtered lists
+    # are counted exactly rather than capped.
+    probe_filtered = False
+
+class ScaleModeAdmin(admin.ModelAdmin):
+    # Changelist settings for tables with millions of rows: no exact
+    # COUNT(*) for the unfiltered list or the "N total" link.
+    paginator = AdminPaginator
+    show_full_result_count = False
+
+    class Media:
+        js = [Script('js/autocomplete.js', defer=True)]
+
+class FullNameMixin:
+    # full_name is computed in the query so the column can be sorted.
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            db_full_name=Concat('first_name', Value(' '), 'last_name'))
+
+    @admin.display(description='Name', ordering='db_full_name')
+    def full_name(self, obj):
+        return obj.db_full_name
 
 @admin.register(Company)
-class CompanyAdmin(admin.ModelAdmin):
+class CompanyAdmin(ScaleModeAdmin):
     list_display = ['name', 'industry', 'city', 'country', 'created_at']
     list_filter = ['industry', 'country', 'created_at']
     search_fields = ['name', 'industry', 'city']
     ordering = ['name']
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(FullNameMixin, ScaleModeAdmin):
     list_display = ['full_name', 'email', 'company', 'contact_type', 'assigned_to', 'created_at']
-    list_filter = ['contact_type', 'company', 'assigned_to', 'created_at']
+    list_filter = ['contact_type', ('company', AutocompleteFilter), 'assigned_to', 'created_at']
+    list_select_related = ['company', 'assigned_to']
     search_fields = ['first_name', 'last_name', 'email', 'company__name']
     ordering = ['last_name', 'first_name']
     raw_id_fields = ['company']
 
 @admin.register(Lead)
-class LeadAdmin(admin.ModelAdmin):
+class LeadAdmin(FullNameMixin, ScaleModeAdmin):
     list_display = ['full_name', 'email', 'company_name', 'status', 'source', 'assigned_to', 'created_at']
     list_filter = ['status', 'source', 'assigned_to', 'created_at']
+    list_select_related = ['assigned_to']
     search_fields = ['first_name', 'last_name', 'email', 'company_name']
     ordering = ['-created_at']
 
-    def full_name(self, obj):
-        return f"{obj.first_name} {obj.last_name}"
-    full_name.short_description = 'Name'
-
 @admin.register(Deal)
-class DealAdmin(admin.ModelAdmin):
+class DealAdmin(ScaleModeAdmin):
     list_display = ['title', 'company', 'contact', 'amount', 'stage', 'probability', 'expected_close_date', 'assigned_to']
-    list_filter = ['stage', 'priority', 'assigned_to', 'expected_close_date']
+    list_filter = ['stage', 'priority', ('company', AutocompleteFilter), ('contact', AutocompleteFilter),
+                   'assigned_to', 'expected_close_date']
+    list_select_related = ['company', 'contact', 'assigned_to']
     search_fields = ['title', 'company__name', 'contact__first_name', 'contact__last_name']
     ordering = ['-created_at']
     raw_id_fields = ['contact', 'company']
 
 @admin.register(Activity)
-class ActivityAdmin(admin.ModelAdmin):
+class ActivityAdmin(ScaleModeAdmin):
     list_display = ['title', 'activity_type', 'status', 'contact', 'deal', 'assigned_to', 'due_date']
-    list_filter = ['activity_type', 'status', 'assigned_to', 'due_date']
+    list_filter = ['activity_type', 'status', ('contact', AutocompleteFilter), ('deal', AutocompleteFilter),
+                   'assigned_to', 'due_date']
+    # Deal.__str__ shows the company name.
+    list_select_related = ['contact', 'deal__company', 'assigned_to']
     search_fields = ['title', 'contact__first_name', 'contact__last_name', 'deal__title']
     ordering = ['due_date']
     raw_id_fields = ['contact', 'deal']
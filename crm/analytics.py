@@ -0,0 +1,260 @@
+from collections import Counter, defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from . import stages
+from .models import Deal, Lead, StageDuration
+
+CENTS = Decimal('0.01')
+DEFAULT_MONTHS = 6
+CLOSED_STAGES = ['closed_won', 'closed_lost']
+OPEN_STAGES = [stage for stage, _ in Deal.STAGE_CHOICES if stage not in CLOSED_STAGES]
+# Funnels assume records move through the choices in order; lost records
+# can't be placed on a step, so they are left out.
+DEAL_FUNNEL = OPEN_STAGES + ['closed_won']
+LEAD_FUNNEL = [status for status, _ in Lead.STATUS_CHOICES if status != 'closed_lost']
+
+OPEN = ~Q(stage__in=CLOSED_STAGES)
+WON = Q(stage='closed_won')
+LOST = Q(stage='closed_lost')
+
+
+def weighted_sum(**kwargs):
+    # amount * probability summed in SQL; divided by 100 in weighted().
+    return Sum(F('amount') * F('probability'), output_field=DecimalField(max_digits=20, decimal_places=2), **kwargs)
+
+
+def money(value):
+    return Decimal(value or 0).quantize(CENTS)
+
+
+def weighted(value):
+    return money(Decimal(value or 0) / 100)
+
+
+def rate(numerator, denominator):
+    return round(numerator / denominator * 100, 1) if denominator else 0.0
+
+
+def add_months(day, months):
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def _as_date(value):
+    return value.date() if hasattr(value, 'date') else value
+
+
+def weighted_pipeline(deals):
+    totals = {
+        row['stage']: row
+        for row in deals.filter(OPEN).values('stage').annotate(
+            count=Count('id'), total=Sum('amount'), weighted=weighted_sum(),
+        ).order_by()
+    }
+    labels = dict(Deal.STAGE_CHOICES)
+    rows = []
+    for stage in OPEN_STAGES:
+        row = totals.get(stage, {})
+        rows.append({
+            'stage': stage,
+            'label': labels[stage],
+            'count': row.get('count', 0),
+            'total': money(row.get('total')),
+            'weighted': weighted(row.get('weighted')),
+        })
+    return {
+        'count': sum(row['count'] for row in rows),
+        'total': sum((row['total'] for row in rows), Decimal('0.00')),
+        'weighted': sum((row['weighted'] for row in rows), Decimal('0.00')),
+        'stages': rows,
+    }
+
+
+def funnel(counts, steps, labels):
+    # Everything at or beyond a step has passed through it, so each step's
+    # count is a suffix sum over the steps after it.
+    reached, total = [], 0
+    for step in reversed(steps):
+        total += counts.get(step, 0)
+        reached.append(total)
+    reached.reverse()
+    return [
+        {
+            'step': step,
+            'label': labels[step],
+            'current': counts.get(step, 0),
+            'reached': reached[i],
+            'conversion': rate(reached[i], reached[i - 1]) if i else 100.0 if reached[0] else 0.0,
+        }
+        for i, step in enumerate(steps)
+    ]
+
+
+def deal_funnel(deals):
+    counts = dict(deals.values_list('stage').annotate(count=Count('id')).order_by())
+    return {
+        'steps': funnel(counts, DEAL_FUNNEL, dict(Deal.STAGE_CHOICES)),
+        'lost': counts.get('closed_lost', 0),
+    }
+
+
+def lead_funnel(leads):
+    counts = dict(leads.values_list('status').annotate(count=Count('id')).order_by())
+    return {
+        'steps': funnel(counts, LEAD_FUNNEL, dict(Lead.STATUS_CHOICES)),
+        'lost': counts.get('closed_lost', 0),
+    }
+
+
+def win_rates(deals):
+    rows = deals.values('assigned_to', 'assigned_to__username').annotate(
+        open=Count('id', filter=OPEN),
+        won=Count('id', filter=WON),
+        lost=Count('id', filter=LOST),
+        won_total=Sum('amount', filter=WON),
+        weighted=weighted_sum(filter=OPEN),
+    ).order_by('assigned_to__username')
+    return [
+        {
+            'user_id': row['assigned_to'],
+            'username': row['assigned_to__username'] or 'Unassigned',
+            'open': row['open'],
+            'won': row['won'],
+            'lost': row['lost'],
+            'win_rate': rate(row['won'], row['won'] + row['lost']),
+            'won_amount': money(row['won_total']),
+            'weighted': weighted(row['weighted']),
+        }
+        for row in rows
+    ]
+
+
+def monthly_forecast(deals, months=DEFAULT_MONTHS, today=None):
+    # Open deals by expected close month. Deals already past their close
+    # date are reported as overdue rather than spread over past months.
+    start = (today or timezone.localdate()).replace(day=1)
+    end = add_months(start, months)
+    rows = deals.filter(OPEN, expected_close_date__lt=end).annotate(
+        month=TruncMonth('expected_close_date'),
+    ).values('month').annotate(count=Count('id'), total=Sum('amount'), weighted=weighted_sum()).order_by('month')
+
+    overdue = {'count': 0, 'total': Decimal('0.00'), 'weighted': Decimal('0.00')}
+    by_month = {}
+    for row in rows:
+        month = _as_date(row['month'])
+        if month < start:
+            overdue['count'] += row['count']
+            overdue['total'] += money(row['total'])
+            overdue['weighted'] += weighted(row['weighted'])
+        else:
+            by_month[month] = row
+    forecast = []
+    for i in range(months):
+        month = add_months(start, i)
+        row = by_month.get(month, {})
+        forecast.append({
+            'month': month,
+            'count': row.get('count', 0),
+            'total': money(row.get('total')),
+            'weighted': weighted(row.get('weighted')),
+        })
+    return {'months': forecast, 'overdue': overdue}
+
+
+def cohorts(deals, months=DEFAULT_MONTHS, today=None):
+    # Deals grouped by the month they were created, with how many of each
+    # cohort have closed and at what rate they were won.
+    start = add_months((today or timezone.localdate()).replace(day=1), 1 - months)
+    rows = deals.filter(created_at__date__gte=start).annotate(
+        month=TruncMonth('created_at'),
+    ).values('month').annotate(
+        count=Count('id'),
+        won=Count('id', filter=WON),
+        lost=Count('id', filter=LOST),
+        total=Sum('amount'),
+        won_total=Sum('amount', filter=WON),
+    ).order_by('month')
+    return [
+        {
+            'month': _as_date(row['month']),
+            'count': row['count'],
+            'won': row['won'],
+            'lost': row['lost'],
+            'closed_rate': rate(row['won'] + row['lost'], row['count']),
+            'win_rate': rate(row['won'], row['won'] + row['lost']),
+            'amount': money(row['total']),
+            'won_amount': money(row['won_total']),
+        }
+        for row in rows
+    ]
+
+
+def _days(seconds):
+    return round(seconds / 86400, 1) if seconds is not None else None
+
+
+def _stay_summary(buckets, seconds):
+    count = sum(buckets.values())
+    return {
+        'count': count,
+        'avg_days': _days(seconds / count) if count else None,
+        'p50_days': _days(stages.percentile(buckets, 0.5)),
+        'p90_days': _days(stages.percentile(buckets, 0.9)),
+    }
+
+
+def stage_velocity(months=DEFAULT_MONTHS, today=None, assigned_to=None):
+    # How long deals stayed in each open stage before moving on, by the
+    # month they moved. Read from the StageDuration rollup, never the log.
+    start = add_months((today or timezone.localdate()).replace(day=1), 1 - months)
+    rows = StageDuration.objects.filter(month__gte=start, stage__in=OPEN_STAGES)
+    if assigned_to is not None:
+        rows = rows.filter(assigned_to_id=assigned_to)
+    rows = rows.values_list('month', 'stage', 'bucket').annotate(
+        count=Sum('count'), seconds=Sum('total_seconds'),
+    ).order_by()
+
+    # Histograms merge by adding bucket counts, so the whole window's
+    # percentiles come from the same rows as each month's.
+    buckets, seconds = defaultdict(Counter), Counter()
+    for month, stage, bucket, count, total in rows:
+        for key in (stage, (_as_date(month), stage)):
+            buckets[key][bucket] += count
+            seconds[key] += total
+    labels = dict(Deal.STAGE_CHOICES)
+    return {
+        'stages': [
+            {'stage': stage, 'label': labels[stage], **_stay_summary(buckets[stage], seconds[stage])}
+            for stage in OPEN_STAGES
+        ],
+        'months': [
+            {
+                'month': month,
+                'stages': [
+                    {'stage': stage, **_stay_summary(buckets[month, stage], seconds[month, stage])}
+                    for stage in OPEN_STAGES
+                ],
+            }
+            for month in (add_months(start, i) for i in range(months))
+        ],
+    }
+
+
+def pipeline_report(deals=None, leads=None, months=DEFAULT_MONTHS, today=None, assigned_to=None):
+    deals = Deal.objects.all() if deals is None else deals
+    leads = Lead.objects.all() if leads is None else leads
+    return {
+        'generated_at': timezone.now(),
+        'pipeline': weighted_pipeline(deals),
+        'deal_funnel': deal_funnel(deals),
+        'lead_funnel': lead_funnel(leads),
+        'win_rates': win_rates(deals),
+        'forecast': monthly_forecast(deals, months, today),
+        'cohorts': cohorts(deals, months, today),
+        'stage_velocity': stage_velocity(months, today, assigned_to),
+    }
@@ -0,0 +1,366 @@
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET, require_http_methods
+
+from . import cache, dedupe, search, stages
+from .models import Company, Contact, Lead, Deal, Activity, DashboardStats
+from .pagination import CursorPaginator
+
+DEFAULT_LIMIT = 50
+
+USER_FIELDS = ['id', 'username', 'first_name', 'last_name']
+
+# entity -> (model, summary fields used when embedded, allowed include= names,
+# list filter params)
+RESOURCES = {
+    'company': (Company, ['id', 'name'], ['contacts', 'deals'], []),
+    'contact': (Contact, ['id', 'first_name', 'last_name', 'email'],
+                ['company', 'assigned_to', 'deals', 'activities'], ['company', 'contact_type']),
+    'lead': (Lead, ['id', 'first_name', 'last_name', 'email', 'status'], ['assigned_to'], ['status']),
+    'deal': (Deal, ['id', 'title', 'stage', 'amount'],
+             ['company', 'contact', 'assigned_to', 'activities'], ['company', 'contact', 'stage']),
+    'activity': (Activity, ['id', 'title', 'status', 'due_date'],
+                 ['contact', 'deal', 'assigned_to'], ['contact', 'deal', 'status']),
+}
+
+# Search documents that embed another entity's fields: entity -> (fields,
+# [(dependent entity, foreign key)]). Mirrors the reindexing in crm.signals.
+DEPENDENT_DOCUMENTS = {
+    'company': (['name'], [('contact', 'company'), ('deal', 'company')]),
+    'contact': (['first_name', 'last_name'], [('deal', 'contact'), ('activity', 'contact')]),
+    'deal': (['title'], [('activity', 'deal')]),
+}
+
+
+class APIError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+    def response(self):
+        return JsonResponse({'error': str(self), **self.extra}, status=self.status)
+
+
+def max_limit():
+    return getattr(settings, 'CRM_API_MAX_LIMIT', 200)
+
+
+def batch_limit():
+    return getattr(settings, 'CRM_API_BATCH_LIMIT', 500)
+
+
+def api_view(view):
+    # Session authentication with JSON errors instead of login redirects.
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required'}, status=401)
+        try:
+            return view(request, *args, **kwargs)
+        except APIError as exc:
+            return exc.response()
+    return wrapper
+
+
+def _summary_fields(model):
+    if model is User:
+        return USER_FIELDS
+    return RESOURCES[search.MODEL_ENTITIES[model]][1]
+
+
+def _field_names(model):
+    return [field.name for field in model._meta.concrete_fields]
+
+
+def _split(value):
+    return [part.strip() for part in (value or '').split(',') if part.strip()]
+
+
+def _relations(entity, include):
+    model, _, allowed, _ = RESOURCES[entity]
+    unknown = [name for name in include if name not in allowed]
+    if unknown:
+        raise APIError(f'Unknown include: {", ".join(unknown)}', allowed=allowed)
+    forward = [name for name in include if model._meta.get_field(name).many_to_one]
+    reverse = [name for name in include if name not in forward]
+    return forward, reverse
+
+
+def build_queryset(entity, fields=None, include=()):
+    # fields= maps to .only(); forward relations are joined with
+    # select_related and reverse ones loaded with one prefetch query each,
+    # both restricted to the related resource's summary fields.
+    model = RESOURCES[entity][0]
+    forward, reverse = _relations(entity, include)
+    queryset = model.objects.select_related(*forward)
+    if fields is not None:
+        only = ['id'] + fields + forward
+        for name in forward:
+            related = model._meta.get_field(name).related_model
+            only += [f'{name}__{field}' for field in _summary_fields(related)]
+        queryset = queryset.only(*dict.fromkeys(only))
+    for name in reverse:
+        rel = model._meta.get_field(name)
+        related = rel.related_model
+        queryset = queryset.prefetch_related(Prefetch(
+            name,
+            queryset=related.objects.only(*_summary_fields(related), rel.field.name).order_by('pk'),
+        ))
+    return queryset
+
+
+def _summary(obj):
+    if obj is None:
+        return None
+    return {name: getattr(obj, name) for name in _summary_fields(type(obj))}
+
+
+def serialize(obj, fields, include=()):
+    data = {}
+    for name in fields:
+        field = obj._meta.get_field(name)
+        data[name] = getattr(obj, field.attname)
+    for name in include:
+        value = getattr(obj, name)
+        if obj._meta.get_field(name).many_to_one:
+            data[name] = _summary(value)
+        else:
+            data[name] = [_summary(related) for related in value.all()]
+    return data
+
+
+def _projection(entity, request):
+    model = RESOURCES[entity][0]
+    allowed = _field_names(model)
+    fields = _split(request.GET.get('fields'))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise APIError(f'Unknown fields: {", ".join(unknown)}', allowed=allowed)
+    include = _split(request.GET.get('include'))
+    return (fields or None), include, (['id'] + [f for f in fields if f != 'id'] if fields else allowed)
+
+
+@api_view
+@require_GET
+def resource_list(request, entity):
+    fields, include, output = _projection(entity, request)
+    queryset = build_queryset(entity, fields, include)
+    search_query = request.GET.get('search')
+    if search_query:
+        queryset = queryset.filter(pk__in=search.matching(entity, search_query))
+    try:
+        for param in RESOURCES[entity][3]:
+            if request.GET.get(param):
+                queryset = queryset.filter(**{param: request.GET[param]})
+    except (ValueError, ValidationError):
+        raise APIError(f'Invalid value for {param}')
+    try:
+        limit = min(int(request.GET.get('limit', DEFAULT_LIMIT)), max_limit())
+    except ValueError:
+        raise APIError('limit must be an integer')
+    page = CursorPaginator(queryset, ['id'], max(limit, 1)).get_page(request.GET.get('cursor'))
+    return JsonResponse({
+        'results': [serialize(obj, output, include) for obj in page],
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    })
+
+
+@api_view
+@require_GET
+def resource_detail(request, entity, pk):
+    fields, include, output = _projection(entity, request)
+    obj = build_queryset(entity, fields, include).filter(pk=pk).first()
+    if obj is None:
+        raise APIError('Not found', status=404)
+    return JsonResponse(serialize(obj, output, include))
+
+
+# Batch writes
+def _load_rows(request):
+    try:
+        rows = json.loads(request.body)
+    except ValueError:
+        raise APIError('Request body must be JSON')
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise APIError('Request body must be a JSON array of objects')
+    if len(rows) > batch_limit():
+        raise APIError(f'At most {batch_limit()} objects per batch')
+    return rows
+
+
+def _writable_fields(model):
+    return {
+        field.name: field for field in model._meta.concrete_fields
+        if field.editable and not field.primary_key
+    }
+
+
+def _apply(instance, row, writable, errors):
+    for name, value in row.items():
+        if name == 'id':
+            continue
+        if name not in writable:
+            errors[name] = ['Unknown or read-only field.']
+            continue
+        setattr(instance, writable[name].attname, value)
+
+
+def _validate(model, instances, writable, errors):
+    # full_clean() would run one query per foreign key and unique field per
+    # object, so those checks are done once for the whole batch instead.
+    relations = [field for field in writable.values() if field.is_relation]
+    for index, instance in instances:
+        try:
+            instance.full_clean(exclude=[field.name for field in relations], validate_unique=False)
+        except ValidationError as exc:
+            errors[index].update(exc.message_dict)
+        for field in relations:
+            try:
+                value = field.target_field.to_python(getattr(instance, field.attname))
+            except ValidationError as exc:
+                errors[index][field.name] = exc.messages
+            else:
+                setattr(instance, field.attname, value)
+    instances = [(index, instance) for index, instance in instances if not errors[index]]
+
+    for field in relations:
+        values = {getattr(instance, field.attname) for _, instance in instances} - {None}
+        existing = set(field.related_model.objects.filter(pk__in=values).values_list('pk', flat=True))
+        for index, instance in instances:
+            value = getattr(instance, field.attname)
+            if value is None:
+                if not field.null:
+                    errors[index][field.name] = ['This field is required.']
+            elif value not in existing:
+                errors[index][field.name] = [f'{field.related_model.__name__} {value} does not exist.']
+
+    for field in writable.values():
+        if not field.unique:
+            continue
+        values = [getattr(instance, field.attname) for _, instance in instances]
+        taken = dict(model.objects.filter(**{f'{field.name}__in': values}).values_list(field.name, 'pk'))
+        seen = set()
+        for index, instance in instances:
+            value = getattr(instance, field.attname)
+            if value in seen or taken.get(value, instance.pk) != instance.pk:
+                errors[index][field.name] = [f'{model._meta.verbose_name.capitalize()} with this '
+                                             f'{field.verbose_name} already exists.']
+            seen.add(value)
+
+
+def stats_totals(entity, instances):
+    # This batch's contribution to DashboardStats, mirroring crm.signals.
+    if entity == 'company':
+        return {'total_companies': len(instances)}
+    if entity == 'contact':
+        return {'total_contacts': len(instances)}
+    if entity == 'lead':
+        return {
+            'total_leads': len(instances),
+            'converted_leads': sum(lead.status == 'converted' for lead in instances),
+        }
+    if entity == 'deal':
+        return {
+            'total_deals': len(instances),
+            'won_deals': sum(deal.stage == 'closed_won' for deal in instances),
+            'total_deal_value': sum((deal.amount or 0 for deal in instances), 0),
+        }
+    return {}
+
+
+def _after_write(entity, pks, stats_deltas, changed=()):
+    # bulk_create()/bulk_update() skip model signals, so do their work here.
+    search.index_objects(entity, pks)
+    dedupe.index_objects(entity, pks)
+    fields, dependents = DEPENDENT_DOCUMENTS.get(entity, ([], []))
+    if set(fields) & set(changed):
+        for dependent, foreign_key in dependents:
+            model = search.ENTITIES[dependent][0]
+            search.index_queryset(dependent, model.objects.filter(**{f'{foreign_key}__in': pks}))
+    DashboardStats.adjust(**stats_deltas)
+    cache.bump(entity)
+
+
+def _errors_response(errors):
+    return JsonResponse({
+        'errors': [{'index': index, 'errors': e} for index, e in enumerate(errors) if e],
+    }, status=400)
+
+
+def batch_create(entity, rows):
+    model = RESOURCES[entity][0]
+    writable = _writable_fields(model)
+    errors = [{} for _ in rows]
+    instances = []
+    for index, row in enumerate(rows):
+        instance = model()
+        _apply(instance, row, writable, errors[index])
+        instances.append((index, instance))
+    _validate(model, instances, writable, errors)
+    if any(errors):
+        return _errors_response(errors)
+
+    objects = [instance for _, instance in instances]
+    with transaction.atomic():
+        created = model.objects.bulk_create(objects)
+        if entity == 'deal':
+            stages.record_created(created)
+    _after_write(entity, [obj.pk for obj in created], stats_totals(entity, created))
+    return JsonResponse({'created': [obj.pk for obj in created]}, status=201)
+
+
+def batch_update(entity, rows):
+    model = RESOURCES[entity][0]
+    writable = _writable_fields(model)
+    errors = [{} for _ in rows]
+    existing = model.objects.in_bulk([row['id'] for row in rows if isinstance(row.get('id'), int)])
+    before = stats_totals(entity, list(existing.values()))
+    old_stages = {pk: obj.stage for pk, obj in existing.items()} if entity == 'deal' else {}
+    instances, changed, seen = [], set(), set()
+    for index, row in enumerate(rows):
+        instance = existing.get(row.get('id'))
+        if instance is None or row['id'] in seen:
+            errors[index]['id'] = ['Missing, unknown or repeated id.']
+            continue
+        seen.add(row['id'])
+        _apply(instance, row, writable, errors[index])
+        changed.update(name for name in row if name in writable)
+        instances.append((index, instance))
+    _validate(model, instances, writable, errors)
+    if any(errors):
+        return _errors_response(errors)
+
+    objects = [instance for _, instance in instances]
+    if changed:
+        now = timezone.now()
+        for obj in objects:
+            obj.updated_at = now
+        with transaction.atomic():
+            model.objects.bulk_update(objects, sorted(changed) + ['updated_at'])
+            if old_stages:
+                stages.record_moves(
+                    [(obj.pk, old_stages[obj.pk], obj.stage, obj.assigned_to_id) for obj in objects], now,
+                )
+    after = stats_totals(entity, objects)
+    deltas = {key: after[key] - before[key] for key in after}
+    _after_write(entity, [obj.pk for obj in objects], deltas, changed)
+    return JsonResponse({'updated': [obj.pk for obj in objects]})
+
+
+@api_view
+@require_http_methods(['POST', 'PATCH'])
+def resource_batch(request, entity):
+    rows = _load_rows(request)
+    if request.method == 'POST':
+        return batch_create(entity, rows)
+    return batch_update(entity, rows)
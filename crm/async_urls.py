@@ -0,0 +1,26 @@
+from django.urls import path
+
+from . import async_views
+from .urls import urlpatterns as sync_urlpatterns
+
+# crm.urls with the read-only views swapped for their async variants; the
+# project URLconf uses this when CRM_ASYNC_VIEWS is set (the ASGI default).
+ASYNC_VIEWS = {
+    'dashboard': async_views.dashboard,
+    'company_list': async_views.company_list,
+    'company_detail': async_views.company_detail,
+    'contact_list': async_views.contact_list,
+    'contact_detail': async_views.contact_detail,
+    'lead_list': async_views.lead_list,
+    'lead_detail': async_views.lead_detail,
+    'deal_list': async_views.deal_list,
+    'deal_detail': async_views.deal_detail,
+    'activity_list': async_views.activity_list,
+    'activity_detail': async_views.activity_detail,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], pattern.default_args, name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
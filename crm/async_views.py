@@ -0,0 +1,209 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.http import Http404
+from django.shortcuts import render
+from django.utils import timezone
+
+from . import bulk, conversion, search
+from .forms import LeadConversionForm
+from .models import Company, Contact, Lead, Deal, Activity, DashboardStats
+from .conditional import conditional_page
+from .pagination import apaginate
+
+# Async variants of the read-only views, served by crm.async_urls under ASGI.
+# Every query is awaited before rendering, and queries that don't depend on
+# each other are issued together with asyncio.gather.
+
+
+async def _list(queryset):
+    return [obj async for obj in queryset]
+
+
+async def _get(queryset, pk):
+    return await queryset.filter(pk=pk).afirst()
+
+
+def _found(obj):
+    if obj is None:
+        raise Http404('No matching object found.')
+    return obj
+
+
+async def _render(request, template_name, context):
+    # Template rendering is synchronous and may still touch the session.
+    return await sync_to_async(render)(request, template_name, context)
+
+
+async def _bulk_context(entity):
+    assignees = await _list(User.objects.filter(is_active=True).order_by('username').only('username'))
+    return {'bulk_actions': bulk.ACTIONS[entity][1], 'assignees': assignees}
+
+
+async def _filter_search(request, queryset, **filters):
+    # Applies the list's own filters, then ranks the remaining rows.
+    filters = {field: request.GET[param] for field, param in filters.items() if request.GET.get(param)}
+    if filters:
+        queryset = queryset.filter(**filters)
+    search_query = request.GET.get('search')
+    if search_query:
+        return await sync_to_async(search.filter_queryset)(queryset, search_query)
+    return queryset, False
+
+
+@login_required
+@conditional_page('company', 'contact', 'lead', 'deal', 'activity', max_age=60)
+async def dashboard(request):
+    stats, recent_activities, upcoming_activities = await asyncio.gather(
+        DashboardStats.aload(),
+        _list(Activity.objects.select_related('contact', 'deal').order_by('-created_at')[:5]),
+        _list(Activity.objects.filter(
+            due_date__gte=timezone.now(),
+            status='planned'
+        ).select_related('contact', 'deal').order_by('due_date')[:5]),
+    )
+    return await _render(request, 'crm/dashboard.html', {
+        'stats': stats,
+        'recent_activities': recent_activities,
+        'upcoming_activities': upcoming_activities,
+    })
+
+
+# Company Views
+@login_required
+@conditional_page('company', 'contact', 'deal')
+async def company_list(request):
+    companies, search_capped = await _filter_search(request, Company.objects.with_totals().order_by('name', 'id'))
+    companies = await apaginate(request, companies, ['name', 'id'])
+    return await _render(request, 'crm/company_list.html', {'companies': companies, 'search_capped': search_capped})
+
+
+@login_required
+@conditional_page('company', 'contact', 'deal')
+async def company_detail(request, pk):
+    company, contacts, deals = await asyncio.gather(
+        _get(Company.objects.with_totals(), pk),
+        _list(Contact.objects.filter(company_id=pk).select_related('assigned_to').order_by('last_name', 'first_name')),
+        _list(Deal.objects.filter(company_id=pk).select_related('contact').order_by('-created_at')),
+    )
+    company = _found(company)
+    for obj in contacts + deals:
+        obj.company = company
+    return await _render(request, 'crm/company_detail.html', {
+        'company': company,
+        'contacts': contacts,
+        'deals': deals
+    })
+
+
+# Contact Views
+@login_required
+@conditional_page('contact', 'company')
+async def contact_list(request):
+    contacts = Contact.objects.select_related('company', 'assigned_to').order_by('last_name', 'id')
+    contacts, search_capped = await _filter_search(request, contacts)
+    contacts = await apaginate(request, contacts, ['last_name', 'id'])
+    return await _render(request, 'crm/contact_list.html', {'contacts': contacts, 'search_capped': search_capped})
+
+
+@login_required
+@conditional_page('contact', 'company', 'deal', 'activity')
+async def contact_detail(request, pk):
+    contact, activities, deals = await asyncio.gather(
+        _get(Contact.objects.select_related('company', 'assigned_to'), pk),
+        _list(Activity.objects.filter(contact_id=pk).select_related('deal').order_by('-created_at')),
+        _list(Deal.objects.filter(contact_id=pk).order_by('-created_at')),
+    )
+    contact = _found(contact)
+    for obj in activities + deals:
+        obj.contact = contact
+    return await _render(request, 'crm/contact_detail.html', {
+        'contact': contact,
+        'activities': activities,
+        'deals': deals
+    })
+
+
+# Lead Views
+@login_required
+@conditional_page('lead')
+async def lead_list(request):
+    leads, search_capped = await _filter_search(request, Lead.objects.order_by('-created_at', '-id'), status='status')
+    leads, bulk_context = await asyncio.gather(
+        apaginate(request, leads, ['-created_at', '-id']),
+        _bulk_context('lead'),
+    )
+    return await _render(request, 'crm/lead_list.html', {
+        'leads': leads,
+        'search_capped': search_capped,
+        'status_choices': Lead.STATUS_CHOICES,
+        **bulk_context,
+    })
+
+
+@login_required
+@conditional_page('lead', 'contact', 'deal')
+async def lead_detail(request, pk):
+    lead = _found(await _get(Lead.objects.select_related('assigned_to', 'converted_contact', 'converted_deal'), pk))
+    return await _render(request, 'crm/lead_detail.html', {
+        'lead': lead,
+        'conversion_form': LeadConversionForm() if conversion.skip_reason(lead) is None else None,
+    })
+
+
+# Deal Views
+@login_required
+@conditional_page('deal', 'company', 'contact')
+async def deal_list(request):
+    deals = Deal.objects.select_related('company', 'contact').order_by('-created_at', '-id')
+    deals, search_capped = await _filter_search(request, deals, stage='stage')
+    deals, bulk_context = await asyncio.gather(
+        apaginate(request, deals, ['-created_at', '-id']),
+        _bulk_context('deal'),
+    )
+    return await _render(request, 'crm/deal_list.html', {
+        'deals': deals,
+        'search_capped': search_capped,
+        'stage_choices': Deal.STAGE_CHOICES,
+        **bulk_context,
+    })
+
+
+@login_required
+@conditional_page('deal', 'company', 'contact', 'activity')
+async def deal_detail(request, pk):
+    deal, activities = await asyncio.gather(
+        _get(Deal.objects.select_related('company', 'contact', 'assigned_to'), pk),
+        _list(Activity.objects.filter(deal_id=pk).select_related('contact').order_by('-created_at')),
+    )
+    deal = _found(deal)
+    for activity in activities:
+        activity.deal = deal
+    return await _render(request, 'crm/deal_detail.html', {'deal': deal, 'activities': activities})
+
+
+# Activity Views
+@login_required
+@conditional_page('activity', 'contact', 'deal')
+async def activity_list(request):
+    activities = Activity.objects.select_related('contact', 'deal').order_by('-due_date', '-id')
+    activities, search_capped = await _filter_search(request, activities, status='status')
+    activities, bulk_context = await asyncio.gather(
+        apaginate(request, activities, ['-due_date', '-id']),
+        _bulk_context('activity'),
+    )
+    return await _render(request, 'crm/activity_list.html', {
+        'activities': activities,
+        'search_capped': search_capped,
+        'status_choices': Activity.STATUS_CHOICES,
+        **bulk_context,
+    })
+
+
+@login_required
+@conditional_page('activity', 'contact', 'deal')
+async def activity_detail(request, pk):
+    activity = _found(await _get(Activity.objects.select_related('contact', 'deal', 'assigned_to'), pk))
+    return await _render(request, 'crm/activity_detail.html', {'activity': activity})
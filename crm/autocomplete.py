@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .models import Company, Contact, Deal
+
+# entity -> (model, fields matched by prefix, related objects the label needs).
+# Each field has an index on LOWER(field) (see the models' Meta.indexes), and
+# results are ordered by the first one.
+SOURCES = {
+    'company': (Company, ['name'], []),
+    'contact': (Contact, ['last_name', 'first_name', 'email'], []),
+    'deal': (Deal, ['title'], ['company']),
+}
+
+
+def page_size():
+    return getattr(settings, 'CRM_AUTOCOMPLETE_PAGE_SIZE', 20)
+
+
+def max_page_size():
+    return getattr(settings, 'CRM_AUTOCOMPLETE_MAX_PAGE_SIZE', 50)
+
+
+def prefix_filter(fields, term):
+    # LOWER(field) >= 'ab' AND LOWER(field) < 'ac' is a range scan on the
+    # expression index; LIKE 'ab%' would only use it on a NOCASE column.
+    lower = term.lower()
+    upper = lower[:-1] + chr(ord(lower[-1]) + 1)
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}_lower__gte': lower, f'{field}_lower__lt': upper})
+    return condition
+
+
+def search(entity, term='', page=1, limit=None):
+    model, fields, related = SOURCES[entity]
+    limit = min(limit or page_size(), max_page_size())
+    queryset = model.objects.annotate(**{f'{field}_lower': Lower(field) for field in fields})
+    term = term.strip()
+    if term:
+        queryset = queryset.filter(prefix_filter(fields, term))
+    queryset = queryset.select_related(*related).order_by(f'{fields[0]}_lower', 'id')
+    offset = (page - 1) * limit
+    # One extra row tells whether there is a next page without a COUNT.
+    rows = list(queryset[offset:offset + limit + 1])
+    return {
+        'results': [{'id': obj.pk, 'text': str(obj)} for obj in rows[:limit]],
+        'page': page,
+        'more': len(rows) > limit,
+    }
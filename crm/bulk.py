@@ -0,0 +1,91 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, conversion, stages
+from .models import Activity, Deal, Lead, DashboardStats
+
+# entity -> (model, {action: label})
+ACTIONS = {
+    'activity': (Activity, {'complete': 'Mark completed', 'status': 'Change status', 'reassign': 'Reassign'}),
+    'lead': (Lead, {'status': 'Change status', 'reassign': 'Reassign', 'convert': 'Convert to contact and deal'}),
+    'deal': (Deal, {'stage': 'Change stage', 'reassign': 'Reassign'}),
+}
+
+# Choice fields the dashboard counts rows for: (entity, field) -> (counter, value)
+COUNTED = {
+    ('lead', 'status'): ('converted_leads', 'converted'),
+    ('deal', 'stage'): ('won_deals', 'closed_won'),
+}
+
+
+def complete_activities(queryset):
+    now = timezone.now()
+    updated = queryset.exclude(status='completed').update(status='completed', completed_at=now, updated_at=now)
+    if updated:
+        cache.bump('activity')
+    return updated
+
+
+def set_choice(entity, queryset, field, value):
+    model = ACTIONS[entity][0]
+    if value not in dict(model._meta.get_field(field).choices):
+        raise ValueError(f'Invalid {field} {value!r}')
+    if entity == 'activity' and value == 'completed':
+        return complete_activities(queryset)
+
+    changes = {field: value, 'updated_at': timezone.now()}
+    if entity == 'activity':
+        changes['completed_at'] = None
+    counter, counted_value = COUNTED.get((entity, field), (None, None))
+    with transaction.atomic():
+        # Rows already at the target value are left alone, so updated_at only
+        # moves on rows that really changed.
+        moving = queryset.exclude(**{field: value})
+        leaving = 0
+        if counter and value != counted_value:
+            leaving = moving.filter(**{field: counted_value}).count()
+        moves = []
+        if (entity, field) == ('deal', 'stage'):
+            moves = [(pk, stage, value, owner)
+                     for pk, stage, owner in moving.values_list('pk', 'stage', 'assigned_to_id')]
+        updated = moving.update(**changes)
+        if counter:
+            DashboardStats.adjust(**{counter: updated if value == counted_value else -leaving})
+        stages.record_moves(moves, changes['updated_at'])
+    if updated:
+        cache.bump(entity)
+    return updated
+
+
+def assignee(value):
+    # The id of the active user a reassign action names.
+    if not str(value or '').isdigit():
+        raise ValueError('Choose a user to assign to')
+    if not User.objects.filter(pk=int(value), is_active=True).exists():
+        raise ValueError('Unknown user')
+    return int(value)
+
+
+def reassign(entity, queryset, user_id):
+    # assigned_to isn't part of any search document or dashboard total, so
+    # only the fragment cache needs invalidating.
+    updated = queryset.exclude(assigned_to_id=user_id).update(assigned_to_id=user_id, updated_at=timezone.now())
+    if updated:
+        cache.bump(entity)
+    return updated
+
+
+def apply(entity, action, queryset, value=None):
+    # Runs one bulk action as a single UPDATE. Model signals don't fire for
+    # QuerySet.update(), so the dashboard counters, deal stage history and
+    # cache versions they would have maintained are updated here.
+    if action not in ACTIONS[entity][1]:
+        raise ValueError(f'Unknown action {action!r}')
+    if action == 'complete':
+        return complete_activities(queryset)
+    if action == 'convert':
+        return conversion.convert_leads(queryset).converted
+    if action == 'reassign':
+        return reassign(entity, queryset, assignee(value))
+    return set_choice(entity, queryset, action, value)
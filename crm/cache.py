@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+VERSION_KEY = 'crm:version:%s'
+MODIFIED_KEY = 'crm:modified:%s'
+FRAGMENT_KEY = 'crm:fragment:%s:u%s:%s:%s'
+
+_counters = {'hits': 0, 'misses': 0}
+_counters_lock = threading.Lock()
+
+
+def fragment_cache():
+    return caches[getattr(settings, 'CRM_FRAGMENT_CACHE', 'default')]
+
+
+def default_timeout():
+    return getattr(settings, 'CRM_FRAGMENT_CACHE_TIMEOUT', 300)
+
+
+def _initial_version():
+    # Seeded from the clock so a cache that lost its counters never hands
+    # out a version that older, still-cached fragments were stored under.
+    return int(time.time() * 1000)
+
+
+def entity_versions(entities):
+    cache = fragment_cache()
+    keys = {entity: VERSION_KEY % entity for entity in entities}
+    found = cache.get_many(keys.values())
+    versions = {}
+    for entity, key in keys.items():
+        if key not in found:
+            cache.add(key, _initial_version(), None)
+            # Unknown history counts as changed now.
+            cache.add(MODIFIED_KEY % entity, time.time(), None)
+            found[key] = cache.get(key)
+        versions[entity] = found[key]
+    return versions
+
+
+def entity_modified(entities):
+    # When any of the entities last changed, as a Unix timestamp, or None
+    # if one of them hasn't changed since the cache was emptied.
+    keys = [MODIFIED_KEY % entity for entity in entities]
+    found = fragment_cache().get_many(keys)
+    if len(found) < len(keys):
+        return None
+    return max(found.values())
+
+
+def bump(*entities):
+    # Invalidates every fragment that depends on these entities.
+    cache = fragment_cache()
+    for entity in entities:
+        try:
+            cache.incr(VERSION_KEY % entity)
+        except ValueError:
+            cache.set(VERSION_KEY % entity, _initial_version(), None)
+    cache.set_many({MODIFIED_KEY % entity: time.time() for entity in entities}, None)
+
+
+def fragment_key(name, user_id, entities, vary=''):
+    versions = entity_versions(entities)
+    version = '.'.join(f'{entity}{versions[entity]}' for entity in sorted(entities))
+    vary_hash = hashlib.md5(str(vary).encode(), usedforsecurity=False).hexdigest() if vary else ''
+    return FRAGMENT_KEY % (name, user_id or 0, version, vary_hash)
+
+
+def _count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+def get_or_render(name, user_id, entities, render, vary='', timeout=None):
+    cache = fragment_cache()
+    key = fragment_key(name, user_id, entities, vary)
+    content = cache.get(key)
+    if content is not None:
+        _count('hits')
+        return content
+    _count('misses')
+    content = render()
+    cache.set(key, content, default_timeout() if timeout is None else timeout)
+    return content
+
+
+def stats():
+    with _counters_lock:
+        hits, misses = _counters['hits'], _counters['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
+
+
+def reset_stats():
+    with _counters_lock:
+        _counters['hits'] = _counters['misses'] = 0
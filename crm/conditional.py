@@ -0,0 +1,110 @@
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import cache, routers
+
+
+# These keep the versions in each process, so a write in another worker, the
+# job worker or an import never reaches them.
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def enabled():
+    # On by default only when the fragment cache is shared between processes.
+    setting = getattr(settings, 'CRM_CONDITIONAL_GET', None)
+    if setting is not None:
+        return bool(setting)
+    alias = getattr(settings, 'CRM_FRAGMENT_CACHE', 'default')
+    return settings.CACHES.get(alias, {}).get('BACKEND') not in PROCESS_LOCAL_BACKENDS
+
+
+def validators(request, entities, max_age=None):
+    # (ETag, Last-Modified timestamp) for a page showing these entities, or
+    # (None, None) when the response mustn't be revalidated. The ETag comes
+    # from the fragment cache's per-entity versions, which every write bumps
+    # (signals for ORM saves, explicit cache.bump() calls for bulk writes),
+    # so a new Activity on a Deal changes every page that lists activities.
+    if not enabled() or request.method not in ('GET', 'HEAD'):
+        return None, None
+    if routers.reading_from_replica() or len(messages.get_messages(request)):
+        # A replica may lag the versions, and flash messages are shown once.
+        return None, None
+    versions = cache.entity_versions(entities)
+    if None in versions.values():
+        # No cache to keep versions in (DummyCache), so no way to tell.
+        return None, None
+    # The page also embeds the user and their CSRF token; the 'user' entity
+    # is bumped on every login.
+    parts = [
+        request.get_full_path(),
+        str(request.user.pk),
+        request.META.get('CSRF_COOKIE', ''),
+        getattr(settings, 'CRM_ETAG_SALT', ''),
+        *(f'{entity}{versions[entity]}' for entity in sorted(versions)),
+    ]
+    last_modified = cache.entity_modified(entities)
+    if max_age:
+        # Pages that also depend on the clock change every max_age seconds,
+        # which a modification time can't express.
+        parts.append(str(int(time.time() // max_age)))
+        last_modified = None
+    digest = hashlib.md5('|'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'W/"{digest}"', last_modified
+
+
+def _not_modified(request, etag, last_modified):
+    return get_conditional_response(request, etag=etag, last_modified=last_modified and int(last_modified))
+
+
+def _add_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+        # Browsers must ask every time rather than reuse the page unchecked.
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def conditional_page(*entities, max_age=None):
+    """
+    Answers GETs with 304 Not Modified, without running the view, while
+    none of the entities the page shows have changed::
+
+        @login_required
+        @conditional_page('deal', 'company', 'contact', 'activity')
+        def deal_detail(request, pk):
+            ...
+    """
+    entities = sorted({*entities, 'user'})
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def inner(request, *args, **kwargs):
+                etag, last_modified = await sync_to_async(validators)(request, entities, max_age)
+                if etag is None:
+                    return await view(request, *args, **kwargs)
+                response = _not_modified(request, etag, last_modified) or await view(request, *args, **kwargs)
+                return _add_validators(response, etag, last_modified)
+            return inner
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            etag, last_modified = validators(request, entities, max_age)
+            if etag is None:
+                return view(request, *args, **kwargs)
+            response = _not_modified(request, etag, last_modified) or view(request, *args, **kwargs)
+            return _add_validators(response, etag, last_modified)
+        return inner
+    return decorator
@@ -0,0 +1,189 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from . import cache, dedupe, search, stages
+from .models import Company, Contact, Deal, Lead, DashboardStats
+
+CLOSE_DAYS = 30
+LOOKUP_BATCH_SIZE = 500
+WRITE_BATCH_SIZE = 1000
+
+
+class ConversionResult:
+    def __init__(self):
+        self.converted = 0
+        self.companies_created = 0
+        self.contacts_created = 0
+        self.contacts_matched = 0
+        self.deals_created = 0
+        self.skipped = {}
+
+    def __str__(self):
+        return (f'{self.converted} converted: {self.companies_created} companies and '
+                f'{self.contacts_created} contacts created, {self.contacts_matched} contacts matched, '
+                f'{self.deals_created} deals created, {len(self.skipped)} skipped')
+
+
+def _key(value):
+    return (value or '').strip().lower()
+
+
+def skip_reason(lead):
+    if lead.status == 'converted':
+        return 'Lead is already converted'
+    if lead.status == 'closed_lost':
+        return 'Lead is closed'
+    if not _key(lead.company_name):
+        return 'Lead has no company name'
+    return None
+
+
+def default_close_date():
+    return timezone.localdate() + timedelta(days=CLOSE_DAYS)
+
+
+def build_contact(lead, company_id):
+    return Contact(
+        first_name=lead.first_name,
+        last_name=lead.last_name,
+        email=_key(lead.email),
+        phone=lead.phone,
+        job_title=lead.job_title,
+        company_id=company_id,
+        assigned_to_id=lead.assigned_to_id,
+        notes=lead.notes,
+    )
+
+
+def build_deal(lead, contact_id, company_id, amount, close_date):
+    return Deal(
+        title=f'{lead.first_name} {lead.last_name} opportunity',
+        contact_id=contact_id,
+        company_id=company_id,
+        amount=Decimal(amount),
+        expected_close_date=close_date,
+        assigned_to_id=lead.assigned_to_id,
+        description=lead.notes,
+    )
+
+
+def lookup(model, field, keys):
+    # {LOWER(field): pk} for the given lowercased keys, answered from the
+    # LOWER() indexes. The oldest row wins when several share a value.
+    found = {}
+    keys = sorted(keys)
+    for start in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        found.update(
+            model.objects.annotate(key=Lower(field))
+            .filter(key__in=keys[start:start + LOOKUP_BATCH_SIZE])
+            .order_by('-pk')
+            .values_list('key', 'pk')
+        )
+    return found
+
+
+def convert(lead, create_deal=True, amount=0, close_date=None):
+    # Converts one lead through the ORM, so the model signals keep the
+    # dashboard, search index and fragment cache current.
+    with transaction.atomic():
+        lead = Lead.objects.select_for_update().get(pk=lead.pk)
+        reason = skip_reason(lead)
+        if reason:
+            raise ValueError(reason)
+        company_id = lookup(Company, 'name', [_key(lead.company_name)]).get(_key(lead.company_name))
+        if company_id is None:
+            company_id = Company.objects.create(name=lead.company_name.strip()).pk
+        contact_id = lookup(Contact, 'email', [_key(lead.email)]).get(_key(lead.email))
+        if contact_id is None:
+            contact = build_contact(lead, company_id)
+            contact.save()
+            contact_id = contact.pk
+        if create_deal:
+            deal = build_deal(lead, contact_id, company_id, amount, close_date or default_close_date())
+            deal.save()
+            lead.converted_deal = deal
+        lead.status = 'converted'
+        lead.converted_contact_id = contact_id
+        lead.save(update_fields=['status', 'converted_contact', 'converted_deal', 'updated_at'])
+    return lead
+
+
+def convert_leads(queryset, create_deal=True, amount=0, close_date=None):
+    # Converts many leads in one transaction: companies and contacts are
+    # matched against maps loaded up front, and everything missing is
+    # written with bulk_create(). Bulk writes skip the model signals, so their
+    # work is done here.
+    result = ConversionResult()
+    close_date = close_date or default_close_date()
+    with transaction.atomic():
+        leads = []
+        for lead in queryset.select_for_update().order_by('pk'):
+            reason = skip_reason(lead)
+            if reason:
+                result.skipped[lead.pk] = reason
+            else:
+                leads.append(lead)
+        if not leads:
+            return result
+
+        companies = lookup(Company, 'name', {_key(lead.company_name) for lead in leads})
+        new_companies = {}
+        for lead in leads:
+            key = _key(lead.company_name)
+            if key not in companies and key not in new_companies:
+                new_companies[key] = Company(name=lead.company_name.strip())
+        Company.objects.bulk_create(new_companies.values(), batch_size=WRITE_BATCH_SIZE)
+        companies.update((key, company.pk) for key, company in new_companies.items())
+
+        contacts = lookup(Contact, 'email', {_key(lead.email) for lead in leads})
+        new_contacts = {}
+        for lead in leads:
+            key = _key(lead.email)
+            if key in contacts:
+                result.contacts_matched += 1
+            elif key not in new_contacts:
+                new_contacts[key] = build_contact(lead, companies[_key(lead.company_name)])
+        Contact.objects.bulk_create(new_contacts.values(), batch_size=WRITE_BATCH_SIZE)
+        contacts.update((key, contact.pk) for key, contact in new_contacts.items())
+
+        deals = []
+        if create_deal:
+            deals = [
+                build_deal(lead, contacts[_key(lead.email)], companies[_key(lead.company_name)], amount, close_date)
+                for lead in leads
+            ]
+            Deal.objects.bulk_create(deals, batch_size=WRITE_BATCH_SIZE)
+            stages.record_created(deals)
+
+        now = timezone.now()
+        for index, lead in enumerate(leads):
+            lead.status = 'converted'
+            lead.converted_contact_id = contacts[_key(lead.email)]
+            lead.converted_deal_id = deals[index].pk if deals else None
+            lead.updated_at = now
+        Lead.objects.bulk_update(leads, ['status', 'converted_contact', 'converted_deal', 'updated_at'],
+                                 batch_size=WRITE_BATCH_SIZE)
+
+        DashboardStats.adjust(
+            total_companies=len(new_companies),
+            total_contacts=len(new_contacts),
+            total_deals=len(deals),
+            total_deal_value=sum((deal.amount for deal in deals), Decimal(0)),
+            converted_leads=len(leads),
+        )
+
+    result.converted = len(leads)
+    result.companies_created = len(new_companies)
+    result.contacts_created = len(new_contacts)
+    result.deals_created = len(deals)
+    search.index_objects('company', [company.pk for company in new_companies.values()])
+    search.index_objects('contact', [contact.pk for contact in new_contacts.values()])
+    search.index_objects('deal', [deal.pk for deal in deals])
+    dedupe.index_objects('company', [company.pk for company in new_companies.values()])
+    dedupe.index_objects('contact', [contact.pk for contact in new_contacts.values()])
+    cache.bump('company', 'contact', 'lead', 'deal')
+    return result
@@ -0,0 +1,119 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import OperationalError, connections
+
+from .models import Company, Contact, Lead, Deal, DashboardStats
+
+# Row counts for changelists and list pages. An exact COUNT(*) scans the
+# whole table (or its smallest index); for an unfiltered queryset the
+# maintained dashboard counters or the database's planner statistics
+# already hold the answer, and a filtered one only needs counting exactly
+# while it is small.
+
+EXACT = 'exact'
+ESTIMATE = 'estimate'
+# At least this many; the database can't estimate the rest.
+LOWER_BOUND = 'lower_bound'
+
+# Models with an exact, incrementally maintained total in DashboardStats.
+COUNTERS = {
+    Company: 'total_companies',
+    Contact: 'total_contacts',
+    Lead: 'total_leads',
+    Deal: 'total_deals',
+}
+
+
+def threshold():
+    # Filtered sets up to this size are counted exactly; larger counts are
+    # estimated and shown as "about N".
+    return getattr(settings, 'CRM_COUNT_ESTIMATE_THRESHOLD', 10000)
+
+
+def is_unfiltered(queryset):
+    query = queryset.query
+    return (not query.where and not query.distinct and not query.combinator
+            and query.low_mark == 0 and query.high_mark is None)
+
+
+def table_estimate(model, using='default'):
+    # Rows in model's table according to the planner statistics: reltuples
+    # on PostgreSQL, sqlite_stat1 (written by ANALYZE or PRAGMA optimize) on
+    # SQLite. None when the table has never been analyzed.
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # One row per index, each starting with the rows it covers; the
+            # largest is the table (partial indexes cover fewer). A failed
+            # statement doesn't abort an SQLite transaction.
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s', [table])
+            except OperationalError:
+                return None
+            counts = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+            return max(counts) if counts else None
+    return None
+
+
+def plan_estimate(queryset):
+    # The planner's row estimate for a filtered query; PostgreSQL only, as
+    # SQLite's query plans carry no row counts.
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    try:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows'])
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def count_rows(queryset, probe_filtered=True):
+    # (count, kind), kind being EXACT, ESTIMATE or LOWER_BOUND.
+    limit = threshold()
+    if is_unfiltered(queryset):
+        field = COUNTERS.get(queryset.model)
+        # Read without DashboardStats.load(), which would write the row if
+        # it were missing.
+        total = field and (DashboardStats.objects.filter(pk=DashboardStats.SINGLETON_PK)
+                           .values_list(field, flat=True).first())
+        if total is not None:
+            return total, EXACT
+        estimate = table_estimate(queryset.model, queryset.db)
+        if estimate is not None and estimate > limit:
+            return estimate, ESTIMATE
+        return queryset.count(), EXACT
+    if not probe_filtered:
+        return queryset.count(), EXACT
+    # COUNT(*) over a LIMITed subquery stops after limit + 1 rows.
+    probe = queryset.order_by()[:limit + 1].count()
+    if probe <= limit:
+        return probe, EXACT
+    estimate = plan_estimate(queryset)
+    if estimate is not None:
+        return max(estimate, probe), ESTIMATE
+    return probe, LOWER_BOUND
+
+
+async def acount_rows(queryset, probe_filtered=True):
+    return await sync_to_async(count_rows)(queryset, probe_filtered)
+
+
+def estimated_count(queryset):
+    return count_rows(queryset)[0]
+
+
+def describe(count, kind):
+    # "1,234", "about 1,200,000" or "more than 10,000".
+    if kind == LOWER_BOUND:
+        return f'more than {count - 1:,}'
+    if kind == ESTIMATE:
+        digits = len(str(count))
+        return f'about {round(count, 2 - digits) if digits > 2 else count:,}'
+    return f'{count:,}'
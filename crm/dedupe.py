@@ -0,0 +1,315 @@
+import heapq
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from itertools import combinations, groupby
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import cache, search
+from .models import Company, Contact, Lead, Deal, BlockingKey
+
+INDEX_BATCH_SIZE = 500
+REPORT_LIMIT = 100
+
+# Webmail domains say nothing about who someone works for, and would make
+# blocks of every contact using them.
+FREE_MAIL_DOMAINS = {
+    'aol.com', 'gmail.com', 'gmx.com', 'hotmail.com', 'icloud.com', 'live.com', 'mail.com', 'me.com',
+    'msn.com', 'outlook.com', 'proton.me', 'protonmail.com', 'yahoo.com', 'yandex.com',
+}
+COMPANY_SUFFIXES = {
+    'ag', 'bv', 'co', 'company', 'corp', 'corporation', 'gmbh', 'inc', 'incorporated', 'limited', 'llc',
+    'ltd', 'plc', 'sa', 'the',
+}
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'),
+    'l': '4', **dict.fromkeys('mn', '5'), 'r': '6',
+}
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# entity -> (model, fields the keys and scores are computed from)
+ENTITIES = {
+    'company': (Company, ['name', 'website', 'email', 'phone']),
+    'contact': (Contact, ['first_name', 'last_name', 'email', 'phone', 'mobile']),
+    'lead': (Lead, ['first_name', 'last_name', 'email', 'phone']),
+}
+
+# Entities merge() accepts; deals have no blocking keys but can still be merged.
+MERGEABLE = {'company': Company, 'contact': Contact, 'lead': Lead, 'deal': Deal}
+
+
+def threshold():
+    return getattr(settings, 'CRM_DEDUPE_THRESHOLD', 0.8)
+
+
+def max_block_size():
+    return getattr(settings, 'CRM_DEDUPE_MAX_BLOCK_SIZE', 200)
+
+
+# Normalization
+def tokens(value):
+    value = unicodedata.normalize('NFKD', value or '').encode('ascii', 'ignore').decode()
+    return TOKEN_RE.findall(value.lower())
+
+
+def soundex(word):
+    if not word[0].isalpha():
+        return word
+    code = word[0].upper()
+    previous = SOUNDEX_CODES.get(word[0], '')
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, '')
+        if digit and digit != previous:
+            code += digit
+        if char not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+def normalize_email(email):
+    local, _, domain = (email or '').strip().lower().partition('@')
+    if not local or not domain:
+        return ''
+    local = local.split('+')[0]
+    if domain in ('gmail.com', 'googlemail.com'):
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return f'{local}@{domain}'
+
+
+def email_domain(email):
+    domain = normalize_email(email).partition('@')[2]
+    return '' if domain in FREE_MAIL_DOMAINS else domain
+
+
+def website_domain(url):
+    url = (url or '').strip().lower()
+    if not url:
+        return ''
+    host = urlsplit(url if '//' in url else f'//{url}').hostname or ''
+    return host[4:] if host.startswith('www.') else host
+
+
+def normalize_phone(phone):
+    # The last ten digits, so a leading country code or trunk 0 still match.
+    digits = re.sub(r'\D', '', phone or '')
+    return digits[-10:] if len(digits) >= 7 else ''
+
+
+def company_tokens(name):
+    return [token for token in tokens(name) if token not in COMPANY_SUFFIXES]
+
+
+def features(entity, row):
+    # The normalized values of one record (a values() dict) used for both
+    # blocking and scoring.
+    if entity == 'company':
+        name = company_tokens(row['name'])
+        return {
+            'name': ' '.join(name),
+            'name_key': ' '.join(soundex(token) for token in name[:2]),
+            'email': '',
+            'domain': website_domain(row['website']) or email_domain(row['email']),
+            'phone': normalize_phone(row['phone']),
+        }
+    first, last = tokens(row['first_name']), tokens(row['last_name'])
+    return {
+        'name': ' '.join(first + last),
+        'name_key': f'{soundex(last[-1])}{first[0][0] if first else ""}' if last else '',
+        'email': normalize_email(row['email']),
+        'domain': email_domain(row['email']),
+        'phone': normalize_phone(row['phone'] or row.get('mobile')),
+    }
+
+
+def blocking_keys(entity, row):
+    found = features(entity, row)
+    keys = {'email': found['email'], 'domain': found['domain'], 'name': found['name_key'], 'phone': found['phone']}
+    return {kind: key[:255] for kind, key in keys.items() if key}
+
+
+# Indexing
+def _chunks(items, size=INDEX_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def index_objects(entity, pks):
+    if entity not in ENTITIES:
+        return
+    model, fields = ENTITIES[entity]
+    for chunk in _chunks(pks):
+        rows = model.objects.filter(pk__in=chunk).values('pk', *fields)
+        keys = [
+            BlockingKey(entity=entity, object_id=row['pk'], kind=kind, key=key)
+            for row in rows
+            for kind, key in blocking_keys(entity, row).items()
+        ]
+        with transaction.atomic():
+            BlockingKey.objects.filter(entity=entity, object_id__in=chunk).delete()
+            BlockingKey.objects.bulk_create(keys)
+
+
+def remove_objects(entity, pks):
+    if entity in ENTITIES:
+        BlockingKey.objects.filter(entity=entity, object_id__in=list(pks)).delete()
+
+
+def rebuild(entities=None):
+    counts = {}
+    for entity in entities or ENTITIES:
+        model = ENTITIES[entity][0]
+        BlockingKey.objects.filter(entity=entity).delete()
+        for chunk in _chunks(model.objects.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=5000)):
+            index_objects(entity, chunk)
+        counts[entity] = BlockingKey.objects.filter(entity=entity).values('object_id').distinct().count()
+    return counts
+
+
+# Scoring
+def similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def score(entity, a, b):
+    # Returns (score between 0 and 1, the evidence behind it). A matching
+    # name alone is weak for people, who often share names; a shared email,
+    # phone or company domain backs it up.
+    name = similarity(a['name'], b['name'])
+    best = name * (0.9 if entity == 'company' else 0.75)
+    reasons = ['name'] if name >= 0.8 else []
+    if a['email'] and a['email'] == b['email']:
+        best = 1.0
+        reasons.append('email')
+    if a['phone'] and a['phone'] == b['phone']:
+        best = max(best, 0.5 + 0.5 * name)
+        reasons.append('phone')
+    if a['domain'] and a['domain'] == b['domain']:
+        # Colleagues share a domain too, so people also need similar names.
+        if entity == 'company' or name >= 0.8:
+            best = max(best, 0.6 + 0.4 * name)
+        reasons.append('domain')
+    return round(best, 3), reasons
+
+
+def candidate_blocks(entity):
+    # Streams the blocking keys in index order, so each block arrives as a
+    # run of rows, and yields the ids in each block. Oversized blocks (a very
+    # common surname, a big company's domain) are skipped: they'd cost O(n^2)
+    # and rarely hold duplicates that no other key catches.
+    rows = (BlockingKey.objects.filter(entity=entity).order_by('kind', 'key')
+            .values_list('kind', 'key', 'object_id').iterator(chunk_size=5000))
+    for _, block in groupby(rows, key=lambda row: row[:2]):
+        ids = sorted({object_id for _, _, object_id in block})
+        if 1 < len(ids) <= max_block_size():
+            yield ids
+
+
+def _block_batches(blocks, size=INDEX_BATCH_SIZE):
+    # Groups blocks until they cover `size` records, so their features load
+    # in one query.
+    batch, ids = [], set()
+    for block in blocks:
+        batch.append(block)
+        ids.update(block)
+        if len(ids) >= size:
+            yield batch, ids
+            batch, ids = [], set()
+    if batch:
+        yield batch, ids
+
+
+def scored_pairs(entity, min_score):
+    # Yields (score, (a, b), reasons) for the pairs in each block that score
+    # at least min_score. A pair sharing several keys is yielded once per
+    # block it is in.
+    model, fields = ENTITIES[entity]
+    for blocks, ids in _block_batches(candidate_blocks(entity)):
+        found = {row['pk']: features(entity, row) for row in model.objects.filter(pk__in=ids).values('pk', *fields)}
+        for block in blocks:
+            for a, b in combinations(block, 2):
+                if a in found and b in found:
+                    value, reasons = score(entity, found[a], found[b])
+                    if value >= min_score:
+                        yield value, (a, b), reasons
+
+
+def find_duplicates(entity, min_score=None, limit=None):
+    # Candidate pairs scored and sorted best first:
+    # [{'ids': (a, b), 'score': 0.93, 'reasons': ['email', 'name']}, ...]
+    # With a limit, only the best `limit` pairs are held (in a min-heap of
+    # the worst kept pair first) while the blocks stream past, so memory
+    # doesn't grow with the number of candidate pairs.
+    min_score = threshold() if min_score is None else min_score
+    kept, heap = {}, []
+    for value, ids, reasons in scored_pairs(entity, min_score):
+        if ids in kept:
+            continue
+        # Ranks by score, then by lower ids; a pair once evicted ranks below
+        # everything kept and can't come back.
+        rank = (value, (-ids[0], -ids[1]))
+        if limit and len(heap) >= limit:
+            if rank < heap[0][0]:
+                continue
+            _, evicted = heapq.heapreplace(heap, (rank, ids))
+            del kept[evicted]
+        elif limit:
+            heapq.heappush(heap, (rank, ids))
+        kept[ids] = (value, reasons)
+    results = [{'ids': ids, 'score': value, 'reasons': reasons} for ids, (value, reasons) in kept.items()]
+    results.sort(key=lambda result: (-result['score'], result['ids']))
+    return results
+
+
+# Merging
+def merge(entity, keep, duplicate_ids):
+    # Folds the duplicates into `keep`: every foreign key pointing at them is
+    # re-pointed with one UPDATE per relation, blank fields on `keep` are
+    # filled from the duplicates, and the duplicates are deleted.
+    model = MERGEABLE[entity]
+    duplicate_ids = sorted({int(pk) for pk in duplicate_ids} - {keep.pk})
+    if not duplicate_ids:
+        raise ValueError('Choose at least one duplicate to merge')
+    moved = {}
+    with transaction.atomic():
+        duplicates = list(model.objects.select_for_update().filter(pk__in=duplicate_ids).order_by('pk'))
+        if len(duplicates) != len(duplicate_ids):
+            raise ValueError(f'Unknown {entity} in {duplicate_ids}')
+        now = timezone.now()
+        for relation in model._meta.related_objects:
+            if not relation.one_to_many:
+                continue
+            related, field = relation.related_model, relation.field.name
+            changes = {field: keep}
+            if any(f.name == 'updated_at' for f in related._meta.concrete_fields):
+                changes['updated_at'] = now
+            updated = related.objects.filter(**{f'{field}__in': duplicate_ids}).update(**changes)
+            if updated:
+                moved[f'{related._meta.model_name}.{field}'] = updated
+                related_entity = search.MODEL_ENTITIES.get(related)
+                if related_entity:
+                    search.index_queryset(related_entity, related.objects.filter(**{field: keep}))
+                    cache.bump(related_entity)
+
+        filled = []
+        for field in model._meta.concrete_fields:
+            if field.primary_key or field.unique or not field.editable:
+                continue
+            if getattr(keep, field.attname) in (None, ''):
+                value = next((getattr(d, field.attname) for d in duplicates
+                              if getattr(d, field.attname) not in (None, '')), None)
+                if value is not None:
+                    setattr(keep, field.attname, value)
+                    filled.append(field.name)
+        if filled:
+            keep.save(update_fields=filled + ['updated_at'])
+        # Deleted one by one through the ORM so the model signals update the
+        # dashboard, search index and blocking keys.
+        model.objects.filter(pk__in=duplicate_ids).delete()
+    return {'moved': moved, 'filled': filled, 'deleted': len(duplicates)}
@@ -0,0 +1,97 @@
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from . import search
+from .models import Company, Contact, Lead, Deal, Activity
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# entity -> (model, [(column, values_list path)], list-view filter params)
+# Column names line up with crm_import so exports can be re-imported.
+EXPORTS = {
+    'company': (Company, [
+        ('id', 'id'), ('name', 'name'), ('industry', 'industry'), ('website', 'website'),
+        ('phone', 'phone'), ('email', 'email'), ('address', 'address'), ('city', 'city'),
+        ('state', 'state'), ('country', 'country'), ('postal_code', 'postal_code'),
+        ('created_at', 'created_at'),
+    ], []),
+    'contact': (Contact, [
+        ('id', 'id'), ('first_name', 'first_name'), ('last_name', 'last_name'), ('email', 'email'),
+        ('phone', 'phone'), ('mobile', 'mobile'), ('job_title', 'job_title'),
+        ('company', 'company__name'), ('contact_type', 'contact_type'), ('city', 'city'),
+        ('country', 'country'), ('assigned_to', 'assigned_to__username'), ('created_at', 'created_at'),
+    ], []),
+    'lead': (Lead, [
+        ('id', 'id'), ('first_name', 'first_name'), ('last_name', 'last_name'), ('email', 'email'),
+        ('phone', 'phone'), ('company_name', 'company_name'), ('job_title', 'job_title'),
+        ('status', 'status'), ('source', 'source'), ('assigned_to', 'assigned_to__username'),
+        ('created_at', 'created_at'),
+    ], ['status']),
+    'deal': (Deal, [
+        ('id', 'id'), ('title', 'title'), ('company', 'company__name'), ('contact_email', 'contact__email'),
+        ('amount', 'amount'), ('stage', 'stage'), ('priority', 'priority'), ('probability', 'probability'),
+        ('expected_close_date', 'expected_close_date'), ('assigned_to', 'assigned_to__username'),
+        ('created_at', 'created_at'),
+    ], ['stage']),
+    'activity': (Activity, [
+        ('id', 'id'), ('title', 'title'), ('activity_type', 'activity_type'), ('status', 'status'),
+        ('contact_email', 'contact__email'), ('deal', 'deal__title'),
+        ('assigned_to', 'assigned_to__username'), ('due_date', 'due_date'),
+        ('completed_at', 'completed_at'), ('created_at', 'created_at'),
+    ], ['status']),
+}
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+class Echo:
+    # csv.writer target that hands each formatted line straight back.
+    def write(self, value):
+        return value
+
+
+def filtered_queryset(entity, params):
+    # The rows a list view shows for these search/status/stage params.
+    model, _, filter_params = EXPORTS[entity]
+    queryset = model.objects.all()
+    search_query = params.get('search')
+    if search_query:
+        queryset = queryset.filter(pk__in=search.matching(entity, search_query))
+    for param in filter_params:
+        if params.get(param):
+            queryset = queryset.filter(**{param: params[param]})
+    return queryset
+
+
+def export_queryset(entity, params):
+    columns = EXPORTS[entity][1]
+    return filtered_queryset(entity, params).order_by('pk').values_list(*[path for _, path in columns])
+
+
+def filename(entity, fmt):
+    model = EXPORTS[entity][0]
+    return f'{model._meta.verbose_name_plural.lower()}.{FORMATS[fmt][1]}'
+
+
+def stream_csv(entity, params, chunk_size=DEFAULT_CHUNK_SIZE):
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in EXPORTS[entity][1]])
+    for row in export_queryset(entity, params).iterator(chunk_size=chunk_size):
+        yield writer.writerow(row)
+
+
+def stream_jsonl(entity, params, chunk_size=DEFAULT_CHUNK_SIZE):
+    columns = [column for column, _ in EXPORTS[entity][1]]
+    encoder = DjangoJSONEncoder()
+    for row in export_queryset(entity, params).iterator(chunk_size=chunk_size):
+        yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+
+def stream(entity, params, fmt='csv', chunk_size=DEFAULT_CHUNK_SIZE):
+    if fmt == 'jsonl':
+        return stream_jsonl(entity, params, chunk_size)
+    return stream_csv(entity, params, chunk_size)
@@ -1,7 +1,32 @@
 from django import forms
 from django.contrib.auth.models import User
+from django.urls import reverse
 from .models import Company, Contact, Lead, Deal, Activity
 
+class AutocompleteSelect(forms.Select):
+    # Renders only the selected option instead of every row of the field's
+    # queryset; static/js/autocomplete.js fetches the rest from url_name as
+    # the user types. The field still validates the one submitted PK.
+    def __init__(self, url_name, attrs=None):
+        super().__init__(attrs)
+        self.url_name = url_name
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['attrs']['data-autocomplete-url'] = reverse(self.url_name)
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        field = self.choices.field
+        choices = [('', field.empty_label)] if field.empty_label is not None else []
+        selected = [pk for pk in value if pk.isdigit()]
+        if selected:
+            choices += [(obj.pk, field.label_from_instance(obj)) for obj in field.queryset.filter(pk__in=selected)]
+        return [
+            (None, [self.create_option(name, pk, label, str(pk) in value, index, attrs=attrs)], index)
+            for index, (pk, label) in enumerate(choices)
+        ]
+
 class CompanyForm(forms.ModelForm):
     class Meta:
         model = Company
@@ -31,7 +56,7 @@ class ContactForm(forms.ModelForm):
             'phone': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Phone Number'}),
             'mobile': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Mobile Number'}),
             'job_title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Job Title'}),
-            'company': forms.Select(attrs={'class': 'form-control'}),
+            'company': AutocompleteSelect('company_autocomplete', attrs={'class': 'form-control'}),
             'contact_type': forms.Select(attrs={'class': 'form-control'}),
             'address': forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Street Address'}),
             'city': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'City'}),
@@ -44,7 +69,6 @@ class ContactForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['company'].queryset = Company.objects.all().order_by('name')
         self.fields['assigned_to'].queryset = User.objects.filter(is_active=True).order_by('first_name', 'last_name')
         self.fields['assigned_to'].required = False
 
@@ -78,8 +102,8 @@ class DealForm(forms.ModelForm):
                  'expected_close_date', 'description', 'assigned_to']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Deal Title'}),
-            'contact': forms.Select(attrs={'class': 'form-control'}),
-            'company': forms.Select(attrs={'class': 'form-control'}),
+            'contact': AutocompleteSelect('contact_autocomplete', attrs={'class': 'form-control'}),
+            'company': AutocompleteSelect('company_autocomplete', attrs={'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': '0.00', 'step': '0.01'}),
             'stage': forms.Select(attrs={'class': 'form-control'}),
             'priority': forms.Select(attrs={'class': 'form-control'}),
@@ -91,8 +115,6 @@ class DealForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['contact'].queryset = Contact.objects.select_related('company').order_by('last_name', 'first_name')
-        self.fields['company'].queryset = Company.objects.all().order_by('name')
         self.fields['assigned_to'].queryset = User.objects.filter(is_active=True).order_by('first_name', 'last_name')
         self.fields['assigned_to'].required = False
 
@@ -105,14 +127,31 @@ class ActivityForm(forms.ModelForm):
             'activity_type': forms.Select(attrs={'class': 'form-control'}),
             'status': forms.Select(attrs={'class': 'form-control'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Activity description...'}),
-            'contact': forms.Select(attrs={'class': 'form-control'}),
-            'deal': forms.Select(attrs={'class': 'form-control'}),
+            'contact': AutocompleteSelect('contact_autocomplete', attrs={'class': 'form-control'}),
+            'deal': AutocompleteSelect('deal_autocomplete', attrs={'class': 'form-control'}),
             'due_date': forms.DateTimeInput(attrs={'class': 'form-control', 'type': 'datetime-local'}),
         }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['contact'].queryset = Contact.objects.select_related('company').order_by('last_name', 'first_name')
-        self.fields['deal'].queryset = Deal.objects.select_related('company').order_by('title')
+        self.fields['deal'].queryset = Deal.objects.select_related('company')
         self.fields['contact'].required = False
-        self.fields['deal'].required = False
\ No newline at end of file
+        self.fields['deal'].required = False
+
+class LeadConversionForm(forms.Form):
+    create_deal = forms.BooleanField(required=False, initial=True, label='Create a deal',
+                                     widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+    amount = forms.DecimalField(max_digits=12, decimal_places=2, min_value=0, initial=0,
+                                widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}))
+    close_date = forms.DateField(required=False, label='Expected close date',
+                                 widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'}))
+
+class ImportForm(forms.Form):
+    ENTITY_CHOICES = [('company', 'Companies'), ('contact', 'Contacts'), ('lead', 'Leads')]
+
+    entity = forms.ChoiceField(choices=ENTITY_CHOICES, widget=forms.Select(attrs={'class': 'form-control'}))
+    file = forms.FileField(help_text='CSV with a header row, or JSON Lines (.jsonl)',
+                           widget=forms.ClearableFileInput(attrs={'class': 'form-control'}))
+    update = forms.BooleanField(required=False, label='Update existing records',
+                                widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}))
+
@@ -0,0 +1,298 @@
+import csv
+import io
+import json
+import time
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from . import cache, conversion, dedupe, search
+from .models import Company, Contact, Lead, DashboardStats
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def read_rows(stream, fmt):
+    # Yields (line_number, row_dict) without loading the whole file.
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                yield line_number, exc
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def detect_format(path):
+    return 'jsonl' if path.endswith(('.jsonl', '.json', '.ndjson')) else 'csv'
+
+
+class RejectWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def write(self, line_number, row, error):
+        if isinstance(row, Exception):
+            row = None
+        self.stream.write(json.dumps({'line': line_number, 'error': str(error), 'row': row}) + '\n')
+        self.count += 1
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def __str__(self):
+        return (f'{self.rows} rows: {self.created} created, {self.updated} updated, '
+                f'{self.rejected} rejected in {self.elapsed:.1f}s ({self.rows_per_second:.0f} rows/s)')
+
+
+class BaseImporter:
+    model = None
+    entity = None
+    # Fields skipped by full_clean(); foreign keys are resolved from lookup
+    # maps instead of one query per row.
+    clean_exclude = ['assigned_to']
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, update_existing=False, rejects=None):
+        self.batch_size = batch_size
+        self.update_existing = update_existing
+        self.rejects = rejects or RejectWriter(io.StringIO())
+        self.fields = [
+            field for field in self.model._meta.concrete_fields
+            if field.editable and not field.primary_key and not field.is_relation
+        ]
+        self.users = dict(User.objects.values_list('username', 'pk'))
+
+    def run(self, rows, progress=None):
+        # progress(result) is called after every flushed batch.
+        result = ImportResult()
+        batch = []
+        for line_number, row in rows:
+            result.rows += 1
+            if isinstance(row, Exception):
+                self.reject(result, line_number, row, row)
+                continue
+            try:
+                batch.append((line_number, row, self.build(row)))
+            except (ValidationError, ValueError, KeyError) as exc:
+                self.reject(result, line_number, row, exc)
+            if len(batch) >= self.batch_size:
+                self.flush(batch, result)
+                batch = []
+                if progress:
+                    progress(result)
+        if batch:
+            self.flush(batch, result)
+        DashboardStats.rebuild()
+        cache.bump(self.entity, 'company')
+        return result.finish()
+
+    def reject(self, result, line_number, row, error):
+        if isinstance(error, ValidationError):
+            error = '; '.join(f'{k}: {", ".join(v)}' for k, v in error.message_dict.items())
+        self.rejects.write(line_number, row, error)
+        result.rejected += 1
+
+    def build(self, row):
+        values = {}
+        for field in self.fields:
+            if field.name not in row:
+                continue
+            value = row[field.name]
+            if isinstance(value, str):
+                value = value.strip()
+            if value in ('', None) and field.null:
+                value = None
+            values[field.name] = value
+        username = (row.get('assigned_to') or '').strip()
+        if username:
+            if username not in self.users:
+                raise ValueError(f'Unknown user {username!r}')
+            values['assigned_to_id'] = self.users[username]
+        instance = self.model(**values)
+        instance.full_clean(exclude=self.clean_exclude, validate_unique=False)
+        return instance
+
+    def update_fields(self, row, key):
+        # build() only sets the columns the file has, so an update writes
+        # just those; columns missing from the file keep their values.
+        fields = [field.name for field in self.fields if field.name in row and field.name != key]
+        if 'assigned_to' in row:
+            fields.append('assigned_to')
+        return fields
+
+    def bulk_update(self, to_update):
+        # to_update holds (instance, fields); rows with the same columns
+        # share one bulk_update().
+        groups = {}
+        for instance, fields in to_update:
+            groups.setdefault(tuple(fields), []).append(instance)
+        for fields, instances in groups.items():
+            self.model.objects.bulk_update(instances, list(fields) + ['updated_at'])
+
+    def flush(self, batch, result):
+        with transaction.atomic():
+            created = self.model.objects.bulk_create([instance for _, _, instance in batch])
+        result.created += len(created)
+        search.index_objects(self.entity, [instance.pk for instance in created])
+        dedupe.index_objects(self.entity, [instance.pk for instance in created])
+
+
+class CompanyImporter(BaseImporter):
+    model = Company
+    entity = 'company'
+
+    def flush(self, batch, result):
+        # Company names aren't unique in the schema; treat an existing name
+        # as the same company so re-running an import is idempotent.
+        names = {instance.name for _, _, instance in batch}
+        existing = dict(Company.objects.filter(name__in=names).values_list('name', 'pk'))
+        to_create, to_update, seen = [], [], set()
+        for line_number, row, instance in batch:
+            if instance.name in seen:
+                self.reject(result, line_number, row, f'Duplicate company {instance.name!r} in file')
+                continue
+            seen.add(instance.name)
+            if instance.name in existing:
+                if not self.update_existing:
+                    self.reject(result, line_number, row, f'Company {instance.name!r} already exists')
+                    continue
+                instance.pk = existing[instance.name]
+                to_update.append((instance, self.update_fields(row, 'name')))
+            else:
+                to_create.append(instance)
+        now = timezone.now()
+        for instance, _ in to_update:
+            instance.updated_at = now
+        with transaction.atomic():
+            created = Company.objects.bulk_create(to_create)
+            self.bulk_update(to_update)
+        updated = [instance.pk for instance, _ in to_update]
+        result.created += len(created)
+        result.updated += len(updated)
+        search.index_objects('company', [c.pk for c in created] + updated)
+        dedupe.index_objects('company', [c.pk for c in created] + updated)
+
+
+class ContactImporter(BaseImporter):
+    model = Contact
+    entity = 'contact'
+    clean_exclude = ['assigned_to', 'company']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.companies = {}
+        for pk, name in Company.objects.order_by('-pk').values_list('pk', 'name').iterator(chunk_size=5000):
+            self.companies[name] = pk
+        self.seen_emails = set()
+
+    def build(self, row):
+        instance = super().build(row)
+        instance.email = instance.email.lower()
+        company_name = (row.get('company') or '').strip()
+        if not company_name:
+            raise ValueError('company is required')
+        # Resolved to a primary key in flush(); new names become companies.
+        instance._company_name = company_name
+        return instance
+
+    def flush(self, batch, result):
+        # Another import or an edit can add one of these emails between the
+        # lookup and the insert. The batch is then rolled back and planned
+        # again, which turns those rows into updates (or rejects).
+        for _ in range(2):
+            try:
+                return self.write_batch(batch, result)
+            except IntegrityError:
+                continue
+        for line_number, row, _ in batch:
+            self.reject(result, line_number, row, 'Conflicts with a concurrent change to the same contacts')
+
+    def write_batch(self, batch, result):
+        # Nothing on self or result changes until the transaction commits,
+        # so a rolled-back attempt can be retried as is.
+        new_names = {
+            instance._company_name for _, _, instance in batch
+            if instance._company_name not in self.companies
+        }
+        # Stored emails may be mixed case; the file's are lowercased.
+        existing = conversion.lookup(Contact, 'email', {instance.email for _, _, instance in batch})
+
+        to_create, to_update, rejects, seen = [], [], [], set()
+        for line_number, row, instance in batch:
+            if instance.email in self.seen_emails or instance.email in seen:
+                rejects.append((line_number, row, f'Duplicate email {instance.email} in file'))
+                continue
+            seen.add(instance.email)
+            if instance.email in existing:
+                if not self.update_existing:
+                    rejects.append((line_number, row, f'Contact {instance.email} already exists'))
+                    continue
+                instance.pk = existing[instance.email]
+                # company is a required column, so always written.
+                to_update.append((instance, self.update_fields(row, 'email') + ['company']))
+            else:
+                instance.pk = None
+                to_create.append(instance)
+
+        now = timezone.now()
+        for instance, _ in to_update:
+            instance.updated_at = now
+        with transaction.atomic():
+            new_companies = Company.objects.bulk_create(Company(name=name) for name in sorted(new_names))
+            new_ids = {company.name: company.pk for company in new_companies}
+            for instance in to_create + [instance for instance, _ in to_update]:
+                instance.company_id = new_ids.get(instance._company_name) or self.companies[instance._company_name]
+            created = Contact.objects.bulk_create(to_create)
+            self.bulk_update(to_update)
+
+        self.companies.update(new_ids)
+        self.seen_emails |= seen
+        for line_number, row, error in rejects:
+            self.reject(result, line_number, row, error)
+        updated = [instance.pk for instance, _ in to_update]
+        result.created += len(created)
+        result.updated += len(updated)
+        search.index_objects('company', [company.pk for company in new_companies])
+        search.index_objects('contact', [c.pk for c in created] + updated)
+        dedupe.index_objects('company', [company.pk for company in new_companies])
+        dedupe.index_objects('contact', [c.pk for c in created] + updated)
+
+
+class LeadImporter(BaseImporter):
+    model = Lead
+    entity = 'lead'
+
+
+IMPORTERS = {
+    'company': CompanyImporter,
+    'contact': ContactImporter,
+    'lead': LeadImporter,
+}
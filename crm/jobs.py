@@ -0,0 +1,230 @@
+import os
+import socket
+import traceback
+from contextlib import nullcontext
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import bulk, cache, exporters, search
+from .importers import IMPORTERS, RejectWriter, detect_format, read_rows
+from .models import DashboardStats, Job
+
+TASKS = {}
+
+REASSIGN_BATCH_SIZE = 1000
+
+
+class JobContext:
+    # Handed to every task; progress() makes the job pollable while it runs.
+    def __init__(self, job):
+        self.job = job
+
+    def progress(self, done, total=None, message=None):
+        changes = {'progress': done}
+        if total is not None:
+            changes['total'] = total
+        if message is not None:
+            changes['message'] = message[:255]
+        Job.objects.filter(pk=self.job.pk).update(**changes)
+
+
+def task(name):
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def retry_backoff():
+    return getattr(settings, 'CRM_JOB_RETRY_BACKOFF', 30)
+
+
+def stale_after():
+    return getattr(settings, 'CRM_JOB_TIMEOUT', 3600)
+
+
+def files_dir():
+    path = Path(getattr(settings, 'CRM_JOB_FILES_DIR', Path(settings.BASE_DIR) / 'job_files'))
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue(task_name, args=None, user=None, max_attempts=3, delay=0):
+    if task_name not in TASKS:
+        raise ValueError(f'Unknown task {task_name!r}')
+    return Job.objects.create(
+        task=task_name,
+        args=args or {},
+        created_by=user,
+        max_attempts=max_attempts,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker=None):
+    # FOR UPDATE SKIP LOCKED lets concurrent workers pass over each other's
+    # candidates on Postgres. SQLite has no row locks, so there the read runs
+    # outside a transaction (avoiding lock-upgrade deadlocks) and the claim
+    # rests on the conditional UPDATE, which only one worker can win.
+    now = timezone.now()
+    locking = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic() if locking else nullcontext():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_after__lte=now)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = Job.objects.filter(pk=job.pk, status='queued').update(
+            status='running',
+            attempts=job.attempts + 1,
+            locked_by=worker or worker_id(),
+            locked_at=now,
+            started_at=now,
+            error='',
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run(job):
+    # Runs a claimed job and records the outcome, re-queueing it with
+    # exponential backoff while it has attempts left.
+    try:
+        result = TASKS[job.task](JobContext(job), **job.args)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = retry_backoff() * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', error=error, locked_by='', locked_at=None,
+                run_after=now + timedelta(seconds=delay),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(status='failed', error=error, finished_at=now)
+        return False
+    Job.objects.filter(pk=job.pk).update(
+        status='succeeded', result=result, finished_at=timezone.now(), locked_by='', locked_at=None,
+    )
+    return True
+
+
+def run_by_id(job_id):
+    # Entry point for worker processes, which only receive the primary key.
+    return run(Job.objects.get(pk=job_id))
+
+
+def requeue_stale():
+    # Jobs whose worker died mid-run go back on the queue; the claim counted
+    # the attempt, so a job that keeps killing its worker still runs out.
+    cutoff = timezone.now() - timedelta(seconds=stale_after())
+    stale = Job.objects.filter(status='running', locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', error='Worker stopped responding', finished_at=timezone.now(),
+    )
+    requeued = stale.update(status='queued', locked_by='', locked_at=None, run_after=timezone.now())
+    return requeued, failed
+
+
+def run_pending(worker=None, limit=None):
+    # Runs queued jobs in this process until none are due; used by
+    # `crm_worker --processes 0` and the tests.
+    done = 0
+    while limit is None or done < limit:
+        job = claim(worker)
+        if job is None:
+            break
+        run(job)
+        done += 1
+    return done
+
+
+# Tasks
+@task('rebuild_stats')
+def rebuild_stats(ctx):
+    stats = DashboardStats.rebuild()
+    cache.bump('company', 'contact', 'lead', 'deal')
+    return {'rebuilt_at': stats.rebuilt_at.isoformat()}
+
+
+@task('rebuild_search')
+def rebuild_search(ctx, entities=None):
+    entities = entities or list(search.ENTITIES)
+    counts = {}
+    for done, entity in enumerate(entities):
+        ctx.progress(done, len(entities), f'Indexing {entity}')
+        counts.update(search.rebuild([entity]))
+    ctx.progress(len(entities), len(entities), 'Done')
+    return counts
+
+
+@task('import')
+def import_file(ctx, entity, path, format=None, update=False):
+    fmt = format or detect_format(path)
+    rejects_path = f'{path}.rejects.jsonl'
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        total = sum(1 for _ in source) - (1 if fmt == 'csv' else 0)
+        source.seek(0)
+        ctx.progress(0, max(total, 0), f'Importing {entity}')
+        with open(rejects_path, 'w') as rejects_file:
+            importer = IMPORTERS[entity](update_existing=update, rejects=RejectWriter(rejects_file))
+            result = importer.run(
+                read_rows(source, fmt),
+                progress=lambda r: ctx.progress(r.rows, message=f'{r.created} created, {r.rejected} rejected'),
+            )
+    ctx.progress(result.rows, message=str(result))
+    return {
+        'rows': result.rows,
+        'created': result.created,
+        'updated': result.updated,
+        'rejected': result.rejected,
+        'rejects_path': rejects_path if result.rejected else None,
+    }
+
+
+@task('export')
+def export_file(ctx, entity, params=None, format='csv'):
+    params = params or {}
+    total = exporters.export_queryset(entity, params).count()
+    name = exporters.filename(entity, format)
+    path = files_dir() / f'export-{ctx.job.pk}-{name}'
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as fh:
+        for line in exporters.stream(entity, params, format):
+            fh.write(line)
+            rows += 1
+            if rows % exporters.DEFAULT_CHUNK_SIZE == 0:
+                ctx.progress(rows, total)
+    rows -= 1 if format == 'csv' else 0
+    ctx.progress(rows, total)
+    return {'path': str(path), 'filename': name, 'rows': rows}
+
+
+@task('reassign')
+def reassign(ctx, entity, user_id, ids=None, filters=None):
+    # Either the ticked ids or every row matching the list filters, read
+    # when the job runs.
+    user_id = bulk.assignee(user_id)
+    if ids is None:
+        ids = list(exporters.filtered_queryset(entity, filters or {}).values_list('pk', flat=True))
+    model = search.ENTITIES[entity][0]
+    updated = 0
+    for start in range(0, len(ids), REASSIGN_BATCH_SIZE):
+        chunk = ids[start:start + REASSIGN_BATCH_SIZE]
+        updated += bulk.reassign(entity, model.objects.filter(pk__in=chunk), user_id)
+        ctx.progress(start + len(chunk), len(ids))
+    return {'updated': updated}
@@ -0,0 +1,318 @@
+import json
+import logging
+import platform
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import NoReverseMatch, reverse
+from django.utils import timezone
+
+from crm.models import Company
+from crm.perf import summarize
+from crm.search import ENTITIES
+
+# Route name -> relative weight. Reads dominate, as they do for people
+# working through lists and records; a small share of creates keeps the
+# write path and the cache invalidation it causes in the picture.
+DEFAULT_MIX = {
+    'dashboard': 8,
+    'company_list': 5, 'company_detail': 6,
+    'contact_list': 10, 'contact_detail': 12, 'contact_autocomplete': 4,
+    'lead_list': 6, 'lead_detail': 5,
+    'deal_list': 8, 'deal_detail': 8, 'deal_autocomplete': 2,
+    'activity_list': 5, 'activity_detail': 3,
+    'company_autocomplete': 2,
+    'pipeline_report': 1,
+    'contact_api': 2, 'deal_api': 2,
+    'contact_create': 2, 'lead_create': 2,
+}
+# Routes replayed as POSTs, with the form data for the n-th request.
+WRITES = {
+    'contact_create': lambda n, company: {
+        'first_name': 'Bench', 'last_name': f'Contact{n}', 'email': f'bench-{time.time_ns()}-{n}@example.com',
+        'company': company, 'contact_type': 'prospect',
+    },
+    'lead_create': lambda n, company: {
+        'first_name': 'Bench', 'last_name': f'Lead{n}', 'email': f'bench-lead{n}@example.com',
+        'company_name': 'Bench Inc', 'status': 'new', 'source': 'website',
+    },
+}
+PREFIXES = ['a', 'b', 'ch', 'da', 'j', 'ma', 'ro', 'sm', 'th', 'w']
+POOL_SIZE = 200
+OK_STATUSES = {200, 302, 304}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        try:
+            mix[name] = int(weight or 1)
+        except ValueError:
+            raise CommandError(f'Bad weight in --mix: {item}')
+    return mix
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Replay a weighted mix of CRM routes with concurrent clients and report throughput '
+            'and latency percentiles, overall and per route, as JSON to compare between versions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', '-n', type=int, default=2000)
+        parser.add_argument('--concurrency', '-c', type=int, default=8)
+        parser.add_argument('--warmup', type=int, default=50, help='Unmeasured requests issued first')
+        parser.add_argument('--mix', help='Comma-separated route=weight pairs replacing the default mix, '
+                                          'e.g. contact_list=5,contact_detail=3')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed and data replay the same requests')
+        parser.add_argument('--user', help='Username to log in as (default: first superuser)')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Disable the fragment cache so every request renders')
+        parser.add_argument('--url', help='Benchmark a running server instead, e.g. http://127.0.0.1:8000 '
+                                          '(needs --session; write routes are left out)')
+        parser.add_argument('--session', help='sessionid cookie for --url runs')
+        parser.add_argument('--output', '-o', help='Write the report as JSON')
+        parser.add_argument('--compare', help='A previous JSON report to compare this run against')
+
+    def handle(self, *args, **options):
+        if options['url'] and not options['session']:
+            raise CommandError('--url needs --session')
+        mix = parse_mix(options['mix']) if options['mix'] else dict(DEFAULT_MIX)
+        if options['url']:
+            mix = {name: weight for name, weight in mix.items() if name not in WRITES}
+        self.rng = random.Random(options['seed'])
+        self.company = Company.objects.order_by('pk').values_list('pk', flat=True).first()
+        pools = self.build_pools(mix)
+        schedule = self.build_schedule(mix, pools, options['warmup'] + options['requests'])
+        warmup, schedule = schedule[:options['warmup']], schedule[options['warmup']:]
+
+        if options['url']:
+            outcomes, elapsed = self.run_http(options['url'], options['session'], warmup, schedule, options)
+        else:
+            user = self.get_user(options['user'])
+            overrides = {'ALLOWED_HOSTS': ['testserver'], 'CRM_PERF_ENABLED': False}
+            if options['no_cache']:
+                overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            with override_settings(**overrides):
+                outcomes, elapsed = self.run_clients(user, warmup, schedule, options)
+
+        report = self.build_report(mix, outcomes, elapsed, options)
+        overall = report['overall']
+        self.stdout.write(
+            f'{overall["requests"]} requests in {overall["seconds"]}s, {overall["throughput"]} req/s, '
+            f'p50 {overall["p50_ms"]}ms, p95 {overall["p95_ms"]}ms, p99 {overall["p99_ms"]}ms, '
+            f'{overall["errors"]} errors'
+        )
+        for name, result in sorted(report['routes'].items()):
+            self.stdout.write(f'  {name:<22} {result["requests"]:>6}  p50 {result["p50_ms"]:>8}ms  '
+                              f'p95 {result["p95_ms"]:>8}ms  p99 {result["p99_ms"]:>8}ms  {result["errors"]} errors')
+        if options['compare']:
+            with open(options['compare']) as fh:
+                report['comparison'] = self.compare(json.load(fh), report)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, indent=2)
+
+    def get_user(self, username):
+        users = User.objects.filter(username=username) if username else User.objects.filter(is_superuser=True)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No user to log in as; pass --user')
+        return user
+
+    # Schedule
+    def build_pools(self, mix):
+        # Detail routes request records spread over the whole table: random
+        # points in the pk range, each rounded up to the next existing row
+        # by one indexed lookup, so gaps in the pks don't matter.
+        pools = {}
+        for name in mix:
+            try:
+                reverse(name)
+                continue
+            except NoReverseMatch:
+                pass
+            entity = name.split('_')[0]
+            if entity not in ENTITIES or not name.endswith('_detail'):
+                raise CommandError(f'Unknown route or route needing arguments: {name}')
+            if entity not in pools:
+                model = ENTITIES[entity][0]
+                pks = model.objects.order_by('pk').values_list('pk', flat=True)
+                first, last = pks.first(), pks.last()
+                if first is None:
+                    raise CommandError(f'No {model._meta.verbose_name} to request for {name}; run crm_seed')
+                pools[entity] = sorted({
+                    pks.filter(pk__gte=self.rng.randint(first, last)).first() for _ in range(POOL_SIZE)
+                })
+        if any(name in WRITES for name in mix) and self.company is None:
+            raise CommandError('Creating contacts needs a company; run crm_seed')
+        return pools
+
+    def build_schedule(self, mix, pools, count):
+        names, weights = list(mix), list(mix.values())
+        schedule = []
+        for n, name in enumerate(self.rng.choices(names, weights=weights, k=count)):
+            entity = name.split('_')[0]
+            if name in WRITES:
+                schedule.append((name, 'post', reverse(name), WRITES[name](n, self.company)))
+                continue
+            if name.endswith('_detail'):
+                url = reverse(name, args=[self.rng.choice(pools[entity])])
+            else:
+                url = reverse(name)
+            if name.endswith('_autocomplete'):
+                url += f'?q={self.rng.choice(PREFIXES)}'
+            elif name.endswith('_list') and self.rng.random() < 0.2:
+                url += f'?search={self.rng.choice(PREFIXES)}'
+            schedule.append((name, 'get', url, None))
+        return schedule
+
+    # Runners
+    def run_clients(self, user, warmup, schedule, options):
+        # One thread per client, like a threaded WSGI server, each taking the
+        # next request off the shared schedule. The clients share one session.
+        login = Client()
+        login.force_login(user)
+        cookie = login.cookies[settings.SESSION_COOKIE_NAME].OutputString(attrs=[])
+
+        def replay(items):
+            items = iter(items)
+            lock = threading.Lock()
+
+            def worker():
+                client = Client(HTTP_COOKIE=cookie)
+                outcomes = []
+                try:
+                    while True:
+                        with lock:
+                            item = next(items, None)
+                        if item is None:
+                            return outcomes
+                        name, method, url, data = item
+                        started = time.perf_counter()
+                        try:
+                            response = client.post(url, data) if method == 'post' else client.get(url)
+                            status = response.status_code
+                        except Exception as exc:
+                            # e.g. OperationalError when SQLite is locked
+                            status = type(exc).__name__
+                        outcomes.append((name, time.perf_counter() - started, status))
+                        close_old_connections()
+                finally:
+                    connections.close_all()
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                futures = [pool.submit(worker) for _ in range(options['concurrency'])]
+                outcomes = [outcome for future in futures for outcome in future.result()]
+            return outcomes, time.perf_counter() - started
+
+        connections.close_all()
+        # Failed requests are counted in the report rather than logged one by one.
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        try:
+            replay(warmup)
+            return replay(schedule)
+        finally:
+            request_logger.disabled = False
+
+    def run_http(self, base, session, warmup, schedule, options):
+        def request(item):
+            name, _, url, _ = item
+            req = urllib.request.Request(base.rstrip('/') + url,
+                                         headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={session}'})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as exc:
+                status = exc.code
+            except OSError as exc:
+                status = type(exc).__name__
+            return name, time.perf_counter() - started, status
+
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            list(pool.map(request, warmup))
+            started = time.perf_counter()
+            outcomes = list(pool.map(request, schedule))
+            elapsed = time.perf_counter() - started
+        return outcomes, elapsed
+
+    # Report
+    def build_report(self, mix, outcomes, elapsed, options):
+        by_route = defaultdict(list)
+        for name, latency, status in outcomes:
+            by_route[name].append((latency, status))
+        routes = {}
+        for name, results in by_route.items():
+            latencies = [latency for latency, _ in results]
+            statuses = Counter(status for _, status in results)
+            errors = sum(count for status, count in statuses.items() if status not in OK_STATUSES)
+            # Per-route throughput would only restate its share of the mix.
+            summary = summarize(latencies, elapsed, errors)
+            del summary['seconds'], summary['throughput']
+            routes[name] = {**summary, 'statuses': dict(sorted((str(status), count) for status, count in statuses.items()))}
+        errors = sum(status not in OK_STATUSES for _, _, status in outcomes)
+        db = connections['default']
+        return {
+            'meta': {
+                'revision': git_revision(),
+                'started_at': timezone.now().isoformat(),
+                'target': options['url'] or 'in-process',
+                'database': db.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'rows': {entity: model.objects.count() for entity, (model, *_) in ENTITIES.items()},
+                'options': {key: options[key] for key in ('requests', 'concurrency', 'warmup', 'seed', 'no_cache')},
+                'mix': mix,
+            },
+            'overall': summarize([latency for _, latency, _ in outcomes], elapsed, errors),
+            'routes': routes,
+        }
+
+    def compare(self, baseline, report):
+        # Positive deltas are regressions for latency, improvements for throughput.
+        def change(old, new):
+            return round((new - old) / old * 100, 1) if old else None
+
+        old, new = baseline['overall'], report['overall']
+        comparison = {
+            'baseline': baseline['meta'].get('revision'),
+            'throughput_pct': change(old['throughput'], new['throughput']),
+            'p95_pct': change(old['p95_ms'], new['p95_ms']),
+            'routes': {},
+        }
+        self.stdout.write(
+            f'vs {comparison["baseline"] or "baseline"}: throughput {old["throughput"]} -> '
+            f'{new["throughput"]} req/s ({comparison["throughput_pct"]}%), '
+            f'p95 {old["p95_ms"]} -> {new["p95_ms"]}ms ({comparison["p95_pct"]}%)'
+        )
+        for name, result in sorted(report['routes'].items()):
+            before = baseline['routes'].get(name)
+            if before:
+                comparison['routes'][name] = {'p95_ms': [before['p95_ms'], result['p95_ms']],
+                                              'p95_pct': change(before['p95_ms'], result['p95_ms'])}
+        return comparison
@@ -0,0 +1,44 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import conversion
+from crm.models import Lead
+
+
+class Command(BaseCommand):
+    help = 'Convert leads into companies, contacts and deals in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', default='qualified', help='Convert leads with this status')
+        parser.add_argument('--ids', help='Comma-separated lead IDs instead of --status')
+        parser.add_argument('--no-deal', action='store_true', help="Don't create a deal per lead")
+        parser.add_argument('--amount', default='0', help='Amount of each new deal')
+        parser.add_argument('--close-date', type=date.fromisoformat,
+                            help=f'Expected close date of the new deals (default: in {conversion.CLOSE_DAYS} days)')
+
+    def handle(self, *args, **options):
+        try:
+            amount = Decimal(options['amount'])
+        except InvalidOperation:
+            raise CommandError('--amount must be a number')
+        if options['ids']:
+            try:
+                ids = [int(pk) for pk in options['ids'].split(',') if pk.strip()]
+            except ValueError:
+                raise CommandError('--ids must be comma-separated integers')
+            queryset = Lead.objects.filter(pk__in=ids)
+        else:
+            if options['status'] not in dict(Lead.STATUS_CHOICES):
+                raise CommandError(f'Unknown status {options["status"]!r}')
+            queryset = Lead.objects.filter(status=options['status'])
+        result = conversion.convert_leads(
+            queryset,
+            create_deal=not options['no_deal'],
+            amount=amount,
+            close_date=options['close_date'],
+        )
+        for pk, reason in sorted(result.skipped.items()):
+            self.stderr.write(f'Lead {pk} skipped: {reason}')
+        self.stdout.write(self.style.SUCCESS(str(result)))
@@ -0,0 +1,178 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from crm import sqlite
+from crm.models import Company, Contact, DashboardStats
+from crm.perf import summarize
+from crm_project import settings_production
+
+READ_ROUTES = ['dashboard', 'contact_list', 'deal_list', 'contact_detail']
+PROFILES = ['baseline', 'tuned']
+
+
+def profile_settings(name):
+    # Database settings for each profile; "tuned" is the production profile.
+    if name == 'tuned':
+        db = settings_production.DATABASES['default']
+        return {
+            'CONN_MAX_AGE': db['CONN_MAX_AGE'],
+            'CONN_HEALTH_CHECKS': db['CONN_HEALTH_CHECKS'],
+            'OPTIONS': dict(db['OPTIONS']),
+        }, dict(settings_production.CRM_SQLITE_PRAGMAS)
+    return {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'OPTIONS': {}}, {}
+
+
+class Command(BaseCommand):
+    help = ('Benchmark mixed read/write traffic against a scratch SQLite database with the '
+            'default settings and with the production profile (WAL, pragmas, persistent connections)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', '-n', type=int, default=2000)
+        parser.add_argument('--threads', '-c', type=int, default=8)
+        parser.add_argument('--write-percent', type=int, default=20,
+                            help='Share of requests that create a contact or deal')
+        parser.add_argument('--companies', type=int, default=200,
+                            help='Companies (with two contacts each) seeded before the run')
+        parser.add_argument('--profile', choices=['both'] + PROFILES, default='both')
+        parser.add_argument('--output', '-o', help='Write the results as JSON')
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('crm_dbbench measures SQLite settings; the default database is not SQLite')
+        profiles = PROFILES if options['profile'] == 'both' else [options['profile']]
+        db = connections.settings['default']
+        original = {key: db.get(key) for key in ('NAME', 'CONN_MAX_AGE', 'CONN_HEALTH_CHECKS', 'OPTIONS')}
+        results = {}
+        # Page renders come from the database on every request, and the run
+        # itself isn't recorded by the perf middleware.
+        overrides = {
+            'ALLOWED_HOSTS': ['testserver'],
+            'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            'CRM_PERF_ENABLED': False,
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                for profile in profiles:
+                    db_settings, pragmas = profile_settings(profile)
+                    connections.close_all()
+                    db.update(NAME=os.path.join(tmp, f'{profile}.sqlite3'), **db_settings)
+                    with override_settings(CRM_SQLITE_PRAGMAS=pragmas, **overrides):
+                        self.seed(options['companies'])
+                        results[profile] = self.run(options)
+                        results[profile]['pragmas'] = sqlite.current_pragmas(connections['default'], [
+                            'journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size',
+                        ])
+                    connections.close_all()
+            finally:
+                connections.close_all()
+                db.update(original)
+
+        for profile, result in results.items():
+            self.stdout.write(
+                f'{profile}: {result["requests"]} requests ({result["writes"]} writes) in {result["seconds"]}s, '
+                f'{result["throughput"]} req/s, p50 {result["p50_ms"]}ms, p95 {result["p95_ms"]}ms, '
+                f'p99 {result["p99_ms"]}ms, {result["errors"]} errors ({result["locked"]} locked)'
+            )
+        if len(results) == 2 and results['baseline']['throughput']:
+            results['speedup'] = round(results['tuned']['throughput'] / results['baseline']['throughput'], 2)
+            self.stdout.write(f'tuned/baseline throughput: {results["speedup"]}x')
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+
+    def seed(self, count):
+        call_command('migrate', verbosity=0, interactive=False)
+        self.user = User.objects.create_user('bench', password='bench')
+        companies = Company.objects.bulk_create(Company(name=f'Bench {i:05d}') for i in range(count))
+        Contact.objects.bulk_create(
+            Contact(first_name=f'First{i}', last_name='Bench', email=f'bench{i}@example.com',
+                    company=companies[i % len(companies)], assigned_to=self.user)
+            for i in range(count * 2)
+        )
+        DashboardStats.rebuild()
+        self.company = companies[0]
+        self.contact = Contact.objects.order_by('pk').first()
+
+    def run(self, options):
+        login = Client()
+        login.force_login(self.user)
+        cookie = login.cookies[settings.SESSION_COOKIE_NAME].OutputString(attrs=[])
+        reads = [
+            reverse(name, args=[self.contact.pk]) if name.endswith('_detail') else reverse(name)
+            for name in READ_ROUTES
+        ]
+        writes = [
+            (reverse('contact_create'), lambda n: {
+                'first_name': 'Load', 'last_name': f'Test{n}', 'email': f'load{n}@example.com',
+                'company': self.company.pk, 'contact_type': 'prospect',
+            }),
+            (reverse('deal_create'), lambda n: {
+                'title': f'Load deal {n}', 'contact': self.contact.pk, 'company': self.company.pk,
+                'amount': '1000.00', 'stage': 'prospecting', 'priority': 'medium', 'probability': 10,
+                'expected_close_date': (date.today() + timedelta(days=30)).isoformat(),
+            }),
+        ]
+        threads = options['threads']
+        counter = iter(range(options['requests']))
+        lock = threading.Lock()
+        connections.close_all()
+
+        def worker():
+            # Like one thread of a threaded WSGI server: close_old_connections()
+            # at each request boundary honours CONN_MAX_AGE.
+            client = Client(HTTP_COOKIE=cookie)
+            outcomes = []
+            try:
+                while True:
+                    with lock:
+                        n = next(counter, None)
+                    if n is None:
+                        return outcomes
+                    is_write = n % 100 < options['write_percent']
+                    started = time.perf_counter()
+                    try:
+                        if is_write:
+                            url, data = writes[n % len(writes)]
+                            status = client.post(url, data(n)).status_code
+                        else:
+                            status = client.get(reads[n % len(reads)]).status_code
+                        error = '' if status in (200, 302) else str(status)
+                    except Exception as exc:
+                        error = str(exc)
+                    outcomes.append((time.perf_counter() - started, is_write, error))
+                    close_old_connections()
+            finally:
+                connections.close_all()
+
+        # Failed requests are counted below rather than logged one by one.
+        request_logger = logging.getLogger('django.request')
+        request_logger.disabled = True
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(threads) as pool:
+                futures = [pool.submit(worker) for _ in range(threads)]
+                outcomes = [outcome for future in futures for outcome in future.result()]
+        finally:
+            request_logger.disabled = False
+        elapsed = time.perf_counter() - started
+
+        errors = [error for _, _, error in outcomes if error]
+        result = summarize([latency for latency, _, _ in outcomes], elapsed, len(errors))
+        result['writes'] = sum(is_write for _, is_write, _ in outcomes)
+        result['locked'] = sum('locked' in error for error in errors)
+        return result
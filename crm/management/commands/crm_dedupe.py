@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm import dedupe
+
+
+class Command(BaseCommand):
+    help = 'List likely duplicate companies, contacts and leads (--rebuild recomputes the blocking keys first)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entities', nargs='*', metavar='entity',
+                            help=f'One or more of: {", ".join(dedupe.ENTITIES)} (default: all)')
+        parser.add_argument('--rebuild', action='store_true', help='Recompute every blocking key first')
+        parser.add_argument('--min-score', type=float, help='Lowest score to report (default: CRM_DEDUPE_THRESHOLD)')
+        parser.add_argument('--limit', type=int, default=50, help='Pairs to report per entity')
+        parser.add_argument('--json', action='store_true', help='Print the pairs as JSON')
+
+    def handle(self, *args, **options):
+        entities = options['entities'] or list(dedupe.ENTITIES)
+        unknown = [entity for entity in entities if entity not in dedupe.ENTITIES]
+        if unknown:
+            raise CommandError(f'Unknown entity: {", ".join(unknown)}')
+        if options['rebuild']:
+            for entity, count in dedupe.rebuild(entities).items():
+                self.stderr.write(f'Indexed {count} {entity} records')
+        found = {
+            entity: dedupe.find_duplicates(entity, options['min_score'], options['limit'])
+            for entity in entities
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(found, indent=2))
+            return
+        for entity, pairs in found.items():
+            self.stdout.write(f'{entity}: {len(pairs)} likely duplicate pair(s)')
+            for pair in pairs:
+                first, second = pair['ids']
+                self.stdout.write(f'  {pair["score"]:.2f}  #{first} / #{second}  ({", ".join(pair["reasons"])})')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from crm.exporters import DEFAULT_CHUNK_SIZE, EXPORTS, FORMATS, stream
+
+
+class Command(BaseCommand):
+    help = 'Stream every company, contact, lead, deal or activity to CSV or JSONL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--output', '-o', default='-', help="Output file (default: stdout)")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--search', help='Same full-text filter as the list views')
+        parser.add_argument('--status', help='Lead or activity status filter')
+        parser.add_argument('--stage', help='Deal stage filter')
+
+    def handle(self, *args, **options):
+        params = {key: options[key] for key in ['search', 'status', 'stage'] if options[key]}
+        lines = stream(options['entity'], params, options['format'], options['chunk_size'])
+        if options['output'] == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+        rows = -1 if options['format'] == 'csv' else 0
+        with open(options['output'], 'w', newline='', encoding='utf-8') as fh:
+            for line in lines:
+                fh.write(line)
+                rows += 1
+        self.stderr.write(self.style.SUCCESS(f'Exported {rows} {options["entity"]} rows to {options["output"]}'))
@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importers import DEFAULT_BATCH_SIZE, IMPORTERS, RejectWriter, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Stream companies, contacts or leads from a CSV or JSONL file into the CRM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('entity', choices=sorted(IMPORTERS))
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            help='Input format (default: guessed from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--update', action='store_true',
+                            help='Update existing records (matched by email or company name) instead of rejecting them')
+        parser.add_argument('--rejects', default=None,
+                            help='Write rejected rows as JSON lines to this file (default: <path>.rejects.jsonl)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path == '-' else detect_format(path))
+        rejects_path = options['rejects'] or (
+            'rejects.jsonl' if path == '-' else f'{path}.rejects.jsonl'
+        )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+
+        try:
+            source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        with source, open(rejects_path, 'w') as rejects_file:
+            importer = IMPORTERS[options['entity']](
+                batch_size=options['batch_size'],
+                update_existing=options['update'],
+                rejects=RejectWriter(rejects_file),
+            )
+            result = importer.run(read_rows(source, fmt))
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {options["entity"]}: {result}'))
+        if result.rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected rows written to {rejects_path}'))
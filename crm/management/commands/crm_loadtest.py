@@ -0,0 +1,154 @@
+import asyncio
+import json
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from crm.async_urls import ASYNC_VIEWS
+from crm.perf import summarize
+from crm.search import ENTITIES
+
+DEFAULT_ROUTES = 'dashboard,company_list,contact_list,deal_list,activity_list,deal_detail'
+
+
+class Command(BaseCommand):
+    help = ('Compare throughput and latency of the async views under the ASGI handler '
+            'with the sync views under the WSGI handler, or of two running servers')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', '-n', type=int, default=500)
+        parser.add_argument('--concurrency', '-c', type=int, default=20)
+        parser.add_argument('--routes', default=DEFAULT_ROUTES,
+                            help='Comma-separated route names, requested round-robin')
+        parser.add_argument('--user', help='Username to log in as (default: first superuser)')
+        parser.add_argument('--mode', choices=['both', 'asgi', 'wsgi'], default='both')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Disable the fragment cache so every request renders')
+        parser.add_argument('--url', action='append', default=[],
+                            help='Benchmark a running server instead, e.g. http://127.0.0.1:8000 '
+                                 '(repeatable; needs --session)')
+        parser.add_argument('--session', help='sessionid cookie for --url runs')
+        parser.add_argument('--output', '-o', help='Write the results as JSON')
+
+    def handle(self, *args, **options):
+        urls = self.build_urls(options['routes'].split(','))
+        if options['url']:
+            if not options['session']:
+                raise CommandError('--url needs --session')
+            results = {
+                base: self.run_http(base, options['session'], urls, options)
+                for base in options['url']
+            }
+        else:
+            user = self.get_user(options['user'])
+            overrides = {}
+            if options['no_cache']:
+                overrides['CACHES'] = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+            results = {}
+            with override_settings(**overrides):
+                if options['mode'] in ('both', 'wsgi'):
+                    with override_settings(ROOT_URLCONF='crm.urls'):
+                        results['wsgi'] = self.run_wsgi(user, urls, options)
+                if options['mode'] in ('both', 'asgi'):
+                    with override_settings(ROOT_URLCONF='crm.async_urls'):
+                        results['asgi'] = asyncio.run(self.run_asgi(user, urls, options))
+
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name}: {result["requests"]} requests in {result["seconds"]}s, '
+                f'{result["throughput"]} req/s, p50 {result["p50_ms"]}ms, '
+                f'p95 {result["p95_ms"]}ms, p99 {result["p99_ms"]}ms, {result["errors"]} errors'
+            )
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump({'routes': urls, **results}, fh, indent=2)
+
+    def get_user(self, username):
+        users = User.objects.filter(username=username) if username else User.objects.filter(is_superuser=True)
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No user to log in as; pass --user')
+        return user
+
+    def build_urls(self, routes):
+        urls = []
+        for name in routes:
+            name = name.strip()
+            if name.endswith('_detail'):
+                model = ENTITIES[name[:-len('_detail')]][0]
+                pk = model.objects.order_by('pk').values_list('pk', flat=True).first()
+                if pk is None:
+                    raise CommandError(f'No {model._meta.verbose_name} to request for {name}')
+                urls.append(reverse(name, args=[pk]))
+            elif name in ASYNC_VIEWS:
+                urls.append(reverse(name))
+            else:
+                raise CommandError(f'{name} has no async variant to compare')
+        return urls
+
+    def run_wsgi(self, user, urls, options):
+        # One thread per worker, like a threaded WSGI server. The workers
+        # share one session so the run itself only reads.
+        login = Client()
+        login.force_login(user)
+        cookie = login.cookies[settings.SESSION_COOKIE_NAME].OutputString(attrs=[])
+        local = threading.local()
+
+        def request(index):
+            if not hasattr(local, 'client'):
+                local.client = Client(HTTP_COOKIE=cookie)
+            started = time.perf_counter()
+            response = local.client.get(urls[index % len(urls)])
+            return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            outcomes = list(pool.map(request, range(options['requests'])))
+        return self.collect(outcomes, time.perf_counter() - started)
+
+    async def run_asgi(self, user, urls, options):
+        # A single event loop serving every in-flight request.
+        client = AsyncClient()
+        await client.aforce_login(user)
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def request(index):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get(urls[index % len(urls)])
+                return time.perf_counter() - started, response.status_code
+
+        started = time.perf_counter()
+        outcomes = await asyncio.gather(*(request(i) for i in range(options['requests'])))
+        return self.collect(outcomes, time.perf_counter() - started)
+
+    def run_http(self, base, session, urls, options):
+        def request(index):
+            req = urllib.request.Request(base.rstrip('/') + urls[index % len(urls)],
+                                         headers={'Cookie': f'{settings.SESSION_COOKIE_NAME}={session}'})
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req) as response:
+                    response.read()
+                    status = response.status
+            except OSError:
+                status = 0
+            return time.perf_counter() - started, status
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            outcomes = list(pool.map(request, range(options['requests'])))
+        return self.collect(outcomes, time.perf_counter() - started)
+
+    def collect(self, outcomes, elapsed):
+        latencies = [latency for latency, _ in outcomes]
+        errors = sum(status != 200 for _, status in outcomes)
+        return summarize(latencies, elapsed, errors)
@@ -0,0 +1,67 @@
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from crm.analytics import DEFAULT_MONTHS, pipeline_report
+from crm.models import Deal, Lead
+
+
+class Command(BaseCommand):
+    help = 'Print the weighted pipeline, funnels, win rates, forecast, cohorts and time in stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=DEFAULT_MONTHS,
+                            help='Forecast and cohort window in months')
+        parser.add_argument('--assigned-to', help='Only deals and leads owned by this username')
+        parser.add_argument('--format', choices=['text', 'json'], default='text')
+
+    def handle(self, *args, **options):
+        deals, leads = Deal.objects.all(), Lead.objects.all()
+        user = None
+        if options['assigned_to']:
+            user = User.objects.filter(username=options['assigned_to']).first()
+            if user is None:
+                raise CommandError(f'Unknown user {options["assigned_to"]!r}')
+            deals = deals.filter(assigned_to=user)
+            leads = leads.filter(assigned_to=user)
+        report = pipeline_report(deals, leads, months=max(options['months'], 1), assigned_to=user and user.pk)
+
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(report, cls=DjangoJSONEncoder, indent=2))
+            return
+
+        pipeline = report['pipeline']
+        self.stdout.write(f'Open pipeline: {pipeline["count"]} deals, '
+                          f'{pipeline["total"]} total, {pipeline["weighted"]} weighted')
+        for row in pipeline['stages']:
+            self.stdout.write(f'  {row["label"]:<15} {row["count"]:>7} {row["total"]:>16} {row["weighted"]:>16}')
+
+        for key, title in [('deal_funnel', 'Deal funnel'), ('lead_funnel', 'Lead funnel')]:
+            self.stdout.write(f'\n{title} ({report[key]["lost"]} lost not shown)')
+            for step in report[key]['steps']:
+                self.stdout.write(f'  {step["label"]:<15} {step["reached"]:>7} {step["conversion"]:>6}%')
+
+        self.stdout.write('\nWin rates')
+        for row in report['win_rates']:
+            self.stdout.write(f'  {row["username"]:<15} {row["won"]:>5} won {row["lost"]:>5} lost '
+                              f'{row["win_rate"]:>6}% {row["won_amount"]:>16}')
+
+        forecast = report['forecast']
+        self.stdout.write('\nForecast by expected close month')
+        overdue = forecast['overdue']
+        self.stdout.write(f'  {"Overdue":<15} {overdue["count"]:>7} {overdue["total"]:>16} {overdue["weighted"]:>16}')
+        for row in forecast['months']:
+            self.stdout.write(f'  {row["month"]:%Y-%m}{"":<8} {row["count"]:>7} {row["total"]:>16} {row["weighted"]:>16}')
+
+        self.stdout.write('\nCohorts by created month')
+        for row in report['cohorts']:
+            self.stdout.write(f'  {row["month"]:%Y-%m}{"":<8} {row["count"]:>7} deals {row["closed_rate"]:>6}% closed '
+                              f'{row["win_rate"]:>6}% won')
+
+        self.stdout.write('\nDays in stage before moving on (average, median, 90th percentile)')
+        for row in report['stage_velocity']['stages']:
+            days = ['-' if row[key] is None else row[key] for key in ('avg_days', 'p50_days', 'p90_days')]
+            self.stdout.write(f'  {row["label"]:<15} {row["count"]:>7} moved '
+                              + ' '.join(f'{value:>7}' for value in days))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from crm import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'entities', nargs='*', choices=sorted(search.ENTITIES),
+            help='Only rebuild these entities (default: all)',
+        )
+
+    def handle(self, *args, **options):
+        counts = search.rebuild(options['entities'] or None)
+        for entity, count in counts.items():
+            self.stdout.write(f'{entity}: {count} indexed')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from crm import stages
+from crm.models import DashboardStats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized dashboard statistics and time-in-stage rollup from the source tables'
+
+    def handle(self, *args, **options):
+        stats = DashboardStats.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt dashboard stats: {stats.total_companies} companies, '
+            f'{stats.total_contacts} contacts, {stats.total_leads} leads, '
+            f'{stats.total_deals} deals'
+        ))
+        stays = stages.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt time in stage from {stays} recorded stage moves'))
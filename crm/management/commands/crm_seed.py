@@ -0,0 +1,306 @@
+import math
+import random
+import time
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from itertools import accumulate
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from crm import cache, dedupe, search, stages
+from crm.models import Company, Contact, Lead, Deal, Activity, DashboardStats, DealStageChange
+
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda', 'William', 'Elizabeth',
+    'David', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen',
+    'Daniel', 'Nancy', 'Matthew', 'Lisa', 'Anthony', 'Betty', 'Mark', 'Margaret', 'Steven', 'Sandra',
+    'Priya', 'Wei', 'Fatima', 'Carlos', 'Yuki', 'Olga', 'Ahmed', 'Sofia', 'Liam', 'Aisha',
+]
+LAST_NAMES = [
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez', 'Martinez',
+    'Hernandez', 'Lopez', 'Gonzalez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark', 'Ramirez', 'Lewis', 'Robinson',
+    'Patel', 'Chen', 'Khan', 'Silva', 'Tanaka', 'Ivanova', 'Nguyen', 'Rossi', 'Murphy', 'Okafor',
+]
+WORDS = [
+    'Acme', 'Apex', 'Blue', 'Bright', 'Cedar', 'Core', 'Delta', 'Echo', 'Falcon', 'Global', 'Granite', 'Harbor',
+    'Iron', 'Keystone', 'Lumen', 'Maple', 'Nexus', 'North', 'Orbit', 'Pioneer', 'Quantum', 'River', 'Summit',
+    'Titan', 'Union', 'Vertex', 'Willow', 'Zenith',
+]
+SUFFIXES = ['Inc', 'LLC', 'Ltd', 'Group', 'Systems', 'Labs', 'Partners', 'Holdings', 'Solutions', 'Corp']
+INDUSTRIES = [
+    ('Software', 25), ('Manufacturing', 15), ('Healthcare', 12), ('Finance', 12), ('Retail', 10),
+    ('Education', 6), ('Logistics', 6), ('Energy', 5), ('Media', 5), ('Hospitality', 4),
+]
+CITIES = [
+    ('New York', 'NY', 'USA', 14), ('San Francisco', 'CA', 'USA', 10), ('Chicago', 'IL', 'USA', 8),
+    ('Austin', 'TX', 'USA', 7), ('London', None, 'UK', 10), ('Berlin', None, 'Germany', 7),
+    ('Toronto', 'ON', 'Canada', 6), ('Sydney', 'NSW', 'Australia', 5), ('Bangalore', 'KA', 'India', 8),
+    ('Singapore', None, 'Singapore', 5),
+]
+FREE_MAIL = ['gmail.com', 'yahoo.com', 'outlook.com']
+CONTACT_TYPES = [('prospect', 45), ('customer', 35), ('partner', 12), ('vendor', 8)]
+LEAD_STATUSES = [('new', 35), ('contacted', 25), ('qualified', 20), ('converted', 10), ('closed_lost', 10)]
+LEAD_SOURCES = [('website', 30), ('referral', 20), ('social_media', 15), ('email_campaign', 12),
+                ('trade_show', 8), ('cold_call', 10), ('other', 5)]
+# stage -> (weight, probability)
+DEAL_STAGES = {
+    'prospecting': (30, 10), 'qualification': (20, 25), 'proposal': (15, 50),
+    'negotiation': (10, 75), 'closed_won': (15, 100), 'closed_lost': (10, 0),
+}
+# Median days a deal spends in each open stage before moving on.
+STAGE_STAYS = {'prospecting': 4, 'qualification': 6, 'proposal': 9, 'negotiation': 14}
+OPEN_STAGES = list(STAGE_STAYS)
+ACTIVITY_TYPES = [('call', 35), ('email', 30), ('meeting', 20), ('task', 10), ('note', 5)]
+
+DEFAULTS = {'companies': 20000, 'contacts': 200000, 'leads': 100000, 'deals': 100000, 'activities': 300000}
+
+
+def weighted(pairs):
+    values = [pair[0] for pair in pairs]
+    return values, list(accumulate(pair[-1] for pair in pairs))
+
+
+@contextmanager
+def preserve_timestamps(*models):
+    # auto_now/auto_now_add would stamp every generated row with "now";
+    # switched off here so created_at can spread over the history window.
+    saved = []
+    for model in models:
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+                saved.append((field, field.auto_now, field.auto_now_add))
+                field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = ('Generate related companies, contacts, leads, deals and activities with realistic '
+            'distributions using batched bulk_create (use --scale 5 for about 3.6 million rows)')
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULTS.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--scale', type=float, default=1.0, help='Multiply every count')
+        parser.add_argument('--users', type=int, default=25, help='Sales users records are assigned to')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--days', type=int, default=730, help='History window for created_at')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data sets')
+        parser.add_argument('--skip-index', action='store_true',
+                            help="Don't rebuild the search index and blocking keys afterwards")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.days = options['days']
+        counts = {name: int(options[name] * options['scale']) for name in DEFAULTS}
+        # Each entity hangs off the one before it.
+        for child, parent in [('contacts', 'companies'), ('deals', 'contacts'), ('activities', 'deals')]:
+            if counts[child] and not counts[parent]:
+                raise CommandError(f'{child.title()} need {parent}; pass --{parent}')
+        started = time.perf_counter()
+        self.users = self.seed_users(options['users'])
+        # Offset from existing rows so re-running adds to a seeded database
+        # without unique email clashes.
+        self.offset = Contact.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+
+        with preserve_timestamps(Company, Contact, Lead, Deal, Activity):
+            companies = self.seed_companies(counts['companies'])
+            contacts = self.seed_contacts(counts['contacts'], companies)
+            self.seed_leads(counts['leads'])
+            deals = self.seed_deals(counts['deals'], contacts)
+            self.seed_stage_history(deals)
+            self.seed_activities(counts['activities'], deals)
+
+        DashboardStats.rebuild()
+        stages.rebuild()
+        if not options['skip_index']:
+            self.stdout.write('Rebuilding search index and blocking keys...')
+            search.rebuild()
+            dedupe.rebuild()
+        cache.bump('company', 'contact', 'lead', 'deal', 'activity')
+        elapsed = time.perf_counter() - started
+        total = sum(counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {total} rows ({", ".join(f"{n} {name}" for name, n in counts.items())}) '
+            f'in {elapsed:.1f}s ({total / elapsed:.0f} rows/s)'
+        ))
+
+    # Helpers
+    def created_at(self):
+        # Skewed towards recent dates, as a growing business's data is.
+        return self.now - timedelta(days=self.days * self.rng.random() ** 2, seconds=self.rng.randrange(86400))
+
+    def pick(self, choices):
+        values, cum_weights = choices
+        return self.rng.choices(values, cum_weights=cum_weights)[0]
+
+    def insert(self, model, rows, total):
+        # rows yields unsaved instances; written batch by batch, each in its
+        # own transaction so progress survives an interrupted run. The new
+        # pks are kept in a compact array: millions of them fit in a few MB.
+        label = str(model._meta.verbose_name_plural).lower()
+        created, batch = array('q'), []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                created.extend(self.flush(model, batch))
+                batch = []
+                self.stdout.write(f'  {label}: {len(created)}' + (f'/{total}' if total is not None else ''))
+        if batch:
+            created.extend(self.flush(model, batch))
+        self.stdout.write(f'{label}: {len(created)}')
+        return created
+
+    def flush(self, model, batch):
+        with transaction.atomic():
+            return [obj.pk for obj in model.objects.bulk_create(batch)]
+
+    # Generators
+    def seed_users(self, count):
+        existing = set(User.objects.filter(username__startswith='seed-').values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=f'seed-{i}', first_name=FIRST_NAMES[i % len(FIRST_NAMES)],
+                 last_name=LAST_NAMES[i % len(LAST_NAMES)], email=f'seed-{i}@example.com')
+            for i in range(max(count, 1)) if f'seed-{i}' not in existing
+        )
+        return list(User.objects.filter(username__startswith='seed-').values_list('pk', flat=True))
+
+    def seed_companies(self, count):
+        industries, cities = weighted(INDUSTRIES), weighted([(city[:3], city[3]) for city in CITIES])
+
+        def rows():
+            for i in range(count):
+                name = f'{self.rng.choice(WORDS)} {self.rng.choice(WORDS)} {self.rng.choice(SUFFIXES)}'
+                slug = name.lower().replace(' ', '')
+                city, state, country = self.pick(cities)
+                created = self.created_at()
+                yield Company(
+                    name=name, industry=self.pick(industries), website=f'https://{slug}{i}.example.com',
+                    email=f'info@{slug}{i}.example.com', phone=f'+1 555 {self.rng.randrange(10 ** 7):07d}',
+                    city=city, state=state, country=country, created_at=created, updated_at=created,
+                )
+        return self.insert(Company, rows(), count)
+
+    def seed_contacts(self, count, companies):
+        # Zipf-like company sizes: a few large accounts, a long tail of small ones.
+        cum_weights = list(accumulate(1 / (rank + 1) ** 1.1 for rank in range(len(companies))))
+        types = weighted(CONTACT_TYPES)
+        company_ids = array('q')
+
+        def rows():
+            for i in range(count):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                company_id = self.rng.choices(companies, cum_weights=cum_weights)[0]
+                company_ids.append(company_id)
+                domain = self.rng.choice(FREE_MAIL) if self.rng.random() < 0.2 else f'company{company_id}.example.com'
+                created = self.created_at()
+                yield Contact(
+                    first_name=first, last_name=last,
+                    email=f'{first}.{last}.{self.offset + i}@{domain}'.lower(),
+                    phone=f'+1 555 {self.rng.randrange(10 ** 7):07d}' if self.rng.random() < 0.7 else None,
+                    company_id=company_id, contact_type=self.pick(types),
+                    assigned_to_id=self.rng.choice(self.users), created_at=created, updated_at=created,
+                )
+        return self.insert(Contact, rows(), count), company_ids
+
+    def seed_leads(self, count):
+        statuses, sources = weighted(LEAD_STATUSES), weighted(LEAD_SOURCES)
+
+        def rows():
+            for i in range(count):
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                created = self.created_at()
+                yield Lead(
+                    first_name=first, last_name=last, email=f'{first}.{last}{i}@lead.example.com'.lower(),
+                    company_name=f'{self.rng.choice(WORDS)} {self.rng.choice(SUFFIXES)}',
+                    status=self.pick(statuses), source=self.pick(sources),
+                    assigned_to_id=self.rng.choice(self.users), created_at=created, updated_at=created,
+                )
+        return self.insert(Lead, rows(), count)
+
+    def seed_deals(self, count, contacts):
+        stage_choices = weighted([(stage, weight) for stage, (weight, _) in DEAL_STAGES.items()])
+        contact_pks, company_ids = contacts
+        contact_ids, created_ats = array('q'), array('d')
+        stage_names, stage_codes, owner_ids = list(DEAL_STAGES), array('b'), array('q')
+
+        def rows():
+            for _ in range(count):
+                index = self.rng.randrange(len(contact_pks))
+                contact_id, company_id = contact_pks[index], company_ids[index]
+                stage = self.pick(stage_choices)
+                created = self.created_at()
+                owner = self.rng.choice(self.users)
+                contact_ids.append(contact_id)
+                created_ats.append(created.timestamp())
+                stage_codes.append(stage_names.index(stage))
+                owner_ids.append(owner)
+                # Log-normal amounts: mostly a few thousand, occasionally six figures.
+                amount = Decimal(min(self.rng.lognormvariate(9, 1.1), 9_999_999)).quantize(Decimal('0.01'))
+                yield Deal(
+                    title=f'{self.rng.choice(WORDS)} {self.rng.choice(["renewal", "expansion", "pilot", "license"])}',
+                    contact_id=contact_id, company_id=company_id, amount=amount, stage=stage,
+                    priority=self.rng.choice(['low', 'medium', 'medium', 'high']),
+                    probability=DEAL_STAGES[stage][1],
+                    expected_close_date=(created + timedelta(days=self.rng.randint(14, 180))).date(),
+                    assigned_to_id=owner, created_at=created, updated_at=created,
+                )
+        return self.insert(Deal, rows(), count), contact_ids, created_ats, stage_codes, owner_ids
+
+    def seed_stage_history(self, deals):
+        # Walks each deal through the open stages up to the one it was
+        # generated in; lost deals drop out after a random open stage.
+        deal_pks, _, created_ats, stage_codes, owner_ids = deals
+        stage_names = list(DEAL_STAGES)
+
+        def rows():
+            for index, deal_id in enumerate(deal_pks):
+                stage, owner = stage_names[stage_codes[index]], owner_ids[index]
+                if stage in OPEN_STAGES:
+                    path = OPEN_STAGES[:OPEN_STAGES.index(stage) + 1]
+                elif stage == 'closed_won':
+                    path = OPEN_STAGES + [stage]
+                else:
+                    path = OPEN_STAGES[:self.rng.randint(1, len(OPEN_STAGES))] + [stage]
+                changed = datetime.fromtimestamp(created_ats[index], tz=dt_timezone.utc)
+                stays = [self.rng.lognormvariate(math.log(STAGE_STAYS[name] * 86400), 0.8) for name in path[:-1]]
+                # Squeezed so the last move happens before now.
+                scale = min(1, (self.now - changed).total_seconds() * 0.95 / sum(stays)) if stays else 1
+                yield DealStageChange(deal_id=deal_id, to_stage=path[0], assigned_to_id=owner, changed_at=changed)
+                for from_stage, to_stage, stay in zip(path, path[1:], stays):
+                    changed += timedelta(seconds=stay * scale)
+                    yield DealStageChange(deal_id=deal_id, from_stage=from_stage, to_stage=to_stage,
+                                          assigned_to_id=owner, changed_at=changed)
+        return self.insert(DealStageChange, rows(), None)
+
+    def seed_activities(self, count, deals):
+        types = weighted(ACTIVITY_TYPES)
+        deal_pks, contact_ids, created_ats = deals[:3]
+
+        def rows():
+            for _ in range(count):
+                index = self.rng.randrange(len(deal_pks))
+                deal_id, contact_id = deal_pks[index], contact_ids[index]
+                deal_created = datetime.fromtimestamp(created_ats[index], tz=dt_timezone.utc)
+                due = deal_created + timedelta(days=self.rng.uniform(0, 120))
+                done = due < self.now and self.rng.random() < 0.85
+                created = min(deal_created + timedelta(days=self.rng.uniform(0, 30)), self.now)
+                activity_type = self.pick(types)
+                yield Activity(
+                    title=f'{activity_type.title()} about {self.rng.choice(WORDS)}', activity_type=activity_type,
+                    status='completed' if done else self.rng.choice(['planned'] * 9 + ['cancelled']),
+                    contact_id=contact_id, deal_id=deal_id, assigned_to_id=self.rng.choice(self.users),
+                    due_date=due, completed_at=due if done else None, created_at=created, updated_at=created,
+                )
+        return self.insert(Activity, rows(), count)
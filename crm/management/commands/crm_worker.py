@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connections
+
+from crm import jobs
+
+
+def _init_process():
+    # Spawned children start from a clean interpreter, so they share no
+    # database connections with the dispatcher.
+    django.setup()
+
+
+def _run(job_id):
+    try:
+        return jobs.run_by_id(job_id)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (imports, exports, rebuilds, reassignments)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', '-p', type=int, default=os.cpu_count() or 1,
+                            help='Worker processes; 0 runs jobs in this process')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once no jobs are due instead of polling')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        worker = jobs.worker_id()
+
+        requeued, failed = jobs.requeue_stale()
+        if requeued or failed:
+            self.stdout.write(f'Recovered stale jobs: {requeued} requeued, {failed} failed')
+
+        if options['processes'] <= 0:
+            ran = self.run_inline(worker, options)
+        else:
+            ran = self.run_pool(worker, options)
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker} ran {ran} job(s)'))
+
+    def stop(self, signum, frame):
+        # Finish the jobs in flight, but don't claim any more.
+        self.stopping = True
+
+    def claim(self, worker):
+        try:
+            return jobs.claim(worker)
+        except OperationalError:
+            # Another worker holds the SQLite write lock; try again shortly.
+            return None
+
+    def run_inline(self, worker, options):
+        ran = 0
+        while not self.stopping:
+            job = self.claim(worker)
+            if job is None:
+                if options['burst']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+            self.stdout.write(f'Running {job}')
+            jobs.run(job)
+            ran += 1
+        return ran
+
+    def run_pool(self, worker, options):
+        size = options['processes']
+        ran = 0
+        running = set()
+        connections.close_all()
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(size, mp_context=context, initializer=_init_process) as pool:
+            while not self.stopping or running:
+                job = None
+                if not self.stopping and len(running) < size:
+                    job = self.claim(worker)
+                if job is not None:
+                    self.stdout.write(f'Running {job}')
+                    running.add(pool.submit(_run, job.pk))
+                    ran += 1
+                    continue
+                if not running:
+                    if options['burst'] or self.stopping:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception():
+                        self.stderr.write(f'Worker process failed: {future.exception()}')
+        return ran
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_companies', models.PositiveIntegerField(default=0)),
+                ('total_contacts', models.PositiveIntegerField(default=0)),
+                ('total_leads', models.PositiveIntegerField(default=0)),
+                ('total_deals', models.PositiveIntegerField(default=0)),
+                ('won_deals', models.PositiveIntegerField(default=0)),
+                ('converted_leads', models.PositiveIntegerField(default=0)),
+                ('total_deal_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Dashboard stats',
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:43
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+
+SQLITE_FTS = [
+    "CREATE VIRTUAL TABLE crm_searchentry_fts USING fts5("
+    "body, entity, content='crm_searchentry', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER crm_searchentry_ai AFTER INSERT ON crm_searchentry BEGIN "
+    "INSERT INTO crm_searchentry_fts(rowid, body, entity) VALUES (new.id, new.body, new.entity); END",
+    "CREATE TRIGGER crm_searchentry_ad AFTER DELETE ON crm_searchentry BEGIN "
+    "INSERT INTO crm_searchentry_fts(crm_searchentry_fts, rowid, body, entity) "
+    "VALUES ('delete', old.id, old.body, old.entity); END",
+    "CREATE TRIGGER crm_searchentry_au AFTER UPDATE ON crm_searchentry BEGIN "
+    "INSERT INTO crm_searchentry_fts(crm_searchentry_fts, rowid, body, entity) "
+    "VALUES ('delete', old.id, old.body, old.entity); "
+    "INSERT INTO crm_searchentry_fts(rowid, body, entity) VALUES (new.id, new.body, new.entity); END",
+]
+
+SQLITE_FTS_DROP = [
+    "DROP TRIGGER IF EXISTS crm_searchentry_au",
+    "DROP TRIGGER IF EXISTS crm_searchentry_ad",
+    "DROP TRIGGER IF EXISTS crm_searchentry_ai",
+    "DROP TABLE IF EXISTS crm_searchentry_fts",
+]
+
+POSTGRES_INDEX = [
+    "CREATE INDEX crm_searchentry_body_tsv ON crm_searchentry USING gin (to_tsvector('simple', body))",
+]
+
+POSTGRES_INDEX_DROP = [
+    "DROP INDEX IF EXISTS crm_searchentry_body_tsv",
+]
+
+
+def create_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            for statement in SQLITE_FTS:
+                schema_editor.execute(statement)
+        except OperationalError:
+            # SQLite built without FTS5; crm.search falls back to LIKE.
+            for statement in SQLITE_FTS_DROP:
+                schema_editor.execute(statement)
+    elif vendor == 'postgresql':
+        for statement in POSTGRES_INDEX:
+            schema_editor.execute(statement)
+
+
+def drop_text_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for statement in SQLITE_FTS_DROP:
+            schema_editor.execute(statement)
+    elif vendor == 'postgresql':
+        for statement in POSTGRES_INDEX_DROP:
+            schema_editor.execute(statement)
+
+
+def index_existing_rows(apps, schema_editor):
+    # Tables that already hold data would otherwise search empty until
+    # crm_rebuild_search is run.
+    from crm import search
+    search.rebuild(['company', 'contact', 'lead', 'deal', 'activity'], apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0002_dashboardstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('company', 'Company'), ('contact', 'Contact'), ('lead', 'Lead'), ('deal', 'Deal'), ('activity', 'Activity')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('body', models.TextField()),
+            ],
+            options={
+                'verbose_name_plural': 'Search entries',
+                'constraints': [models.UniqueConstraint(fields=('entity', 'object_id'), name='crm_searchentry_entity_object')],
+            },
+        ),
+        migrations.RunPython(create_text_index, drop_text_index),
+        migrations.RunPython(index_existing_rows, migrations.RunPython.noop),
+    ]
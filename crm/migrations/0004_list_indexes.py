@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-17 06:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_searchentry'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-due_date', '-id'], name='crm_activity_due_id'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['status', '-due_date', '-id'], name='crm_activity_status_due_id'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['-created_at'], name='crm_activity_created'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(condition=models.Q(('status', 'planned')), fields=['due_date'], name='crm_activity_planned_due'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['name', 'id'], name='crm_company_name_id'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['last_name', 'id'], name='crm_contact_last_name_id'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['-created_at', '-id'], name='crm_deal_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(fields=['stage', '-created_at', '-id'], name='crm_deal_stage_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['-created_at', '-id'], name='crm_lead_created_id'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='crm_lead_status_created_id'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:22
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0006_requestmetric'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='crm_company_name_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(django.db.models.functions.text.Lower('last_name'), name='crm_contact_last_name_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(django.db.models.functions.text.Lower('first_name'), name='crm_contact_first_name_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(django.db.models.functions.text.Lower('email'), name='crm_contact_email_lower'),
+        ),
+        migrations.AddIndex(
+            model_name='deal',
+            index=models.Index(django.db.models.functions.text.Lower('title'), name='crm_deal_title_lower'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0007_autocomplete_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lead',
+            name='converted_contact',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='converted_leads', to='crm.contact'),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='converted_deal',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='converted_leads', to='crm.deal'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-17 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0008_lead_conversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockingKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('company', 'Company'), ('contact', 'Contact'), ('lead', 'Lead')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('email', 'Email'), ('domain', 'Email domain'), ('name', 'Phonetic name'), ('phone', 'Phone')], max_length=10)),
+                ('key', models.CharField(max_length=255)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['entity', 'kind', 'key'], name='crm_blockingkey_block'), models.Index(fields=['entity', 'object_id'], name='crm_blockingkey_object')],
+            },
+        ),
+    ]
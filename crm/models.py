@@ -1,8 +1,46 @@
+import asyncio
+
 from django.db import models
 from django.contrib.auth.models import User
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Lower
 from django.utils import timezone
 
-class Company(models.Model):
+class TrackedFieldsMixin(models.Model):
+    # Remembers the values a row was loaded with so signal handlers can see
+    # what changed on save without re-reading the row.
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def loaded_value(self, field_name, default=None):
+        return getattr(self, '_loaded_values', {}).get(field_name, default)
+
+class CompanyQuerySet(models.QuerySet):
+    def with_totals(self):
+        # Correlated subqueries rather than joins so contact and deal rows
+        # don't multiply each other, and so the COUNT(*) for pagination can
+        # drop them entirely.
+        contacts = (Contact.objects.filter(company=OuterRef('pk')).order_by()
+                    .values('company').annotate(n=Count('pk')).values('n'))
+        deals = (Deal.objects.filter(company=OuterRef('pk')).order_by()
+                 .values('company').annotate(n=Count('pk'), total=Sum('amount')))
+        return self.annotate(
+            contact_count=Coalesce(Subquery(contacts), 0),
+            deal_count=Coalesce(Subquery(deals.values('n')), 0),
+            deal_total=Coalesce(
+                Subquery(deals.values('total')),
+                Value(0),
+                output_field=DecimalField(max_digits=16, decimal_places=2),
+            ),
+        )
+
+class Company(TrackedFieldsMixin):
     name = models.CharField(max_length=200)
     industry = models.CharField(max_length=100, blank=True, null=True)
     website = models.URLField(blank=True, null=True)
@@ -16,13 +54,20 @@ class Company(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CompanyQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Companies"
+        indexes = [
+            models.Index(fields=['name', 'id'], name='crm_company_name_id'),
+            # Autocomplete prefix search (crm.autocomplete)
+            models.Index(Lower('name'), name='crm_company_name_lower'),
+        ]
 
     def __str__(self):
         return self.name
 
-class Contact(models.Model):
+class Contact(TrackedFieldsMixin):
     CONTACT_TYPE_CHOICES = [
         ('customer', 'Customer'),
         ('prospect', 'Prospect'),
@@ -48,6 +93,15 @@ class Contact(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_name', 'id'], name='crm_contact_last_name_id'),
+            # Autocomplete prefix search (crm.autocomplete)
+            models.Index(Lower('last_name'), name='crm_contact_last_name_lower'),
+            models.Index(Lower('first_name'), name='crm_contact_first_name_lower'),
+            models.Index(Lower('email'), name='crm_contact_email_lower'),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
@@ -55,7 +109,7 @@ class Contact(models.Model):
     def full_name(self):
         return f"{self.first_name} {self.last_name}"
 
-class Lead(models.Model):
+class Lead(TrackedFieldsMixin):
     STATUS_CHOICES = [
         ('new', 'New'),
         ('contacted', 'Contacted'),
@@ -84,13 +138,24 @@ class Lead(models.Model):
     source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default='website')
     assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     notes = models.TextField(blank=True, null=True)
+    # Set by crm.conversion when the lead is converted.
+    converted_contact = models.ForeignKey('Contact', on_delete=models.SET_NULL, null=True, blank=True,
+                                          editable=False, related_name='converted_leads')
+    converted_deal = models.ForeignKey('Deal', on_delete=models.SET_NULL, null=True, blank=True,
+                                       editable=False, related_name='converted_leads')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='crm_lead_created_id'),
+            models.Index(fields=['status', '-created_at', '-id'], name='crm_lead_status_created_id'),
+        ]
+
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.company_name}"
 
-class Deal(models.Model):
+class Deal(TrackedFieldsMixin):
     STAGE_CHOICES = [
         ('prospecting', 'Prospecting'),
         ('qualification', 'Qualification'),
@@ -119,12 +184,20 @@ class Deal(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='crm_deal_created_id'),
+            models.Index(fields=['stage', '-created_at', '-id'], name='crm_deal_stage_created_id'),
+            # Autocomplete prefix search (crm.autocomplete)
+            models.Index(Lower('title'), name='crm_deal_title_lower'),
+        ]
+
     def __str__(self):
         return f"{self.title} - {self.company.name}"
 
     @property
     def weighted_amount(self):
-        return self.amount * (self.probability / 100)
+        return self.amount * self.probability / 100
 
 class Activity(models.Model):
     TYPE_CHOICES = [
@@ -155,6 +228,14 @@ class Activity(models.Model):
 
     class Meta:
         verbose_name_plural = "Activities"
+        indexes = [
+            models.Index(fields=['-due_date', '-id'], name='crm_activity_due_id'),
+            models.Index(fields=['status', '-due_date', '-id'], name='crm_activity_status_due_id'),
+            models.Index(fields=['-created_at'], name='crm_activity_created'),
+            # Dashboard "upcoming" panel: planned activities by due date.
+            models.Index(fields=['due_date'], name='crm_activity_planned_due',
+                         condition=models.Q(status='planned')),
+        ]
 
     def __str__(self):
         return f"{self.title} - {self.activity_type}"
@@ -162,4 +243,254 @@ class Activity(models.Model):
     def mark_completed(self):
         self.status = 'completed'
         self.completed_at = timezone.now()
-        self.save()
+        self.save(update_fields=['status', 'completed_at', 'updated_at'])
+
+class DealStageChange(models.Model):
+    # Append-only log of the stages a deal has been in; crm.stages writes a
+    # row when a deal is created and whenever its stage changes.
+    deal = models.ForeignKey(Deal, on_delete=models.CASCADE, related_name='stage_changes')
+    from_stage = models.CharField(max_length=20, choices=Deal.STAGE_CHOICES, blank=True)
+    to_stage = models.CharField(max_length=20, choices=Deal.STAGE_CHOICES)
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deal', 'changed_at'], name='crm_dealstage_deal_changed'),
+        ]
+
+    def __str__(self):
+        return f"{self.deal_id}: {self.from_stage or '-'} -> {self.to_stage}"
+
+class StageDuration(models.Model):
+    # Time-in-stage rollup: how many deals left `stage` in `month`, owned by
+    # `assigned_to`, after a stay that fell into duration bucket `bucket`
+    # (see crm.stages). Maintained incrementally as deals move; a key may
+    # have more than one row, so readers always sum.
+    month = models.DateField()
+    assigned_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    stage = models.CharField(max_length=20, choices=Deal.STAGE_CHOICES)
+    bucket = models.PositiveSmallIntegerField()
+    count = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'assigned_to', 'stage', 'bucket'], name='crm_stageduration_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.month:%Y-%m} {self.stage} #{self.bucket}: {self.count}"
+
+class DashboardStats(models.Model):
+    total_companies = models.PositiveIntegerField(default=0)
+    total_contacts = models.PositiveIntegerField(default=0)
+    total_leads = models.PositiveIntegerField(default=0)
+    total_deals = models.PositiveIntegerField(default=0)
+    won_deals = models.PositiveIntegerField(default=0)
+    converted_leads = models.PositiveIntegerField(default=0)
+    total_deal_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    SINGLETON_PK = 1
+
+    class Meta:
+        verbose_name_plural = "Dashboard stats"
+
+    def __str__(self):
+        return f"Dashboard stats ({self.updated_at:%Y-%m-%d %H:%M})"
+
+    @property
+    def lead_conversion_rate(self):
+        if not self.total_leads:
+            return 0
+        return round(self.converted_leads / self.total_leads * 100, 1)
+
+    @classmethod
+    def load(cls):
+        stats = cls.objects.filter(pk=cls.SINGLETON_PK).first()
+        if stats is None:
+            stats = cls.rebuild()
+        return stats
+
+    @classmethod
+    async def aload(cls):
+        stats = await cls.objects.filter(pk=cls.SINGLETON_PK).afirst()
+        if stats is None:
+            stats = await cls.arebuild()
+        return stats
+
+    @classmethod
+    def rebuild(cls):
+        stats, _ = cls.objects.update_or_create(
+            pk=cls.SINGLETON_PK,
+            defaults={
+                'total_companies': Company.objects.count(),
+                'total_contacts': Contact.objects.count(),
+                'total_leads': Lead.objects.count(),
+                'total_deals': Deal.objects.count(),
+                'won_deals': Deal.objects.filter(stage='closed_won').count(),
+                'converted_leads': Lead.objects.filter(status='converted').count(),
+                'total_deal_value': Deal.objects.aggregate(Sum('amount'))['amount__sum'] or 0,
+                'rebuilt_at': timezone.now(),
+            },
+        )
+        return stats
+
+    @classmethod
+    async def arebuild(cls):
+        # Same totals as rebuild(), with the aggregate queries issued concurrently.
+        (companies, contacts, leads, deals, won, converted, value) = await asyncio.gather(
+            Company.objects.acount(),
+            Contact.objects.acount(),
+            Lead.objects.acount(),
+            Deal.objects.acount(),
+            Deal.objects.filter(stage='closed_won').acount(),
+            Lead.objects.filter(status='converted').acount(),
+            Deal.objects.aaggregate(Sum('amount')),
+        )
+        stats, _ = await cls.objects.aupdate_or_create(
+            pk=cls.SINGLETON_PK,
+            defaults={
+                'total_companies': companies,
+                'total_contacts': contacts,
+                'total_leads': leads,
+                'total_deals': deals,
+                'won_deals': won,
+                'converted_leads': converted,
+                'total_deal_value': value['amount__sum'] or 0,
+                'rebuilt_at': timezone.now(),
+            },
+        )
+        return stats
+
+    @classmethod
+    def adjust(cls, **deltas):
+        # Applies counter deltas in a single UPDATE so concurrent writers
+        # never overwrite each other's increments.
+        changes = {field: models.F(field) + delta for field, delta in deltas.items() if delta}
+        if changes:
+            changes['updated_at'] = timezone.now()
+            cls.objects.filter(pk=cls.SINGLETON_PK).update(**changes)
+
+class SearchEntry(models.Model):
+    # One row per indexed object; crm.search keeps the SQLite FTS5 table or
+    # the Postgres tsvector index over `body` in step with it.
+    ENTITY_CHOICES = [
+        ('company', 'Company'),
+        ('contact', 'Contact'),
+        ('lead', 'Lead'),
+        ('deal', 'Deal'),
+        ('activity', 'Activity'),
+    ]
+
+    entity = models.CharField(max_length=20, choices=ENTITY_CHOICES)
+    object_id = models.BigIntegerField()
+    body = models.TextField()
+
+    class Meta:
+        verbose_name_plural = "Search entries"
+        constraints = [
+            models.UniqueConstraint(fields=['entity', 'object_id'], name='crm_searchentry_entity_object'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity}:{self.object_id}"
+
+class BlockingKey(models.Model):
+    # Normalized keys crm.dedupe groups records by: only records sharing a
+    # key (a block) are compared as possible duplicates.
+    ENTITY_CHOICES = [
+        ('company', 'Company'),
+        ('contact', 'Contact'),
+        ('lead', 'Lead'),
+    ]
+    KIND_CHOICES = [
+        ('email', 'Email'),
+        ('domain', 'Email domain'),
+        ('name', 'Phonetic name'),
+        ('phone', 'Phone'),
+    ]
+
+    entity = models.CharField(max_length=20, choices=ENTITY_CHOICES)
+    object_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    key = models.CharField(max_length=255)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['entity', 'kind', 'key'], name='crm_blockingkey_block'),
+            models.Index(fields=['entity', 'object_id'], name='crm_blockingkey_object'),
+        ]
+
+    def __str__(self):
+        return f"{self.entity}:{self.object_id} {self.kind}={self.key}"
+
+class Job(models.Model):
+    # A unit of background work run by `manage.py crm_worker`; see crm.jobs.
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=50)
+    args = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after', 'id'], name='crm_job_status_run_after'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    @property
+    def percent(self):
+        if self.status == 'succeeded':
+            return 100
+        if not self.total:
+            return 0
+        return min(100, round(self.progress / self.total * 100))
+
+class RequestMetric(models.Model):
+    # One row per request, flushed in batches by crm.perf.PerfMiddleware.
+    view = models.CharField(max_length=200)
+    method = models.CharField(max_length=10)
+    status = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    queries = models.PositiveIntegerField()
+    db_ms = models.FloatField()
+    duplicate_queries = models.PositiveIntegerField(default=0)
+    duplicates = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='crm_metric_created'),
+        ]
+
+    def __str__(self):
+        return f"{self.method} {self.view} {self.duration_ms:.1f}ms"
@@ -0,0 +1,272 @@
+import asyncio
+import base64
+import binascii
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from . import counts
+
+PER_PAGE = 10
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+    # Duck-types the parts of django.core.paginator.Page the list templates use.
+    is_cursor = True
+
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    # Keyset pagination over a fixed ordering such as ('-created_at', '-id').
+    # The last key must be unique so every row has a distinct position; the
+    # ordering fields are assumed to be non-nullable.
+
+    def __init__(self, queryset, ordering, per_page=PER_PAGE):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.per_page = per_page
+        self.fields = [
+            queryset.model._meta.get_field(key.lstrip('-'))
+            for key in self.ordering
+        ]
+
+    def encode_cursor(self, obj, direction):
+        values = [field.value_to_string(obj) for field in self.fields]
+        payload = json.dumps([direction] + values, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, *values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in ('n', 'p') or len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            return direction, [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, binascii.Error, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _seek(self, values, forward):
+        # Builds (a > x) OR (a = x AND b > y) ... for the requested direction.
+        condition = Q()
+        equal = Q()
+        for key, field, value in zip(self.ordering, self.fields, values):
+            descending = key.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            condition |= equal & Q(**{f'{field.name}__{lookup}': value})
+            equal &= Q(**{field.name: value})
+        return condition
+
+    def _query(self, cursor):
+        direction, values = 'n', None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                direction, values = 'n', None
+
+        forward = direction == 'n'
+        if forward:
+            ordering = self.ordering
+        else:
+            ordering = [key[1:] if key.startswith('-') else f'-{key}' for key in self.ordering]
+
+        queryset = self.queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self._seek(values, forward))
+        return queryset[:self.per_page + 1], forward, values is not None
+
+    def _page(self, rows, forward, seeking):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if forward:
+            has_next, has_previous = has_more, seeking
+        else:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+
+        return CursorPage(
+            rows,
+            has_next=has_next,
+            has_previous=has_previous,
+            next_cursor=self.encode_cursor(rows[-1], 'n') if rows and has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], 'p') if rows and has_previous else None,
+        )
+
+    def get_page(self, cursor=None):
+        queryset, forward, seeking = self._query(cursor)
+        return self._page(list(queryset), forward, seeking)
+
+    async def aget_page(self, cursor=None):
+        queryset, forward, seeking = self._query(cursor)
+        return self._page([obj async for obj in queryset], forward, seeking)
+
+
+class EstimatedPage(Page):
+    # Without an exact count the paginator can't tell where the last page
+    # is, so the page reads one extra row to find out whether there is a
+    # next one.
+    more = None
+
+    def has_next(self):
+        if self.more is None:
+            return super().has_next()
+        return self.more
+
+    def window(self):
+        # The page links around this one; page_range would list every page
+        # of a million-row table.
+        if self.paginator.count_is_exact:
+            last = min(self.paginator.num_pages, self.number + 2)
+        else:
+            last = self.number + 1 if self.has_next() else self.number
+        return range(max(1, self.number - 2), last + 1)
+
+
+class EstimatedCountPaginator(Paginator):
+    # Counts through crm.counts: the maintained counters or planner
+    # statistics for unfiltered querysets, an exact COUNT(*) capped at
+    # CRM_COUNT_ESTIMATE_THRESHOLD rows for filtered ones. count_kind says
+    # which kind of figure count is; when it isn't exact any page number
+    # is accepted and an empty page past the end falls back as usual.
+    probe_filtered = True
+    count_kind = counts.EXACT
+
+    @cached_property
+    def count(self):
+        count, self.count_kind = counts.count_rows(self.object_list, self.probe_filtered)
+        return count
+
+    @property
+    def count_is_exact(self):
+        return self.count is not None and self.count_kind == counts.EXACT
+
+    @property
+    def count_label(self):
+        return counts.describe(self.count, self.count_kind)
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super().validate_number(number)
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def get_page(self, number):
+        if self.count_is_exact:
+            return super().get_page(number)
+        try:
+            return self.page(number)
+        except PageNotAnInteger:
+            return self.page(1)
+        except EmptyPage:
+            pass
+        # Past the end: the estimated last page, or the first if the
+        # estimate overshot.
+        try:
+            return self.page(self.num_pages)
+        except EmptyPage:
+            return self.page(1)
+
+    def page(self, number):
+        if self.count_is_exact:
+            return super().page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self.build_page(list(self.object_list[bottom:bottom + self.per_page + 1]), number)
+
+    def build_page(self, rows, number):
+        # rows holds up to per_page + 1 objects starting at the page's offset.
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        page = self._get_page(rows[:self.per_page], number, self)
+        page.more = len(rows) > self.per_page
+        return page
+
+    def _get_page(self, *args, **kwargs):
+        return EstimatedPage(*args, **kwargs)
+
+
+def cursor_mode(request):
+    return getattr(settings, 'CRM_CURSOR_PAGINATION', False) or 'cursor' in request.GET
+
+
+def paginate(request, queryset, ordering, per_page=PER_PAGE):
+    # Cursor pagination is opt-in (?cursor= or CRM_CURSOR_PAGINATION) and
+    # only applies to the view's natural ordering, not to ranked search results.
+    # The page is built on first access, so a cached list fragment skips
+    # the count and page queries entirely.
+    if cursor_mode(request) and not request.GET.get('search'):
+        paginator = CursorPaginator(queryset, ordering, per_page)
+        return SimpleLazyObject(lambda: paginator.get_page(request.GET.get('cursor')))
+    paginator = EstimatedCountPaginator(queryset, per_page)
+    return SimpleLazyObject(lambda: paginator.get_page(request.GET.get('page')))
+
+
+async def apaginate(request, queryset, ordering, per_page=PER_PAGE):
+    # Async counterpart of paginate() for the ASGI views. The page is loaded
+    # eagerly; in offset mode the count and the requested slice run together.
+    if cursor_mode(request) and not request.GET.get('search'):
+        return await CursorPaginator(queryset, ordering, per_page).aget_page(request.GET.get('cursor'))
+    try:
+        number = max(int(request.GET.get('page', 1)), 1)
+    except (TypeError, ValueError):
+        number = 1
+    offset = (number - 1) * per_page
+    (count, kind), rows = await asyncio.gather(
+        counts.acount_rows(queryset),
+        _alist(queryset[offset:offset + per_page + 1]),
+    )
+    paginator = EstimatedCountPaginator(queryset, per_page)
+    paginator.count, paginator.count_kind = count, kind
+    if not paginator.count_is_exact and (rows or number == 1):
+        return paginator.build_page(rows, number)
+    page = await sync_to_async(paginator.get_page)(number)
+    if page.number == number:
+        page.object_list = rows[:per_page]
+    else:
+        page.object_list = await _alist(page.object_list)
+    return page
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset]
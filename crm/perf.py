@@ -0,0 +1,381 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+from .models import RequestMetric
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists of any length share one signature: IN (%s, %s, ...) -> IN (...)
+PLACEHOLDER_LIST_RE = re.compile(r'\((?:%s, )*%s\)')
+MAX_SIGNATURE_LENGTH = 500
+MAX_DUPLICATES = 10
+FIELDS = ['view', 'method', 'status', 'duration_ms', 'queries', 'db_ms', 'duplicate_queries', 'duplicates',
+          'created_at']
+
+_buffer = deque()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+# The recorder of the request being served. Context variables follow async
+# views into the threads where sync_to_async runs their ORM calls, which a
+# wrapper installed per connection (connections are per thread) would miss.
+_current = ContextVar('crm_perf_recorder', default=None)
+
+
+def enabled():
+    return getattr(settings, 'CRM_PERF_ENABLED', True)
+
+
+def buffer_size():
+    return getattr(settings, 'CRM_PERF_BUFFER_SIZE', 1000)
+
+
+def flush_interval():
+    return getattr(settings, 'CRM_PERF_FLUSH_INTERVAL', 60)
+
+
+def jsonl_path():
+    return getattr(settings, 'CRM_PERF_JSONL', None)
+
+
+def retention_days():
+    return getattr(settings, 'CRM_PERF_RETENTION_DAYS', 30)
+
+
+def report_limit():
+    return getattr(settings, 'CRM_PERF_REPORT_LIMIT', 50000)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def summarize(latencies, elapsed, errors):
+    # Throughput and latency percentiles for a benchmark run (seconds in, ms out).
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def signature(sql):
+    return PLACEHOLDER_LIST_RE.sub('(...)', sql)[:MAX_SIGNATURE_LENGTH]
+
+
+class QueryRecorder:
+    # Database execute wrapper that counts and times every query a request
+    # runs. Params are kept out of the SQL, so equal text means the same
+    # statement issued again, usually from a loop (N+1).
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.count += 1
+            self.signatures[signature(sql)] += 1
+
+    @contextmanager
+    def activate(self):
+        token = _current.set(self)
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    def duplicates(self):
+        return {sql: count for sql, count in self.signatures.most_common(MAX_DUPLICATES) if count > 1}
+
+
+def _execute(execute, sql, params, many, context):
+    recorder = _current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    # connection_created receiver: routes every query through _execute.
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def record(request, response, seconds, recorder):
+    match = request.resolver_match
+    duplicates = recorder.duplicates()
+    sample = {
+        'view': match.view_name if match else '<unresolved>',
+        'method': request.method,
+        'status': response.status_code,
+        'duration_ms': round(seconds * 1000, 3),
+        'queries': recorder.count,
+        'db_ms': round(recorder.seconds * 1000, 3),
+        'duplicate_queries': sum(count - 1 for count in recorder.signatures.values()),
+        'duplicates': duplicates,
+        'created_at': timezone.now(),
+    }
+    with _lock:
+        _buffer.append(sample)
+        # Ring buffer: if flushing falls behind, the oldest samples go first.
+        while len(_buffer) > buffer_size():
+            _buffer.popleft()
+    return sample
+
+
+def clear():
+    with _lock:
+        _buffer.clear()
+
+
+def pending():
+    with _lock:
+        return list(_buffer)
+
+
+def _parse(line):
+    sample = json.loads(line)
+    sample['created_at'] = datetime.fromisoformat(sample['created_at'].replace('Z', '+00:00'))
+    return sample
+
+
+def _cutoff():
+    days = retention_days()
+    return None if days is None else timezone.now() - timedelta(days=days)
+
+
+def rotate_jsonl(path, cutoff):
+    # Once the oldest sample in the file is past the cutoff, the file moves
+    # to <path>.1 (replacing the previous one, all of whose samples are
+    # older still) and appends start a new file. A rename doesn't lose
+    # lines another process is appending.
+    try:
+        with open(path) as fh:
+            first = fh.readline()
+    except FileNotFoundError:
+        return False
+    if not first.strip() or _parse(first)['created_at'] >= cutoff:
+        return False
+    os.replace(path, f'{path}.1')
+    return True
+
+
+def prune():
+    # Drops samples older than CRM_PERF_RETENTION_DAYS (None keeps them
+    # all): RequestMetric rows are deleted, and the JSONL file is rotated,
+    # so it holds at most twice the retention period. Returns the number of
+    # rows deleted.
+    cutoff = _cutoff()
+    if cutoff is None:
+        return 0
+    path = jsonl_path()
+    if path:
+        rotate_jsonl(path, cutoff)
+        return 0
+    deleted, _ = RequestMetric.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def flush():
+    # Writes the buffered samples to CRM_PERF_JSONL if set, else to the
+    # RequestMetric table, then drops samples past the retention period.
+    # Returns the number written.
+    global _last_flush
+    with _lock:
+        samples = list(_buffer)
+        _buffer.clear()
+        _last_flush = time.monotonic()
+    if not samples:
+        return 0
+    try:
+        path = jsonl_path()
+        if path:
+            with open(path, 'a') as fh:
+                for sample in samples:
+                    fh.write(json.dumps(sample, cls=DjangoJSONEncoder) + '\n')
+        else:
+            RequestMetric.objects.bulk_create(RequestMetric(**sample) for sample in samples)
+        prune()
+    except (DatabaseError, OSError):
+        logger.exception('Could not flush %d request metrics', len(samples))
+        with _lock:
+            _buffer.extendleft(reversed(samples))
+        return 0
+    return len(samples)
+
+
+def maybe_flush():
+    # Never writes inside a caller's transaction (e.g. ATOMIC_REQUESTS or a
+    # test case): a rollback would take the metrics with it.
+    if time.monotonic() - _last_flush < flush_interval():
+        return 0
+    if any(connections[alias].in_atomic_block for alias in connections):
+        return 0
+    return flush()
+
+
+class PerfMiddleware:
+    # Records wall time, query count, DB time and repeated SQL for every
+    # request. Queries run while a streaming response is consumed happen
+    # after the middleware returns and aren't counted.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.activate():
+            response = self.get_response(request)
+        record(request, response, time.perf_counter() - started, recorder)
+        maybe_flush()
+        return response
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with recorder.activate():
+            response = await self.get_response(request)
+        record(request, response, time.perf_counter() - started, recorder)
+        await sync_to_async(maybe_flush)()
+        return response
+
+
+# Report
+def _reversed_lines(path, block_size=1 << 16):
+    # The file's lines, last first, reading blocks from the end.
+    try:
+        fh = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with fh:
+        position = fh.seek(0, os.SEEK_END)
+        tail = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            fh.seek(position)
+            lines = (fh.read(step) + tail).split(b'\n')
+            tail = lines.pop(0)
+            yield from reversed(lines)
+        yield tail
+
+
+def _read_jsonl(path, since, limit):
+    # Reads the current file and then the rotated one from the end, and
+    # stops at `limit` samples or the first sample older than `since`. Each
+    # process appends its buffer in one go, so lines are only out of order
+    # by up to a flush interval.
+    stop = since - timedelta(seconds=flush_interval())
+    samples = []
+    for name in (path, f'{path}.1'):
+        for line in _reversed_lines(name):
+            if not line.strip():
+                continue
+            sample = _parse(line)
+            if sample['created_at'] < stop:
+                return samples, False
+            if sample['created_at'] >= since:
+                if len(samples) == limit:
+                    return samples, True
+                samples.append(sample)
+    return samples, False
+
+
+def load_samples(since, limit=None):
+    # The newest `limit` stored samples since `since`, plus any still
+    # buffered, and whether older stored samples were left out.
+    limit = limit or report_limit()
+    path = jsonl_path()
+    if path:
+        stored, truncated = _read_jsonl(path, since, limit)
+    else:
+        stored = list(RequestMetric.objects.filter(created_at__gte=since).order_by('-created_at')
+                      .values(*FIELDS)[:limit + 1])
+        truncated = len(stored) > limit
+        stored = stored[:limit]
+    return stored + [sample for sample in pending() if sample['created_at'] >= since], truncated
+
+
+def view_summary(samples):
+    by_view = defaultdict(list)
+    for sample in samples:
+        by_view[sample['view']].append(sample)
+    rows = []
+    for view, group in by_view.items():
+        durations = [sample['duration_ms'] for sample in group]
+        queries = [sample['queries'] for sample in group]
+        rows.append({
+            'view': view,
+            'requests': len(group),
+            'p50_ms': round(percentile(durations, 50), 2),
+            'p95_ms': round(percentile(durations, 95), 2),
+            'p99_ms': round(percentile(durations, 99), 2),
+            'avg_queries': round(sum(queries) / len(group), 1),
+            'max_queries': max(queries),
+            'avg_db_ms': round(sum(sample['db_ms'] for sample in group) / len(group), 2),
+            'duplicate_requests': sum(1 for sample in group if sample['duplicate_queries']),
+        })
+    return sorted(rows, key=lambda row: row['p95_ms'], reverse=True)
+
+
+def repeated_sql(samples, limit=20):
+    totals = Counter()
+    views = defaultdict(set)
+    for sample in samples:
+        for sql, count in sample['duplicates'].items():
+            totals[sql] += count - 1
+            views[sql].add(sample['view'])
+    return [
+        {'sql': sql, 'repeats': repeats, 'views': sorted(views[sql])}
+        for sql, repeats in totals.most_common(limit)
+    ]
+
+
+def report(since):
+    samples, truncated = load_samples(since)
+    return {
+        'since': since,
+        'requests': len(samples),
+        # Only the newest CRM_PERF_REPORT_LIMIT samples are summarized.
+        'truncated': truncated,
+        'oldest': min((sample['created_at'] for sample in samples), default=None) if truncated else None,
+        'views': view_summary(samples),
+        'repeated_sql': repeated_sql(samples),
+    }
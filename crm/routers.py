@@ -0,0 +1,116 @@
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_SESSION_KEY = 'crm_primary_until'
+# Job state is polled while workers update it, so it is always read fresh.
+PRIMARY_ONLY_MODELS = {'job'}
+
+_state = ContextVar('crm_routing_state', default=None)
+
+
+def replicas():
+    return getattr(settings, 'CRM_REPLICA_DATABASES', [])
+
+
+def sticky_seconds():
+    return getattr(settings, 'CRM_REPLICA_STICKY_SECONDS', 10)
+
+
+def reading_from_replica():
+    state = _state.get()
+    return state is not None and state.use_replica
+
+
+def is_read_only_view(request):
+    match = request.resolver_match
+    if request.method not in ('GET', 'HEAD') or match is None or not match.url_name:
+        return False
+    name = match.url_name
+    return name == 'dashboard' or name.endswith(('_list', '_detail', '_autocomplete'))
+
+
+class RoutingState:
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+class ReplicaRouter:
+    # Sends CRM reads made by read-only views to a replica, and everything
+    # else to the primary. Reads outside a request (commands, the job worker)
+    # and reads of auth/session data always use the primary.
+    def _replicable(self, model):
+        return model._meta.app_label == 'crm' and model._meta.model_name not in PRIMARY_ONLY_MODELS
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replica or not replicas() or not self._replicable(model):
+            return None
+        return random.choice(replicas())
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None and model._meta.app_label != 'sessions':
+            state.wrote = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary.
+        return db not in replicas()
+
+
+class ReplicaRoutingMiddleware:
+    # Decides per request whether ReplicaRouter may use a replica. After a
+    # request writes anything, the session is pinned to the primary for
+    # CRM_REPLICA_STICKY_SECONDS so the user sees their own changes before
+    # the replicas catch up.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.pin_after_write(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = RoutingState()
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        self.pin_after_write(request, state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _state.get()
+        if state is not None and replicas() and is_read_only_view(request):
+            state.use_replica = request.session.get(PIN_SESSION_KEY, 0) < time.time()
+
+    def pin_after_write(self, request, state):
+        if state.wrote and replicas() and hasattr(request, 'session'):
+            request.session[PIN_SESSION_KEY] = time.time() + sticky_seconds()
@@ -0,0 +1,199 @@
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+
+from .counts import is_unfiltered
+from .models import Company, Contact, Lead, Deal, Activity, SearchEntry
+
+FTS_TABLE = 'crm_searchentry_fts'
+TS_CONFIG = 'simple'
+INDEX_BATCH_SIZE = 500
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _join(*parts):
+    return ' '.join(part for part in parts if part)
+
+
+# entity -> (model, select_related, document builder)
+ENTITIES = {
+    'company': (Company, [], lambda c: _join(c.name, c.industry, c.city)),
+    'contact': (Contact, ['company'], lambda c: _join(
+        c.first_name, c.last_name, c.email, c.company.name)),
+    'lead': (Lead, [], lambda l: _join(l.first_name, l.last_name, l.email, l.company_name)),
+    'deal': (Deal, ['company', 'contact'], lambda d: _join(
+        d.title, d.company.name, d.contact.first_name, d.contact.last_name)),
+    'activity': (Activity, ['contact', 'deal'], lambda a: _join(
+        a.title,
+        a.contact.first_name if a.contact else None,
+        a.contact.last_name if a.contact else None,
+        a.deal.title if a.deal else None)),
+}
+
+MODEL_ENTITIES = {model: entity for entity, (model, _, _) in ENTITIES.items()}
+
+
+def result_limit():
+    return getattr(settings, 'CRM_SEARCH_RESULT_LIMIT', 500)
+
+
+_fts5_available = None
+
+
+def _has_fts5():
+    global _fts5_available
+    if _fts5_available is None:
+        _fts5_available = FTS_TABLE in connection.introspection.table_names()
+    return _fts5_available
+
+
+def _tokens(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+# Indexing
+def _chunks(items, size=INDEX_BATCH_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _models(entity, apps=None):
+    # (model, SearchEntry); data migrations pass their historical apps.
+    model = ENTITIES[entity][0]
+    if apps is None:
+        return model, SearchEntry
+    return apps.get_model('crm', model.__name__), apps.get_model('crm', 'SearchEntry')
+
+
+def index_objects(entity, pks, apps=None):
+    _, related, build_document = ENTITIES[entity]
+    model, entry_model = _models(entity, apps)
+    for chunk in _chunks(pks):
+        objects = model.objects.select_related(*related).filter(pk__in=chunk)
+        entries = [
+            entry_model(entity=entity, object_id=obj.pk, body=build_document(obj))
+            for obj in objects
+        ]
+        with transaction.atomic():
+            entry_model.objects.filter(entity=entity, object_id__in=chunk).delete()
+            entry_model.objects.bulk_create(entries)
+
+
+def index_queryset(entity, queryset, apps=None):
+    for chunk in _chunks(queryset.values_list('pk', flat=True).iterator(chunk_size=INDEX_BATCH_SIZE)):
+        index_objects(entity, chunk, apps)
+
+
+def remove_objects(entity, pks):
+    SearchEntry.objects.filter(entity=entity, object_id__in=list(pks)).delete()
+
+
+def rebuild(entities=None, apps=None):
+    counts = {}
+    for entity in entities or ENTITIES:
+        model, entry_model = _models(entity, apps)
+        entry_model.objects.filter(entity=entity).delete()
+        index_queryset(entity, model.objects.order_by('pk'), apps)
+        counts[entity] = entry_model.objects.filter(entity=entity).count()
+    return counts
+
+
+# Querying
+def _sqlite_sql(entity, tokens):
+    match = 'entity : "%s" AND body : (%s)' % (entity, ' AND '.join('"%s"*' % t for t in tokens))
+    return (
+        f'SELECT e.object_id FROM {FTS_TABLE} f '
+        f'JOIN crm_searchentry e ON e.id = f.rowid '
+        f'WHERE {FTS_TABLE} MATCH %s',
+        [match],
+        f'ORDER BY bm25({FTS_TABLE}, 1.0, 0.0)',
+        [],
+    )
+
+
+def _postgresql_sql(entity, tokens):
+    tsquery = ' & '.join('%s:*' % t for t in tokens)
+    return (
+        f"SELECT e.object_id FROM crm_searchentry e "
+        f"WHERE e.entity = %s AND to_tsvector('{TS_CONFIG}', e.body) @@ to_tsquery('{TS_CONFIG}', %s)",
+        [entity, tsquery],
+        f"ORDER BY ts_rank(to_tsvector('{TS_CONFIG}', e.body), to_tsquery('{TS_CONFIG}', %s)) DESC",
+        [tsquery],
+    )
+
+
+def _index_sql(entity, tokens):
+    if connection.vendor == 'sqlite' and _has_fts5():
+        return _sqlite_sql(entity, tokens)
+    if connection.vendor == 'postgresql':
+        return _postgresql_sql(entity, tokens)
+    return None
+
+
+def _fallback_entries(entity, tokens):
+    entries = SearchEntry.objects.filter(entity=entity)
+    for token in tokens:
+        entries = entries.filter(body__icontains=token)
+    return entries.values_list('object_id', flat=True)
+
+
+def search_ids(entity, query, limit=None, within=None):
+    # Best-ranked matching object ids, at most `limit` of them. With
+    # `within`, only ids of rows in that queryset are ranked, so list
+    # filters apply before the limit rather than after it.
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+    limit = limit or result_limit()
+    if within is not None and is_unfiltered(within):
+        within = None
+    index_sql = _index_sql(entity, tokens)
+    if index_sql is None:
+        entries = _fallback_entries(entity, tokens)
+        if within is not None:
+            entries = entries.filter(object_id__in=within.order_by().values('pk'))
+        return list(entries[:limit])
+    select_sql, params, order_sql, order_params = index_sql
+    if within is not None:
+        within_sql, within_params = within.order_by().values('pk').query.sql_with_params()
+        select_sql = f'{select_sql} AND e.object_id IN ({within_sql})'
+        params = params + list(within_params)
+    with connection.cursor() as cursor:
+        cursor.execute(f'{select_sql} {order_sql} LIMIT %s', params + order_params + [limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def matching(entity, query):
+    # Every matching object id as a subquery for `pk__in`, unranked and
+    # unlimited; used where the full result set is needed (exports).
+    tokens = _tokens(query)
+    if not tokens:
+        return SearchEntry.objects.none().values_list('object_id', flat=True)
+    index_sql = _index_sql(entity, tokens)
+    if index_sql is None:
+        return _fallback_entries(entity, tokens)
+    select_sql, params, _, _ = index_sql
+    return RawSQL(select_sql, params)
+
+
+def filter_queryset(queryset, query):
+    # Restricts the (already filtered) queryset to its best-ranked matches
+    # and orders it by rank. Returns the queryset and whether the result
+    # limit cut the matches short.
+    entity = MODEL_ENTITIES[queryset.model]
+    limit = result_limit()
+    ids = search_ids(entity, query, limit + 1, within=queryset)
+    if not ids:
+        return queryset.none(), False
+    capped = len(ids) > limit
+    ids = ids[:limit]
+    rank = Case(
+        *[When(pk=pk, then=Value(position)) for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=ids).order_by(rank), capped
@@ -0,0 +1,196 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import cache, dedupe, perf, search, sqlite, stages
+from .models import Company, Contact, Lead, Deal, Activity, DashboardStats
+
+MISSING = object()
+
+
+def _refresh_loaded_values(instance, field_names):
+    # Keep the snapshot current so saving the same instance twice doesn't
+    # count the same transition twice.
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        loaded = instance._loaded_values = {}
+    for field_name in field_names:
+        loaded[field_name] = getattr(instance, field_name)
+
+
+# Stage history. Connected ahead of the dashboard receivers, which refresh
+# the loaded stage this compares against.
+@receiver(post_save, sender=Deal)
+def record_stage_change(sender, instance, created, **kwargs):
+    if created:
+        stages.record_created([instance])
+        return
+    old_stage = instance.loaded_value('stage', MISSING)
+    if old_stage is not MISSING and old_stage != instance.stage:
+        stages.record_moves([(instance.pk, old_stage, instance.stage, instance.assigned_to_id)])
+
+
+# Dashboard statistics
+@receiver(post_save, sender=Company)
+def company_saved(sender, instance, created, **kwargs):
+    if created:
+        DashboardStats.adjust(total_companies=1)
+
+
+@receiver(post_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    DashboardStats.adjust(total_companies=-1)
+
+
+@receiver(post_save, sender=Contact)
+def contact_saved(sender, instance, created, **kwargs):
+    if created:
+        DashboardStats.adjust(total_contacts=1)
+
+
+@receiver(post_delete, sender=Contact)
+def contact_deleted(sender, instance, **kwargs):
+    DashboardStats.adjust(total_contacts=-1)
+
+
+@receiver(post_save, sender=Lead)
+def lead_saved(sender, instance, created, **kwargs):
+    converted = int(instance.status == 'converted')
+    if created:
+        DashboardStats.adjust(total_leads=1, converted_leads=converted)
+    else:
+        old_status = instance.loaded_value('status', MISSING)
+        if old_status is not MISSING:
+            DashboardStats.adjust(converted_leads=converted - int(old_status == 'converted'))
+    _refresh_loaded_values(instance, ['status'])
+
+
+@receiver(post_delete, sender=Lead)
+def lead_deleted(sender, instance, **kwargs):
+    DashboardStats.adjust(total_leads=-1, converted_leads=-int(instance.status == 'converted'))
+
+
+@receiver(post_save, sender=Deal)
+def deal_saved(sender, instance, created, **kwargs):
+    won = int(instance.stage == 'closed_won')
+    amount = Decimal(instance.amount or 0)
+    if created:
+        DashboardStats.adjust(total_deals=1, won_deals=won, total_deal_value=amount)
+    else:
+        deltas = {}
+        old_stage = instance.loaded_value('stage', MISSING)
+        if old_stage is not MISSING:
+            deltas['won_deals'] = won - int(old_stage == 'closed_won')
+        old_amount = instance.loaded_value('amount', MISSING)
+        if old_amount is not MISSING:
+            deltas['total_deal_value'] = amount - Decimal(old_amount or 0)
+        DashboardStats.adjust(**deltas)
+    _refresh_loaded_values(instance, ['stage', 'amount'])
+
+
+@receiver(post_delete, sender=Deal)
+def deal_deleted(sender, instance, **kwargs):
+    DashboardStats.adjust(
+        total_deals=-1,
+        won_deals=-int(instance.stage == 'closed_won'),
+        total_deal_value=-Decimal(instance.amount or 0),
+    )
+
+
+def _changed(instance, created, field_names):
+    if created:
+        return False
+    return any(
+        instance.loaded_value(field_name, MISSING) != getattr(instance, field_name)
+        for field_name in field_names
+    )
+
+
+# Duplicate detection. Connected ahead of the search receivers, which refresh
+# the loaded name values this compares against, and leaves refreshing to them.
+def update_blocking_keys(sender, instance, created, **kwargs):
+    entity = search.MODEL_ENTITIES[sender]
+    fields = dedupe.ENTITIES[entity][1]
+    if created or _changed(instance, created, fields):
+        dedupe.index_objects(entity, [instance.pk])
+
+
+def remove_blocking_keys(sender, instance, **kwargs):
+    dedupe.remove_objects(search.MODEL_ENTITIES[sender], [instance.pk])
+
+
+for _entity, (_model, _) in dedupe.ENTITIES.items():
+    post_save.connect(update_blocking_keys, sender=_model, dispatch_uid=f'crm_dedupe_saved_{_entity}')
+    post_delete.connect(remove_blocking_keys, sender=_model, dispatch_uid=f'crm_dedupe_deleted_{_entity}')
+
+
+# Search index
+
+
+@receiver(post_save, sender=Company)
+def index_company(sender, instance, created, **kwargs):
+    search.index_objects('company', [instance.pk])
+    if _changed(instance, created, ['name']):
+        search.index_queryset('contact', instance.contacts.all())
+        search.index_queryset('deal', instance.deals.all())
+    _refresh_loaded_values(instance, ['name'])
+
+
+@receiver(post_save, sender=Contact)
+def index_contact(sender, instance, created, **kwargs):
+    search.index_objects('contact', [instance.pk])
+    if _changed(instance, created, ['first_name', 'last_name']):
+        search.index_queryset('deal', instance.deals.all())
+        search.index_queryset('activity', instance.activities.all())
+    _refresh_loaded_values(instance, ['first_name', 'last_name'])
+
+
+@receiver(post_save, sender=Lead)
+def index_lead(sender, instance, created, **kwargs):
+    search.index_objects('lead', [instance.pk])
+
+
+@receiver(post_save, sender=Deal)
+def index_deal(sender, instance, created, **kwargs):
+    search.index_objects('deal', [instance.pk])
+    if _changed(instance, created, ['title']):
+        search.index_queryset('activity', instance.activities.all())
+    _refresh_loaded_values(instance, ['title'])
+
+
+@receiver(post_save, sender=Activity)
+def index_activity(sender, instance, created, **kwargs):
+    search.index_objects('activity', [instance.pk])
+
+
+def unindex_object(sender, instance, **kwargs):
+    search.remove_objects(search.MODEL_ENTITIES[sender], [instance.pk])
+
+
+for _model in search.MODEL_ENTITIES:
+    post_delete.connect(unindex_object, sender=_model, dispatch_uid=f'crm_unindex_{_model._meta.model_name}')
+
+
+# Fragment cache
+def bump_fragment_version(sender, **kwargs):
+    cache.bump(search.MODEL_ENTITIES[sender])
+
+
+for _model in search.MODEL_ENTITIES:
+    post_save.connect(bump_fragment_version, sender=_model, dispatch_uid=f'crm_bump_saved_{_model._meta.model_name}')
+    post_delete.connect(bump_fragment_version, sender=_model, dispatch_uid=f'crm_bump_deleted_{_model._meta.model_name}')
+
+
+# Pages show user names and, through the session, who is logged in; saves
+# include the last_login update on every login.
+@receiver([post_save, post_delete], sender=User, dispatch_uid='crm_bump_user')
+def bump_user_version(sender, **kwargs):
+    cache.bump('user')
+
+
+# Database connections
+connection_created.connect(sqlite.apply_pragmas, dispatch_uid='crm_sqlite_pragmas')
+connection_created.connect(perf.install, dispatch_uid='crm_perf_install')
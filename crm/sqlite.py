@@ -0,0 +1,23 @@
+from django.conf import settings
+
+
+def pragmas():
+    return getattr(settings, 'CRM_SQLITE_PRAGMAS', {})
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    # connection_created receiver. Runs once per new connection, so with
+    # CONN_MAX_AGE the cost is paid once per worker thread, not per request.
+    if connection.vendor != 'sqlite':
+        return
+    for name, value in pragmas().items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
+
+
+def current_pragmas(connection, names=None):
+    with connection.cursor() as cursor:
+        values = {}
+        for name in names or pragmas():
+            cursor.execute(f'PRAGMA {name}')
+            values[name] = cursor.fetchone()[0]
+        return values
@@ -0,0 +1,145 @@
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Deal, DealStageChange, StageDuration
+
+# Stays are bucketed on a log scale, four buckets per doubling from a minute
+# up, so the rollup can merge months and owners and still answer percentile
+# queries. A bucket is 19% wide; interpolating inside it keeps percentiles
+# within a few percent of the exact value.
+BASE_SECONDS = 60
+BUCKETS_PER_DOUBLING = 4
+MAX_BUCKET = 120
+
+
+def bucket_for(seconds):
+    if seconds < BASE_SECONDS:
+        return 0
+    return min(int(math.log2(seconds / BASE_SECONDS) * BUCKETS_PER_DOUBLING) + 1, MAX_BUCKET)
+
+
+def bucket_bounds(bucket):
+    if bucket == 0:
+        return 0.0, float(BASE_SECONDS)
+    return (BASE_SECONDS * 2 ** ((bucket - 1) / BUCKETS_PER_DOUBLING),
+            BASE_SECONDS * 2 ** (bucket / BUCKETS_PER_DOUBLING))
+
+
+def percentile(buckets, fraction):
+    # buckets maps bucket -> count. Returns seconds, interpolated
+    # geometrically inside the bucket the rank falls in.
+    rank = fraction * sum(buckets.values())
+    seen = 0
+    for bucket in sorted(buckets):
+        count = buckets[bucket]
+        if count and seen + count >= rank:
+            low, high = bucket_bounds(bucket)
+            share = (rank - seen) / count
+            return high * share if bucket == 0 else low * (high / low) ** share
+        seen += count
+    return None
+
+
+def month_of(moment):
+    return timezone.localdate(moment).replace(day=1)
+
+
+def _totals(stays):
+    # stays yields (month, stage, assigned_to_id, seconds).
+    totals = defaultdict(lambda: [0, 0])
+    for month, stage, assigned_to_id, seconds in stays:
+        seconds = max(int(seconds), 0)
+        total = totals[month, stage, assigned_to_id, bucket_for(seconds)]
+        total[0] += 1
+        total[1] += seconds
+    return totals
+
+
+def add_stays(stays):
+    for (month, stage, assigned_to_id, bucket), (count, seconds) in _totals(stays).items():
+        key = {'month': month, 'stage': stage, 'assigned_to_id': assigned_to_id, 'bucket': bucket}
+        # Two writers can both miss and create a row for the same key; that
+        # only splits the key over two rows, which readers sum anyway.
+        updated = StageDuration.objects.filter(**key).update(
+            count=F('count') + count, total_seconds=F('total_seconds') + seconds,
+        )
+        if not updated:
+            StageDuration.objects.create(count=count, total_seconds=seconds, **key)
+
+
+def record_created(deals):
+    # Opens the history of newly created deals.
+    now = timezone.now()
+    DealStageChange.objects.bulk_create(
+        DealStageChange(deal_id=deal.pk, to_stage=deal.stage, assigned_to_id=deal.assigned_to_id,
+                        changed_at=deal.created_at or now)
+        for deal in deals
+    )
+
+
+def record_moves(moves, when=None):
+    # moves holds (deal_id, from_stage, to_stage, assigned_to_id) for deals
+    # whose stage has just been changed. Each move is logged, and the stay
+    # it ends is added to the rollup under the month it ended in and the
+    # deal's owner at that point.
+    moves = [move for move in moves if move[1] != move[2]]
+    if not moves:
+        return
+    when = when or timezone.now()
+    latest = DealStageChange.objects.filter(deal=OuterRef('pk')).order_by('-changed_at', '-pk')
+    entered = {
+        pk: (stage, changed_at)
+        for pk, stage, changed_at in Deal.objects.filter(pk__in=[move[0] for move in moves]).annotate(
+            entered_stage=Subquery(latest.values('to_stage')[:1]),
+            entered_at=Subquery(latest.values('changed_at')[:1]),
+        ).values_list('pk', 'entered_stage', 'entered_at')
+    }
+    month = month_of(when)
+    stays = []
+    for deal_id, from_stage, to_stage, assigned_to_id in moves:
+        stage, entered_at = entered.get(deal_id, (None, None))
+        # Deals from before the log existed have no known start for the
+        # stage they are leaving.
+        if stage == from_stage and entered_at is not None:
+            stays.append((month, from_stage, assigned_to_id, (when - entered_at).total_seconds()))
+    DealStageChange.objects.bulk_create(
+        DealStageChange(deal_id=deal_id, from_stage=from_stage, to_stage=to_stage,
+                        assigned_to_id=assigned_to_id, changed_at=when)
+        for deal_id, from_stage, to_stage, assigned_to_id in moves
+    )
+    add_stays(stays)
+
+
+def replay(changes):
+    # changes yields (deal_id, from_stage, to_stage, assigned_to_id,
+    # changed_at) ordered by deal and time; yields the stays they record.
+    previous = None
+    for change in changes:
+        deal_id, from_stage, _, assigned_to_id, changed_at = change
+        if previous and previous[0] == deal_id and previous[2] == from_stage:
+            yield month_of(changed_at), from_stage, assigned_to_id, (changed_at - previous[4]).total_seconds()
+        previous = change
+
+
+def rebuild():
+    # Recomputes the rollup from the whole log, e.g. after history was
+    # loaded in bulk.
+    changes = DealStageChange.objects.order_by('deal_id', 'changed_at', 'pk').values_list(
+        'deal_id', 'from_stage', 'to_stage', 'assigned_to_id', 'changed_at',
+    )
+    totals = _totals(replay(changes.iterator(chunk_size=10000)))
+    with transaction.atomic():
+        StageDuration.objects.all().delete()
+        StageDuration.objects.bulk_create(
+            (
+                StageDuration(month=month, stage=stage, assigned_to_id=assigned_to_id, bucket=bucket,
+                              count=count, total_seconds=seconds)
+                for (month, stage, assigned_to_id, bucket), (count, seconds) in totals.items()
+            ),
+            batch_size=5000,
+        )
+    return sum(count for count, _ in totals.values())
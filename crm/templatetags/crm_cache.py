@@ -0,0 +1,54 @@
+from django import template
+from django.template.base import token_kwargs
+
+from crm import cache, routers
+
+register = template.Library()
+
+
+class FragmentCacheNode(template.Node):
+    def __init__(self, nodelist, name, kwargs):
+        self.nodelist = nodelist
+        self.name = name
+        self.kwargs = kwargs
+
+    def render(self, context):
+        kwargs = {key: value.resolve(context) for key, value in self.kwargs.items()}
+        entities = [entity.strip() for entity in kwargs.get('entities', '').split(',') if entity.strip()]
+        user = context.get('user')
+        timeout = kwargs.get('timeout')
+        if routers.reading_from_replica():
+            # A replica may not have the write that bumped the version yet, so
+            # don't keep what it rendered for longer than replicas may lag.
+            timeout = min(cache.default_timeout() if timeout is None else timeout, routers.sticky_seconds())
+        return cache.get_or_render(
+            self.name.resolve(context),
+            getattr(user, 'pk', None),
+            entities,
+            lambda: self.nodelist.render(context),
+            vary=kwargs.get('vary', ''),
+            timeout=timeout,
+        )
+
+
+@register.tag
+def cachefragment(parser, token):
+    """
+    Caches the enclosed template per user until one of the listed entities
+    changes::
+
+        {% cachefragment 'contact_table' entities='contact,company' vary=request.get_full_path %}
+            ...
+        {% endcachefragment %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires a fragment name")
+    name = parser.compile_filter(bits[1])
+    remaining = bits[2:]
+    kwargs = token_kwargs(remaining, parser)
+    if remaining:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' only accepts keyword arguments after the name")
+    nodelist = parser.parse(('endcachefragment',))
+    parser.delete_first_token()
+    return FragmentCacheNode(nodelist, name, kwargs)
@@ -1,3 +1,2170 @@
-from django.test import TestCase
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.functions import Lower
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (analytics, autocomplete, bulk, cache, conditional, conversion, counts, dedupe, jobs, perf, routers,
+               search, sqlite, stages)
+from .forms import ActivityForm, ContactForm
+from .importers import CompanyImporter, ContactImporter, RejectWriter, read_rows
+from . import urls as crm_urls
+from .models import (Company, Contact, Lead, Deal, Activity, BlockingKey, DashboardStats, DealStageChange, Job,
+                     RequestMetric, SearchEntry, StageDuration)
+from .pagination import CursorPaginator
+
+
+class CRMTestMixin:
+    def setUp(self):
+        super().setUp()
+        # Rolled-back test data can reuse primary keys and entity versions.
+        cache.fragment_cache().clear()
+        cache.reset_stats()
+        perf.clear()
+
+    @classmethod
+    def create_user(cls, username='tester', **kwargs):
+        return User.objects.create_user(username=username, password='secret', **kwargs)
+
+    @classmethod
+    def create_company(cls, name='Acme', **kwargs):
+        return Company.objects.create(name=name, **kwargs)
+
+    @classmethod
+    def create_contact(cls, company, email='jane@example.com', **kwargs):
+        kwargs.setdefault('first_name', 'Jane')
+        kwargs.setdefault('last_name', 'Doe')
+        return Contact.objects.create(company=company, email=email, **kwargs)
+
+    @classmethod
+    def create_deal(cls, contact, amount='1000.00', **kwargs):
+        kwargs.setdefault('title', 'Big deal')
+        kwargs.setdefault('expected_close_date', date.today() + timedelta(days=30))
+        return Deal.objects.create(contact=contact, company=contact.company, amount=Decimal(amount), **kwargs)
+
+
+class DashboardStatsTests(CRMTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        DashboardStats.rebuild()
+        self.company = self.create_company()
+        self.contact = self.create_contact(self.company)
+
+    def assertStatsMatchRebuild(self):
+        incremental = DashboardStats.load()
+        rebuilt = DashboardStats.rebuild()
+        for field in ['total_companies', 'total_contacts', 'total_leads', 'total_deals',
+                      'won_deals', 'converted_leads', 'total_deal_value']:
+            self.assertEqual(getattr(incremental, field), getattr(rebuilt, field), field)
+
+    def test_creates_increment_totals(self):
+        self.create_deal(self.contact, amount='250.00', stage='closed_won')
+        Lead.objects.create(first_name='L', last_name='One', email='l@example.com', status='converted')
+        stats = DashboardStats.load()
+        self.assertEqual(stats.total_companies, 1)
+        self.assertEqual(stats.total_contacts, 1)
+        self.assertEqual(stats.total_deals, 1)
+        self.assertEqual(stats.won_deals, 1)
+        self.assertEqual(stats.total_deal_value, Decimal('250.00'))
+        self.assertEqual(stats.lead_conversion_rate, 100.0)
+
+    def test_updates_apply_deltas(self):
+        deal = self.create_deal(self.contact, amount='100.00')
+        deal = Deal.objects.get(pk=deal.pk)
+        deal.stage = 'closed_won'
+        deal.amount = Decimal('300.00')
+        deal.save()
+        deal.save()
+        lead = Lead.objects.create(first_name='L', last_name='One', email='l@example.com')
+        lead.status = 'converted'
+        lead.save()
+        stats = DashboardStats.load()
+        self.assertEqual(stats.won_deals, 1)
+        self.assertEqual(stats.total_deal_value, Decimal('300.00'))
+        self.assertEqual(stats.converted_leads, 1)
+        self.assertStatsMatchRebuild()
+
+    def test_cascading_delete_decrements_totals(self):
+        self.create_deal(self.contact, stage='closed_won')
+        self.company.delete()
+        stats = DashboardStats.load()
+        self.assertEqual(stats.total_companies, 0)
+        self.assertEqual(stats.total_contacts, 0)
+        self.assertEqual(stats.total_deals, 0)
+        self.assertEqual(stats.won_deals, 0)
+        self.assertStatsMatchRebuild()
+
+    def test_rebuild_command(self):
+        DashboardStats.objects.update(total_contacts=99)
+        call_command('crm_rebuild_stats', stdout=StringIO())
+        self.assertEqual(DashboardStats.load().total_contacts, 1)
+
+    def test_dashboard_reads_stats_row(self):
+        user = self.create_user()
+        self.client.force_login(user)
+        # session + user + stats row + recent + upcoming activities
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['stats'].total_contacts, 1)
+
+
+class SearchIndexTests(CRMTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.company = self.create_company(name='Initech', industry='Software', city='Austin')
+        self.contact = self.create_contact(self.company, first_name='Peter', last_name='Gibbons',
+                                           email='peter@initech.com')
+
+    def test_signals_index_new_objects(self):
+        self.assertEqual(search.search_ids('company', 'soft'), [self.company.pk])
+        self.assertEqual(search.search_ids('contact', 'initech gib'), [self.contact.pk])
+        self.assertEqual(search.search_ids('contact', 'lumbergh'), [])
+
+    def test_company_rename_reindexes_contacts(self):
+        company = Company.objects.get(pk=self.company.pk)
+        company.name = 'Initrode'
+        company.save()
+        self.assertEqual(search.search_ids('contact', 'initrode'), [self.contact.pk])
+
+    def test_prefix_matching(self):
+        other = self.create_contact(self.company, first_name='Peter', last_name='Peterson',
+                                    email='pp@example.com')
+        self.assertCountEqual(search.search_ids('contact', 'peter'), [self.contact.pk, other.pk])
+        self.assertEqual(search.search_ids('contact', 'peterson'), [other.pk])
+
+    def test_delete_removes_entries(self):
+        self.company.delete()
+        self.assertFalse(SearchEntry.objects.exists())
+
+    def test_rebuild(self):
+        SearchEntry.objects.all().delete()
+        counts = search.rebuild()
+        self.assertEqual(counts['contact'], 1)
+        self.assertEqual(search.search_ids('contact', 'peter'), [self.contact.pk])
+
+    def test_list_view_uses_index(self):
+        self.client.force_login(self.create_user())
+        response = self.client.get(reverse('contact_list'), {'search': 'gibbons'})
+        self.assertEqual(list(response.context['contacts']), [self.contact])
+
+    @override_settings(CRM_SEARCH_RESULT_LIMIT=20)
+    def test_list_filters_apply_before_the_result_limit(self):
+        user = self.create_user()
+        self.client.force_login(user)
+        Lead.objects.bulk_create(
+            Lead(first_name='Sam', last_name='Smith', email=f's{i}@example.com',
+                 status='qualified' if i >= 55 else 'new')
+            for i in range(60)
+        )
+        search.rebuild(['lead'])
+        response = self.client.get(reverse('lead_list'), {'search': 'smith', 'status': 'qualified'})
+        self.assertEqual(response.context['leads'].paginator.count, 5)
+        self.assertFalse(response.context['search_capped'])
+        self.assertContains(response, '5 leads')
+
+        response = self.client.get(reverse('lead_list'), {'search': 'smith'})
+        self.assertEqual(response.context['leads'].paginator.count, 20)
+        self.assertTrue(response.context['search_capped'])
+        self.assertContains(response, 'Showing the 20 best matching leads')
+
+        with override_settings(ROOT_URLCONF='crm.async_urls'):
+            response = self.client.get(reverse('lead_list'), {'search': 'smith', 'status': 'qualified'})
+        self.assertEqual(len(response.context['leads']), 5)
+
+
+class SearchMigrationTests(TransactionTestCase):
+    before = [('crm', '0002_dashboardstats')]
+    after = [('crm', '0003_searchentry')]
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes('crm'))
+        super().tearDown()
+
+    def test_existing_rows_are_indexed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        company = apps.get_model('crm', 'Company').objects.create(name='Initech')
+        apps.get_model('crm', 'Contact').objects.create(first_name='Peter', last_name='Gibbons',
+                                                        email='peter@initech.com', company=company)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        self.assertEqual(search.search_ids('company', 'initech'), [company.pk])
+        self.assertEqual(len(search.search_ids('contact', 'gibbons initech')), 1)
+
+
+class CursorPaginationTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        company = cls.create_company()
+        for i in range(25):
+            # Duplicate last names exercise the id tie-breaker.
+            cls.create_contact(company, email=f'c{i}@example.com', last_name=f'Name{i % 7}')
+
+    def test_walks_forward_and_back(self):
+        queryset = Contact.objects.all()
+        paginator = CursorPaginator(queryset, ['last_name', 'id'])
+        expected = list(queryset.order_by('last_name', 'id'))
+        pages, page = [], paginator.get_page()
+        while True:
+            pages.append(list(page))
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
+        self.assertEqual([c for p in pages for c in p], expected)
+        self.assertEqual([len(p) for p in pages], [10, 10, 5])
+
+        page = paginator.get_page(page.previous_cursor)
+        self.assertEqual(list(page), pages[1])
+        page = paginator.get_page(page.previous_cursor)
+        self.assertEqual(list(page), pages[0])
+        self.assertFalse(page.has_previous())
+
+    def test_invalid_cursor_returns_first_page(self):
+        paginator = CursorPaginator(Contact.objects.all(), ['-created_at', '-id'])
+        self.assertEqual(list(paginator.get_page('garbage')), list(paginator.get_page()))
+
+    def test_list_view_cursor_mode_skips_count(self):
+        self.client.force_login(self.create_user())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('contact_list'), {'cursor': ''})
+        self.assertTrue(response.context['contacts'].has_next())
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+        self.assertContains(response, f"?cursor={response.context['contacts'].next_cursor}")
+
+
+class FragmentCacheTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.other = cls.create_user('other')
+        cls.company = cls.create_company()
+        cls.contact = cls.create_contact(cls.company, assigned_to=cls.user)
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_second_render_is_a_hit(self):
+        first = self.client.get(reverse('contact_list'))
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(reverse('contact_list'))
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertFalse(any('crm_contact' in q['sql'] for q in queries.captured_queries))
+
+    def test_dashboard_hit_skips_stats_row(self):
+        self.client.get(reverse('dashboard'))
+        # session + user only
+        with self.assertNumQueries(2):
+            self.client.get(reverse('dashboard'))
+
+    def test_save_invalidates_dependent_fragments(self):
+        self.client.get(reverse('contact_list'))
+        self.client.get(reverse('company_list'))
+        self.company.name = 'Globex'
+        self.company.save()
+        self.assertContains(self.client.get(reverse('contact_list')), 'Globex')
+        self.assertContains(self.client.get(reverse('company_list')), 'Globex')
+        self.assertEqual(cache.stats()['hits'], 0)
+
+    def test_fragments_are_per_user_and_per_url(self):
+        self.client.get(reverse('contact_list'))
+        self.client.get(reverse('contact_list'), {'page': 2})
+        self.client.force_login(self.other)
+        self.client.get(reverse('contact_list'))
+        self.assertEqual(cache.stats(), {'hits': 0, 'misses': 3, 'hit_rate': 0.0})
+
+    def test_import_bumps_versions(self):
+        before = cache.entity_versions(['contact', 'company'])
+        ContactImporter().run(read_rows(StringIO('first_name,last_name,email,company\nA,B,a@example.com,New Co\n'), 'csv'))
+        after = cache.entity_versions(['contact', 'company'])
+        self.assertGreater(after['contact'], before['contact'])
+        self.assertGreater(after['company'], before['company'])
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.assertEqual(self.client.get(reverse('cache_stats')).status_code, 302)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('cache_stats'))
+        self.assertEqual(set(response.json()), {'hits', 'misses', 'hit_rate'})
+
+
+# Per-route ceilings for the number of queries (session and user lookups
+# included) and wall time in seconds. Every named route in crm.urls needs
+# an entry so new views can't ship without one.
+RouteBudget = namedtuple('RouteBudget', ['queries', 'seconds'])
+
+ROUTE_BUDGETS = {
+    'dashboard': RouteBudget(5, 1.0),
+    'company_list': RouteBudget(4, 1.0),
+    'company_detail': RouteBudget(5, 1.0),
+    'company_create': RouteBudget(2, 1.0),
+    'company_edit': RouteBudget(3, 1.0),
+    'contact_list': RouteBudget(4, 1.0),
+    'contact_detail': RouteBudget(5, 1.0),
+    'contact_create': RouteBudget(3, 1.0),
+    'contact_edit': RouteBudget(5, 1.0),
+    'lead_list': RouteBudget(5, 1.0),
+    'lead_detail': RouteBudget(3, 1.0),
+    'lead_create': RouteBudget(3, 1.0),
+    'lead_edit': RouteBudget(4, 1.0),
+    'lead_convert': RouteBudget(2, 1.0),
+    'deal_list': RouteBudget(5, 1.0),
+    'deal_detail': RouteBudget(4, 1.0),
+    'deal_create': RouteBudget(3, 1.0),
+    'deal_edit': RouteBudget(6, 1.0),
+    'activity_list': RouteBudget(6, 1.0),
+    'activity_detail': RouteBudget(3, 1.0),
+    'activity_create': RouteBudget(2, 1.0),
+    'activity_edit': RouteBudget(5, 1.0),
+    'activity_complete': RouteBudget(9, 1.0),
+    'lead_bulk': RouteBudget(2, 1.0),
+    'deal_bulk': RouteBudget(2, 1.0),
+    'activity_bulk': RouteBudget(2, 1.0),
+    'company_export': RouteBudget(3, 2.0),
+    'contact_export': RouteBudget(3, 2.0),
+    'lead_export': RouteBudget(3, 2.0),
+    'deal_export': RouteBudget(3, 2.0),
+    'activity_export': RouteBudget(3, 3.0),
+    'company_autocomplete': RouteBudget(3, 1.0),
+    'contact_autocomplete': RouteBudget(3, 1.0),
+    'deal_autocomplete': RouteBudget(3, 1.0),
+    'company_api': RouteBudget(3, 1.0),
+    'company_api_detail': RouteBudget(3, 1.0),
+    'company_api_batch': RouteBudget(2, 1.0),
+    'contact_api': RouteBudget(3, 1.0),
+    'contact_api_detail': RouteBudget(3, 1.0),
+    'contact_api_batch': RouteBudget(2, 1.0),
+    'lead_api': RouteBudget(3, 1.0),
+    'lead_api_detail': RouteBudget(3, 1.0),
+    'lead_api_batch': RouteBudget(2, 1.0),
+    'deal_api': RouteBudget(3, 1.0),
+    'deal_api_detail': RouteBudget(3, 1.0),
+    'deal_api_batch': RouteBudget(2, 1.0),
+    'activity_api': RouteBudget(3, 1.0),
+    'activity_api_detail': RouteBudget(3, 1.0),
+    'activity_api_batch': RouteBudget(2, 1.0),
+    'pipeline_report': RouteBudget(9, 2.0),
+    'cache_stats': RouteBudget(2, 1.0),
+    'perf_report': RouteBudget(3, 1.0),
+    'dedupe_report': RouteBudget(5, 2.0),
+    'dedupe_merge': RouteBudget(2, 1.0),
+    'job_list': RouteBudget(3, 1.0),
+    'job_detail': RouteBudget(3, 1.0),
+    'job_download': RouteBudget(3, 1.0),
+    'job_rebuild': RouteBudget(2, 1.0),
+    'import_upload': RouteBudget(2, 1.0),
+}
+
+
+@override_settings(CRM_CONDITIONAL_GET=True)
+class ConditionalGetTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.other = cls.create_user('other')
+        cls.contact = cls.create_contact(cls.create_company(), assigned_to=cls.user)
+        cls.deal = cls.create_deal(cls.contact, assigned_to=cls.user)
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.url = reverse('deal_detail', args=[self.deal.pk])
+
+    def revalidate(self, url, response):
+        return self.client.get(url, headers={'if-none-match': response['ETag']})
+
+    def test_unchanged_page_is_not_rendered(self):
+        first = self.client.get(self.url)
+        self.assertTrue(first['ETag'].startswith('W/"'))
+        self.assertIn('no-cache', first['Cache-Control'])
+        # session + user only
+        with self.assertNumQueries(2):
+            second = self.revalidate(self.url, first)
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+        third = self.client.get(self.url, headers={'if-modified-since': first['Last-Modified']})
+        self.assertEqual(third.status_code, 304)
+
+    def test_related_change_invalidates(self):
+        first = self.client.get(self.url)
+        Activity.objects.create(title='Follow-up', activity_type='call', deal=self.deal, assigned_to=self.user,
+                                due_date=timezone.now())
+        second = self.revalidate(self.url, first)
+        self.assertContains(second, 'Follow-up')
+        self.assertNotEqual(second['ETag'], first['ETag'])
+
+    def test_bulk_write_invalidates(self):
+        url = reverse('deal_list')
+        first = self.client.get(url)
+        self.client.post(reverse('deal_bulk'), {'action': 'stage', 'value': 'closed_won', 'ids': [self.deal.pk]})
+        # The bulk action's success message is shown once, so no 304 while it's pending.
+        self.assertEqual(self.revalidate(url, first).status_code, 200)
+        self.assertNotEqual(self.client.get(url)['ETag'], first['ETag'])
+
+    def test_varies_by_url_and_user(self):
+        first = self.client.get(reverse('deal_list'))
+        self.assertEqual(self.revalidate(reverse('deal_list') + '?stage=won', first).status_code, 200)
+        self.client.force_login(self.other)
+        self.assertEqual(self.revalidate(reverse('deal_list'), first).status_code, 200)
+
+    def test_writes_and_disabled_setting_bypass(self):
+        first = self.client.get(reverse('deal_edit', args=[self.deal.pk]))
+        self.assertFalse(first.has_header('ETag'))
+        with override_settings(CRM_CONDITIONAL_GET=False):
+            self.assertFalse(self.client.get(self.url).has_header('ETag'))
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertFalse(self.client.get(self.url).has_header('ETag'))
+
+    def test_off_by_default_with_a_process_local_cache(self):
+        # Writes in other processes wouldn't bump a LocMemCache's versions.
+        with override_settings(CRM_CONDITIONAL_GET=None):
+            self.assertFalse(self.client.get(self.url).has_header('ETag'))
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': '/var/tmp/crm'}}
+            with override_settings(CACHES=shared):
+                self.assertTrue(conditional.enabled())
+
+
+class QueryBudgetMixin:
+    def assertWithinQueryBudget(self, url_name, budget, *args, **params):
+        url = reverse(url_name, args=args)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{url_name} ran {len(queries)} queries (budget {budget}):\n' +
+            '\n'.join(q['sql'] for q in queries.captured_queries),
+        )
+        return response
+
+
+class QueryBudgetTests(QueryBudgetMixin, CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user(first_name='Sam', last_name='Seller')
+        due = timezone.now() + timedelta(days=1)
+        for i in range(12):
+            company = cls.create_company(name=f'Company {i}')
+            for j in range(3):
+                contact = cls.create_contact(company, email=f'c{i}-{j}@example.com', assigned_to=cls.user)
+                deal = cls.create_deal(contact, title=f'Deal {i}-{j}', assigned_to=cls.user)
+                Activity.objects.create(title=f'Call {i}-{j}', activity_type='call', contact=contact,
+                                        deal=deal, assigned_to=cls.user, due_date=due)
+            Lead.objects.create(first_name='Lead', last_name=str(i), email=f'l{i}@example.com',
+                                assigned_to=cls.user)
+        cls.company = company
+        cls.contact = contact
+        cls.deal = deal
+        cls.activity = Activity.objects.filter(deal=deal).first()
+        cls.lead = Lead.objects.first()
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_list_views(self):
+        for url_name in ['dashboard', 'company_list', 'contact_list', 'lead_list', 'deal_list', 'activity_list']:
+            with self.subTest(url_name):
+                self.assertWithinQueryBudget(url_name, ROUTE_BUDGETS[url_name].queries)
+
+    def test_cursor_list_views(self):
+        for url_name in ['company_list', 'contact_list', 'lead_list', 'deal_list', 'activity_list']:
+            with self.subTest(url_name):
+                self.assertWithinQueryBudget(url_name, ROUTE_BUDGETS[url_name].queries, cursor='')
+
+    def test_detail_views(self):
+        objects = {
+            'company_detail': self.company,
+            'contact_detail': self.contact,
+            'lead_detail': self.lead,
+            'deal_detail': self.deal,
+            'activity_detail': self.activity,
+        }
+        for url_name, obj in objects.items():
+            with self.subTest(url_name):
+                self.assertWithinQueryBudget(url_name, ROUTE_BUDGETS[url_name].queries, obj.pk)
+
+    def test_company_list_annotates_totals(self):
+        response = self.assertWithinQueryBudget('company_list', ROUTE_BUDGETS['company_list'].queries)
+        company = response.context['companies'][0]
+        self.assertEqual(company.contact_count, 3)
+        self.assertEqual(company.deal_count, 3)
+        self.assertEqual(company.deal_total, Decimal('3000.00'))
+
+
+class RoutePerformanceTests(CRMTestMixin, TestCase):
+    # Hits every route in crm.urls against production-like volumes. Set
+    # CRM_PERF_REPORT=path.json to write the measured numbers as a baseline.
+    COMPANIES = 1000
+    CONTACTS_PER_COMPANY = 3
+    LEADS = 2000
+    ACTIVITIES_PER_DEAL = 2
+
+    report = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user(first_name='Sam', last_name='Seller')
+        users = [cls.user] + [cls.create_user(f'rep{i}') for i in range(4)]
+        today = date.today()
+        now = timezone.now()
+
+        companies = Company.objects.bulk_create(
+            Company(name=f'Company {i:05d}', industry='Software', city='Austin')
+            for i in range(cls.COMPANIES)
+        )
+        contacts = Contact.objects.bulk_create(
+            Contact(first_name=f'First{i}', last_name=f'Last{i % 500}', email=f'contact{i}@example.com',
+                    company=companies[i % len(companies)], assigned_to=users[i % len(users)])
+            for i in range(cls.COMPANIES * cls.CONTACTS_PER_COMPANY)
+        )
+        deals = Deal.objects.bulk_create(
+            Deal(title=f'Deal {i}', contact=contact, company_id=contact.company_id,
+                 amount=Decimal(1000 + i), stage=Deal.STAGE_CHOICES[i % 6][0], probability=i % 100,
+                 expected_close_date=today + timedelta(days=i % 180), assigned_to=contact.assigned_to)
+            for i, contact in enumerate(contacts)
+        )
+        Activity.objects.bulk_create(
+            Activity(title=f'Call {i}', activity_type='call', contact_id=deal.contact_id, deal=deal,
+                     assigned_to=users[i % len(users)], due_date=now + timedelta(hours=i % 500 - 250),
+                     status='planned' if i % 3 else 'completed')
+            for i, deal in enumerate(deals * cls.ACTIVITIES_PER_DEAL)
+        )
+        Lead.objects.bulk_create(
+            Lead(first_name=f'Lead{i}', last_name='Prospect', email=f'lead{i}@example.com',
+                 company_name=f'Prospect {i}', status=Lead.STATUS_CHOICES[i % 5][0])
+            for i in range(cls.LEADS)
+        )
+        DashboardStats.rebuild()
+        search.rebuild()
+
+        cls.objects = {
+            'company': Company.objects.last(),
+            'contact': Contact.objects.last(),
+            'lead': Lead.objects.last(),
+            'deal': Deal.objects.last(),
+            'activity': Activity.objects.filter(status='planned').last(),
+            'job': Job.objects.create(task='export', args={'entity': 'deal'}, created_by=cls.user),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        path = os.environ.get('CRM_PERF_REPORT')
+        if path and cls.report:
+            with open(path, 'w') as fh:
+                json.dump(cls.report, fh, indent=2, sort_keys=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def named_routes(self):
+        for pattern in crm_urls.urlpatterns:
+            if pattern.name:
+                yield pattern.name, '<int:pk>' in str(pattern.pattern)
+
+    def test_every_route_has_a_budget(self):
+        missing = [name for name, _ in self.named_routes() if name not in ROUTE_BUDGETS]
+        self.assertEqual(missing, [])
+
+    def test_routes_within_budget(self):
+        for name, needs_pk in self.named_routes():
+            budget = ROUTE_BUDGETS[name]
+            args = [self.objects[name.split('_')[0]].pk] if needs_pk else []
+            with self.subTest(name):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    response = self.client.get(reverse(name, args=args))
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                    elapsed = time.perf_counter() - started
+                self.report[name] = {'queries': len(queries), 'seconds': round(elapsed, 4)}
+                # 405: write-only endpoints such as the API batch routes
+                self.assertIn(response.status_code, (200, 302, 405))
+                self.assertLessEqual(len(queries), budget.queries, name)
+                self.assertLessEqual(elapsed, budget.seconds, name)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class IndexUsageTests(CRMTestMixin, TestCase):
+    # The main query of each list view must be answered from an index, both
+    # for the row lookup and for the ORDER BY, instead of scanning and sorting.
+    @classmethod
+    def setUpTestData(cls):
+        user = cls.create_user()
+        company = cls.create_company()
+        contact = cls.create_contact(company)
+        deal = cls.create_deal(contact)
+        Lead.objects.create(first_name='L', last_name='One', email='l@example.com')
+        Activity.objects.create(title='Call', activity_type='call', deal=deal, assigned_to=user,
+                                due_date=timezone.now())
+
+    def assertUsesIndex(self, queryset, table):
+        plan = queryset.explain()
+        for line in plan.splitlines():
+            if f'SCAN {table}' in line:
+                self.assertIn('USING', line, plan)
+        self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+        self.assertRegex(plan, rf'(SCAN|SEARCH) {table} USING (COVERING )?INDEX', plan)
+
+    def test_list_view_queries(self):
+        now = timezone.now()
+        cases = {
+            'company_list': (Company.objects.order_by('name', 'id'), 'crm_company'),
+            'contact_list': (Contact.objects.select_related('company').order_by('last_name', 'id'), 'crm_contact'),
+            'lead_list': (Lead.objects.order_by('-created_at', '-id'), 'crm_lead'),
+            'lead_list_status': (Lead.objects.filter(status='new').order_by('-created_at', '-id'), 'crm_lead'),
+            'deal_list': (Deal.objects.select_related('company', 'contact').order_by('-created_at', '-id'),
+                          'crm_deal'),
+            'deal_list_stage': (Deal.objects.select_related('company', 'contact').filter(stage='proposal')
+                                .order_by('-created_at', '-id'), 'crm_deal'),
+            'activity_list': (Activity.objects.select_related('contact', 'deal').order_by('-due_date', '-id'),
+                              'crm_activity'),
+            'activity_list_status': (Activity.objects.select_related('contact', 'deal').filter(status='planned')
+                                     .order_by('-due_date', '-id'), 'crm_activity'),
+            'dashboard_recent': (Activity.objects.order_by('-created_at'), 'crm_activity'),
+            'dashboard_upcoming': (Activity.objects.filter(due_date__gte=now, status='planned')
+                                   .order_by('due_date'), 'crm_activity'),
+        }
+        for name, (queryset, table) in cases.items():
+            with self.subTest(name):
+                self.assertUsesIndex(queryset[:10], table)
+
+
+class ImportTests(CRMTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.company = self.create_company(name='Acme')
+        self.create_contact(self.company, email='existing@example.com')
+
+    def run_import(self, text, fmt='csv', **kwargs):
+        rejects = StringIO()
+        importer = ContactImporter(batch_size=2, rejects=RejectWriter(rejects), **kwargs)
+        result = importer.run(read_rows(StringIO(text), fmt))
+        return result, [json.loads(line) for line in rejects.getvalue().splitlines()]
+
+    def test_csv_import_resolves_companies_and_rejects_bad_rows(self):
+        result, rejects = self.run_import(
+            'first_name,last_name,email,company\n'
+            'Ann,Lee,ann@example.com,Acme\n'
+            'Bob,Ray,BOB@example.com,Globex\n'
+            'Dup,Ray,bob@example.com,Globex\n'
+            'Bad,Email,not-an-email,Acme\n'
+            'Old,Timer,existing@example.com,Acme\n'
+        )
+        self.assertEqual((result.rows, result.created, result.rejected), (5, 2, 3))
+        self.assertEqual(sorted(r['line'] for r in rejects), [4, 5, 6])
+        self.assertEqual(Contact.objects.get(email='ann@example.com').company, self.company)
+        self.assertEqual(Contact.objects.get(email='bob@example.com').company.name, 'Globex')
+        self.assertEqual(DashboardStats.load().total_contacts, 3)
+        self.assertEqual(search.search_ids('contact', 'globex'),
+                         [Contact.objects.get(email='bob@example.com').pk])
+
+    def test_jsonl_update_existing(self):
+        result, rejects = self.run_import(
+            '{"first_name": "New", "last_name": "Name", "email": "existing@example.com", "company": "Acme"}\n'
+            'not json\n',
+            fmt='jsonl', update_existing=True,
+        )
+        self.assertEqual((result.updated, result.rejected), (1, 1))
+        self.assertEqual(Contact.objects.get(email='existing@example.com').first_name, 'New')
+
+    def test_update_keeps_columns_missing_from_the_file(self):
+        user = self.create_user()
+        Contact.objects.filter(email='existing@example.com').update(
+            phone='555-0100', job_title='CTO', notes='Met at the fair', contact_type='customer', assigned_to=user,
+        )
+        Company.objects.filter(pk=self.company.pk).update(city='Austin', website='https://acme.example.com')
+        result, _ = self.run_import(
+            'first_name,last_name,email,company\nNew,Name,existing@example.com,Acme\n', update_existing=True,
+        )
+        self.assertEqual(result.updated, 1)
+        contact = Contact.objects.get(email='existing@example.com')
+        self.assertEqual(contact.first_name, 'New')
+        self.assertEqual((contact.phone, contact.job_title, contact.notes, contact.contact_type, contact.assigned_to),
+                         ('555-0100', 'CTO', 'Met at the fair', 'customer', user))
+
+        importer = CompanyImporter(update_existing=True)
+        result = importer.run(read_rows(StringIO('name,email\nAcme,info@acme.example.com\n'), 'csv'))
+        self.assertEqual(result.updated, 1)
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertEqual((company.email, company.city, company.website),
+                         ('info@acme.example.com', 'Austin', 'https://acme.example.com'))
+
+    def test_existing_emails_match_case_insensitively(self):
+        Contact.objects.filter(email='existing@example.com').update(email='Existing@Example.com')
+        result, rejects = self.run_import('first_name,last_name,email,company\nOld,Timer,existing@example.com,Acme\n')
+        self.assertEqual((result.created, result.rejected), (0, 1))
+        self.assertIn('already exists', rejects[0]['error'])
+        result, _ = self.run_import('first_name,last_name,email,company\nNew,Name,EXISTING@example.com,Acme\n',
+                                    update_existing=True)
+        self.assertEqual((result.created, result.updated), (0, 1))
+        self.assertEqual(Contact.objects.get().first_name, 'New')
+
+    def test_email_inserted_after_the_lookup_becomes_an_update(self):
+        lookup = conversion.lookup
+        calls = []
+
+        def stale_lookup(*args):
+            # The first lookup misses the existing contact, as if it had
+            # been inserted concurrently.
+            calls.append(args)
+            return {} if len(calls) == 1 else lookup(*args)
+
+        with mock.patch.object(conversion, 'lookup', side_effect=stale_lookup):
+            result, rejects = self.run_import(
+                'first_name,last_name,email,company\n'
+                'New,Name,existing@example.com,Globex\n'
+                'Ann,Lee,ann@example.com,Acme\n',
+                update_existing=True,
+            )
+        self.assertEqual((result.created, result.updated, result.rejected), (1, 1, 0), rejects)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Contact.objects.get(email='existing@example.com').company.name, 'Globex')
+        self.assertEqual(Company.objects.filter(name='Globex').count(), 1)
+
+    def test_command(self):
+        path = os.path.join(self.enterContext(TemporaryDirectory()), 'contacts.csv')
+        with open(path, 'w') as fh:
+            fh.write('first_name,last_name,email,company\nAnn,Lee,ann@example.com,Acme\n')
+        out = StringIO()
+        call_command('crm_import', 'contact', path, stdout=out)
+        self.assertIn('1 created', out.getvalue())
+        self.assertTrue(Contact.objects.filter(email='ann@example.com').exists())
+
+
+class ExportTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        company = cls.create_company(name='Acme')
+        cls.contact = cls.create_contact(company, email='jane@example.com', assigned_to=cls.user)
+        cls.create_deal(cls.contact, title='Renewal', stage='proposal')
+        cls.create_deal(cls.contact, title='Upsell', stage='closed_won')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_streams_csv_with_filters(self):
+        response = self.client.get(reverse('deal_export'), {'stage': 'closed_won'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'title', 'company'])
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Upsell', lines[1])
+
+    def test_search_filter_is_unranked_subquery(self):
+        response = self.client.get(reverse('deal_export'), {'format': 'jsonl', 'search': 'renew'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['title'] for row in rows], ['Renewal'])
+
+    def test_export_round_trips_through_import(self):
+        out = StringIO()
+        call_command('crm_export', 'contact', stdout=out)
+        Contact.objects.all().delete()
+        rejects = StringIO()
+        result = ContactImporter(rejects=RejectWriter(rejects)).run(read_rows(StringIO(out.getvalue()), 'csv'))
+        self.assertEqual(result.created, 1, rejects.getvalue())
+        self.assertEqual(Contact.objects.get().assigned_to, self.user)
+
+    def test_rejects_unknown_format(self):
+        response = self.client.get(reverse('contact_export'), {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(ROOT_URLCONF='crm.async_urls')
+class AsyncViewTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.company = cls.create_company(name='Acme')
+        cls.contact = cls.create_contact(cls.company, assigned_to=cls.user)
+        cls.deal = cls.create_deal(cls.contact, title='Renewal')
+        cls.activity = Activity.objects.create(title='Kickoff call', activity_type='call', contact=cls.contact,
+                                               deal=cls.deal, assigned_to=cls.user,
+                                               due_date=timezone.now() + timedelta(days=1))
+        for i in range(15):
+            Lead.objects.create(first_name='Lead', last_name=str(i), email=f'l{i}@example.com')
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.async_client.force_login(self.user)
+
+    async def test_views_match_sync_variants(self):
+        pages = {
+            'dashboard': [], 'company_list': [], 'contact_list': [], 'deal_list': [], 'activity_list': [],
+            'company_detail': [self.company.pk], 'contact_detail': [self.contact.pk],
+            'deal_detail': [self.deal.pk], 'activity_detail': [self.activity.pk],
+        }
+        for name, args in pages.items():
+            response = await self.async_client.get(reverse(name, args=args))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertContains(response, 'Kickoff call' if 'activit' in name or name == 'dashboard' else 'Acme')
+
+    async def test_dashboard_gathers_queries(self):
+        await DashboardStats.objects.all().adelete()
+        response = await self.async_client.get(reverse('dashboard'))
+        self.assertEqual(response.context['stats'].total_deals, 1)
+        self.assertEqual([a.title for a in response.context['upcoming_activities']], ['Kickoff call'])
+
+    async def test_offset_and_cursor_pages(self):
+        response = await self.async_client.get(reverse('lead_list'), {'page': 2})
+        page = response.context['leads']
+        self.assertEqual((page.number, len(page), page.paginator.count), (2, 5, 15))
+        response = await self.async_client.get(reverse('lead_list'), {'page': 99})
+        self.assertEqual(response.context['leads'].number, 2)
+        response = await self.async_client.get(reverse('lead_list'), {'cursor': ''})
+        self.assertTrue(response.context['leads'].has_next())
+
+    @override_settings(CRM_CONDITIONAL_GET=True)
+    async def test_conditional_get(self):
+        url = reverse('deal_detail', args=[self.deal.pk])
+        response = await self.async_client.get(url)
+        response = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_search_and_missing_objects(self):
+        response = await self.async_client.get(reverse('deal_list'), {'search': 'renew'})
+        self.assertEqual([deal.title for deal in response.context['deals']], ['Renewal'])
+        response = await self.async_client.get(reverse('deal_detail', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+
+class LoadTestCommandTests(CRMTestMixin, TransactionTestCase):
+    # Worker threads use their own connections, so the data must be committed.
+    def test_compares_wsgi_and_asgi(self):
+        self.create_user('admin', is_superuser=True)
+        self.create_contact(self.create_company())
+        out = StringIO()
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'load.json')
+            call_command('crm_loadtest', '-n', '12', '-c', '3', '--routes', 'contact_list,contact_detail',
+                         '--output', path, stdout=out)
+            with open(path) as fh:
+                report = json.load(fh)
+        self.assertEqual(set(report), {'routes', 'wsgi', 'asgi'})
+        for mode in ('wsgi', 'asgi'):
+            self.assertEqual((report[mode]['requests'], report[mode]['errors']), (12, 0))
+        self.assertIn('p99', out.getvalue())
+
+
+class SeedCommandTests(CRMTestMixin, TestCase):
+    def seed(self, **counts):
+        args = ['--users', '2', '--batch-size', '7', '--seed', '3']
+        for name, count in counts.items():
+            args += [f'--{name}', str(count)]
+        call_command('crm_seed', *args, stdout=StringIO())
+
+    def test_generates_related_rows(self):
+        self.seed(companies=5, contacts=40, leads=20, deals=30, activities=60)
+        self.assertEqual(
+            [model.objects.count() for model in (Company, Contact, Lead, Deal, Activity)], [5, 40, 20, 30, 60])
+        self.assertFalse(Deal.objects.exclude(company=F('contact__company')).exists())
+        self.assertFalse(Activity.objects.exclude(contact=F('deal__contact')).exists())
+        self.assertFalse(Deal.objects.filter(stage='closed_won').exclude(probability=100).exists())
+        # Timestamps spread over the history window instead of all being "now".
+        oldest = Contact.objects.order_by('created_at').first().created_at
+        self.assertLess(oldest, timezone.now() - timedelta(days=7))
+        self.assertEqual(User.objects.filter(username__startswith='seed-').count(), 2)
+
+        stats = DashboardStats.load()
+        self.assertEqual((stats.total_contacts, stats.total_deals), (40, 30))
+        self.assertEqual(SearchEntry.objects.filter(entity='contact').count(), 40)
+        self.assertTrue(BlockingKey.objects.filter(entity='contact').exists())
+        # Every deal's stage history ends in the stage it was generated in.
+        latest = DealStageChange.objects.filter(deal=OuterRef('pk')).order_by('-changed_at').values('to_stage')[:1]
+        self.assertFalse(Deal.objects.exclude(stage=Subquery(latest)).exists())
+        self.assertEqual(DealStageChange.objects.filter(from_stage='').count(), 30)
+        self.assertEqual(StageDuration.objects.aggregate(n=Sum('count'))['n'], DealStageChange.objects.count() - 30)
+        # Timestamps are automatic again afterwards.
+        self.assertGreater(self.create_company().created_at, timezone.now() - timedelta(minutes=1))
+
+    def test_runs_again_on_a_seeded_database(self):
+        self.seed(companies=2, contacts=10, leads=0, deals=0, activities=0)
+        self.seed(companies=2, contacts=10, leads=0, deals=0, activities=0)
+        self.assertEqual(Contact.objects.values('email').distinct().count(), 20)
+
+    def test_same_seed_same_data(self):
+        self.seed(companies=3, contacts=5, leads=0, deals=0, activities=0)
+        first = list(Company.objects.order_by('pk').values_list('name', 'industry', 'city'))
+        Company.objects.all().delete()
+        self.seed(companies=3, contacts=0, leads=0, deals=0, activities=0)
+        self.assertEqual(list(Company.objects.order_by('pk').values_list('name', 'industry', 'city')), first)
+
+    def test_rejects_orphans(self):
+        with self.assertRaises(CommandError):
+            self.seed(companies=0, contacts=0, leads=0, deals=5, activities=0)
+
+
+class BenchCommandTests(CRMTestMixin, TransactionTestCase):
+    # Worker threads use their own connections, so the data must be committed.
+    def test_writes_report_and_compares(self):
+        self.create_user('admin', is_superuser=True)
+        call_command('crm_seed', '--companies', '3', '--contacts', '12', '--leads', '6', '--deals', '8',
+                     '--activities', '10', '--users', '1', '--skip-index', stdout=StringIO())
+        out = StringIO()
+        with TemporaryDirectory() as tmp:
+            baseline, current = os.path.join(tmp, 'a.json'), os.path.join(tmp, 'b.json')
+            call_command('crm_bench', '-n', '40', '-c', '3', '--warmup', '5', '-o', baseline, stdout=StringIO())
+            call_command('crm_bench', '-n', '40', '-c', '3', '--warmup', '5', '--compare', baseline,
+                         '-o', current, stdout=out)
+            with open(current) as fh:
+                report = json.load(fh)
+        self.assertEqual((report['overall']['requests'], report['overall']['errors']), (40, 0))
+        self.assertEqual(sum(route['requests'] for route in report['routes'].values()), 40)
+        self.assertLessEqual(set(report['routes']), set(report['meta']['mix']))
+        self.assertEqual(report['meta']['rows']['deal'], 8)
+        self.assertIn('p95_pct', report['comparison'])
+        self.assertIn('p95', out.getvalue())
+
+    def test_mix_validation(self):
+        self.create_user('admin', is_superuser=True)
+        with self.assertRaises(CommandError):
+            call_command('crm_bench', '--mix', 'nope=1', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('crm_bench', '--mix', 'deal_detail=1', stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Fills sqlite_stat1 with ANALYZE')
+class AdminScaleTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = cls.create_user('admin', is_staff=True, is_superuser=True)
+        cls.company = cls.create_company('Initech')
+        cls.create_contact(cls.company, first_name='Zed', last_name='Adams', email='zed@example.com')
+        amy = cls.create_contact(cls.company, first_name='Amy', last_name='Zane', email='amy@example.com')
+        for title in ('Call', 'Email'):
+            Activity.objects.create(title=title, activity_type='call', contact=amy, assigned_to=cls.admin,
+                                    due_date=timezone.now())
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def changelist(self, model, **params):
+        return self.client.get(reverse(f'admin:crm_{model}_changelist'), params)
+
+    def test_filter_loads_only_the_selected_company(self):
+        with CaptureQueriesContext(connection) as before:
+            self.changelist('contact')
+        for i in range(20):
+            contact = self.create_contact(self.create_company(f'Co {i}'), email=f'c{i}@example.com')
+            self.create_deal(contact)
+        with CaptureQueriesContext(connection) as after:
+            response = self.changelist('contact')
+        self.assertEqual(len(after), len(before))
+        self.assertContains(response, 'data-autocomplete-url="/companies/autocomplete/"')
+        self.assertNotContains(response, 'Co 19</a>')
+        response = self.changelist('contact', company__id__exact=self.company.pk)
+        self.assertContains(response, 'class="selected">\n    <a href="?company__id__exact=%d">Initech' % self.company.pk)
+        for model in ('deal', 'activity', 'lead', 'company'):
+            self.assertEqual(self.changelist(model).status_code, 200, model)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        def add_activities(count):
+            for i in range(count):
+                contact = self.create_contact(self.create_company(f'Co {i}'), email=f'a{count}-{i}@example.com')
+                Activity.objects.create(title=f'Demo {i}', activity_type='meeting', contact=contact,
+                                        deal=self.create_deal(contact), assigned_to=self.admin,
+                                        due_date=timezone.now())
+
+        add_activities(2)
+        queries = {}
+        for model in ('activity', 'deal', 'contact'):
+            with CaptureQueriesContext(connection) as before:
+                self.changelist(model)
+            queries[model] = len(before)
+        add_activities(8)
+        for model, expected in queries.items():
+            with CaptureQueriesContext(connection) as after:
+                self.changelist(model)
+            self.assertEqual(len(after), expected, model)
+
+    def test_full_name_is_annotated_and_sortable(self):
+        response = self.changelist('contact', o='1')
+        names = [contact.db_full_name for contact in response.context['cl'].result_list]
+        self.assertEqual(names, ['Amy Zane', 'Zed Adams'])
+        response = self.changelist('contact', o='-1')
+        self.assertEqual(response.context['cl'].result_list[0].db_full_name, 'Zed Adams')
+
+    @override_settings(CRM_COUNT_ESTIMATE_THRESHOLD=1)
+    def test_unfiltered_count_comes_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        for model in ('contact', 'activity'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.changelist(model)
+            self.assertEqual(response.context['cl'].result_count, 2)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries), model)
+        # Stale statistics are what an estimate is; filtered lists stay exact.
+        Activity.objects.filter(title='Call').delete()
+        self.assertEqual(counts.estimated_count(Activity.objects.all()), 2)
+        response = self.changelist('activity', title='Email')
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+
+class RowCountTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        for i in range(25):
+            Lead.objects.create(first_name='Lead', last_name=f'N{i}', email=f'n{i}@example.com',
+                                status='new' if i % 5 else 'qualified')
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_unfiltered_lists_use_the_counter_table(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('lead_list'))
+        self.assertFalse(any('COUNT(' in q['sql'] for q in queries.captured_queries))
+        self.assertContains(response, '25 leads')
+        self.assertEqual(counts.count_rows(Lead.objects.all()), (25, counts.EXACT))
+
+    def test_small_filtered_sets_are_exact(self):
+        response = self.client.get(reverse('lead_list'), {'status': 'qualified'})
+        self.assertContains(response, '5 leads')
+        self.assertEqual(counts.count_rows(Lead.objects.filter(status='new')), (20, counts.EXACT))
+
+    @override_settings(CRM_COUNT_ESTIMATE_THRESHOLD=10)
+    def test_large_filtered_sets_stop_counting(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('lead_list'), {'status': 'new'})
+        count_sql = next(q['sql'] for q in queries.captured_queries if 'COUNT(' in q['sql'])
+        self.assertIn('LIMIT 11', count_sql)
+        if connection.vendor == 'sqlite':
+            self.assertContains(response, 'more than 10 leads')
+            self.assertNotContains(response, '>Last<')
+        page = response.context['leads']
+        self.assertTrue(page.has_next())
+        self.assertEqual(list(page.window()), [1, 2])
+        # Pages past the lower bound stay reachable.
+        response = self.client.get(reverse('lead_list'), {'status': 'new', 'page': 3})
+        page = response.context['leads']
+        self.assertEqual(page.number, 2)
+        self.assertFalse(page.has_next())
+        self.assertEqual(len(page), 10)
+
+    def test_describe(self):
+        self.assertEqual(counts.describe(1234, counts.EXACT), '1,234')
+        self.assertEqual(counts.describe(1234567, counts.ESTIMATE), 'about 1,200,000')
+        self.assertEqual(counts.describe(10001, counts.LOWER_BOUND), 'more than 10,000')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Fills sqlite_stat1 with ANALYZE')
+    @override_settings(CRM_COUNT_ESTIMATE_THRESHOLD=20)
+    def test_tables_without_counters_use_statistics(self):
+        contact = self.create_contact(self.create_company())
+        Activity.objects.bulk_create(
+            Activity(title=f'Call {i}', activity_type='call', contact=contact, assigned_to=self.user,
+                     due_date=timezone.now())
+            for i in range(30)
+        )
+        self.assertEqual(counts.count_rows(Activity.objects.all()), (30, counts.EXACT))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        Activity.objects.filter(title='Call 0').delete()
+        self.assertEqual(counts.count_rows(Activity.objects.all()), (30, counts.ESTIMATE))
+        self.assertContains(self.client.get(reverse('activity_list')), 'about 30 activities')
+
+    async def test_async_pages_share_the_count(self):
+        with override_settings(ROOT_URLCONF='crm.async_urls'):
+            await self.async_client.aforce_login(self.user)
+            response = await self.async_client.get(reverse('lead_list'), {'page': 2})
+        self.assertEqual(response.context['leads'].paginator.count_label, '25')
+
+
+class AnalyticsTests(CRMTestMixin, TestCase):
+    TODAY = date(2030, 3, 15)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann = cls.create_user('ann')
+        cls.bob = cls.create_user('bob')
+        contact = cls.create_contact(cls.create_company())
+        deals = [
+            # stage, amount, probability, close date, owner
+            ('prospecting', '1000.00', 10, date(2030, 3, 20), cls.ann),
+            ('proposal', '2000.00', 50, date(2030, 4, 1), cls.ann),
+            ('negotiation', '3000.00', 75, date(2030, 1, 10), cls.bob),
+            ('closed_won', '4000.00', 100, date(2030, 2, 1), cls.ann),
+            ('closed_lost', '5000.00', 0, date(2030, 2, 1), cls.bob),
+            ('closed_won', '600.00', 100, date(2030, 2, 1), None),
+        ]
+        for stage, amount, probability, close_date, owner in deals:
+            cls.create_deal(contact, amount=amount, stage=stage, probability=probability,
+                            expected_close_date=close_date, assigned_to=owner)
+        for status in ['new', 'new', 'contacted', 'qualified', 'converted', 'closed_lost']:
+            Lead.objects.create(first_name='L', last_name=status, email=f'{status}@example.com', status=status)
+
+    def test_weighted_pipeline_matches_model_property(self):
+        pipeline = analytics.weighted_pipeline(Deal.objects.all())
+        open_deals = Deal.objects.exclude(stage__in=analytics.CLOSED_STAGES)
+        self.assertEqual(pipeline['weighted'], sum(deal.weighted_amount for deal in open_deals))
+        self.assertEqual(pipeline['weighted'], Decimal('3350.00'))
+        self.assertEqual((pipeline['count'], pipeline['total']), (3, Decimal('6000.00')))
+        self.assertEqual([row['count'] for row in pipeline['stages']], [1, 0, 1, 1])
+
+    def test_funnels_count_everything_past_each_step(self):
+        steps = analytics.deal_funnel(Deal.objects.all())['steps']
+        self.assertEqual([step['reached'] for step in steps], [5, 4, 4, 3, 2])
+        self.assertEqual(steps[1]['conversion'], 80.0)
+        lead_funnel = analytics.lead_funnel(Lead.objects.all())
+        self.assertEqual([step['reached'] for step in lead_funnel['steps']], [5, 3, 2, 1])
+        self.assertEqual(lead_funnel['lost'], 1)
+
+    def test_win_rates_by_owner(self):
+        rows = {row['username']: row for row in analytics.win_rates(Deal.objects.all())}
+        self.assertEqual((rows['ann']['won'], rows['ann']['open'], rows['ann']['win_rate']), (1, 2, 100.0))
+        self.assertEqual((rows['bob']['lost'], rows['bob']['win_rate']), (1, 0.0))
+        self.assertEqual(rows['bob']['weighted'], Decimal('2250.00'))
+        self.assertEqual(rows['Unassigned']['won_amount'], Decimal('600.00'))
+
+    def test_monthly_forecast(self):
+        forecast = analytics.monthly_forecast(Deal.objects.all(), months=3, today=self.TODAY)
+        self.assertEqual([row['month'] for row in forecast['months']],
+                         [date(2030, 3, 1), date(2030, 4, 1), date(2030, 5, 1)])
+        self.assertEqual([row['weighted'] for row in forecast['months']],
+                         [Decimal('100.00'), Decimal('1000.00'), Decimal('0.00')])
+        self.assertEqual((forecast['overdue']['count'], forecast['overdue']['total']), (1, Decimal('3000.00')))
+
+    def test_report_runs_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(7):
+            report = analytics.pipeline_report()
+        self.assertEqual(report['cohorts'][-1]['win_rate'], 66.7)
+
+    def test_view_and_command(self):
+        self.client.force_login(self.ann)
+        self.assertContains(self.client.get(reverse('pipeline_report')), 'Weighted Pipeline')
+        Lead.objects.filter(status='qualified').update(assigned_to=self.bob)
+        data = self.client.get(reverse('pipeline_report'), {'format': 'json', 'assigned_to': self.bob.pk}).json()
+        self.assertEqual(data['pipeline']['weighted'], '2250.00')
+        self.assertEqual([step['reached'] for step in data['lead_funnel']['steps']], [1, 1, 1, 0])
+        self.assertEqual(self.client.get(reverse('pipeline_report'), {'months': 'x'}).status_code, 400)
+        out = StringIO()
+        call_command('crm_pipeline_report', '--assigned-to', 'ann', stdout=out)
+        self.assertIn('Open pipeline: 2 deals, 3000.00 total, 1100.00 weighted', out.getvalue())
+
+
+class StageHistoryTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.ann = cls.create_user('ann')
+        cls.bob = cls.create_user('bob')
+        cls.contact = cls.create_contact(cls.create_company())
+
+    def backdate(self, deal, days):
+        DealStageChange.objects.filter(deal=deal).update(changed_at=F('changed_at') - timedelta(days=days))
+
+    def rollup(self):
+        return list(StageDuration.objects.values_list('stage', 'assigned_to', 'count').order_by('stage', 'assigned_to'))
+
+    def test_saves_log_stage_changes_and_roll_up_the_stay(self):
+        deal = self.create_deal(self.contact, assigned_to=self.ann)
+        self.backdate(deal, 3)
+        deal = Deal.objects.get(pk=deal.pk)
+        deal.stage = 'proposal'
+        deal.save()
+        deal.title = 'Renamed'
+        deal.save()
+        changes = list(deal.stage_changes.order_by('changed_at').values_list('from_stage', 'to_stage'))
+        self.assertEqual(changes, [('', 'prospecting'), ('prospecting', 'proposal')])
+        stay = StageDuration.objects.get()
+        self.assertEqual((stay.stage, stay.assigned_to, stay.count), ('prospecting', self.ann, 1))
+        self.assertAlmostEqual(stay.total_seconds, 3 * 86400, delta=60)
+        self.assertEqual(stay.month, stages.month_of(timezone.now()))
+
+    def test_bulk_paths_log_stage_changes(self):
+        deals = [self.create_deal(self.contact, assigned_to=owner) for owner in (self.ann, self.bob, self.bob)]
+        for deal in deals:
+            self.backdate(deal, 2)
+        bulk.apply('deal', 'stage', Deal.objects.filter(pk__in=[deals[0].pk, deals[1].pk]), 'qualification')
+        self.assertEqual(self.rollup(), [('prospecting', self.ann.pk, 1), ('prospecting', self.bob.pk, 1)])
+
+        self.client.force_login(self.ann)
+        rows = [{'id': deal.pk, 'stage': 'proposal'} for deal in deals]
+        response = self.client.patch(reverse('deal_api_batch'), json.dumps(rows), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(DealStageChange.objects.filter(to_stage='proposal').count(), 3)
+        # The qualification stays only just started; the third deal's
+        # prospecting stay is two days long.
+        self.assertEqual(StageDuration.objects.filter(stage='qualification').aggregate(n=Sum('count'))['n'], 2)
+        self.assertEqual(StageDuration.objects.filter(stage='prospecting').aggregate(n=Sum('count'))['n'], 3)
+
+        lead = Lead.objects.create(first_name='New', last_name='Lead', email='new@example.com', company_name='Acme')
+        conversion.convert_leads(Lead.objects.filter(pk=lead.pk))
+        converted = Lead.objects.get(pk=lead.pk).converted_deal
+        self.assertEqual(list(converted.stage_changes.values_list('to_stage', flat=True)), ['prospecting'])
+
+    def test_deals_older_than_the_log_start_their_history_on_first_move(self):
+        deal = self.create_deal(self.contact)
+        DealStageChange.objects.all().delete()
+        deal = Deal.objects.get(pk=deal.pk)
+        deal.stage = 'proposal'
+        deal.save()
+        self.assertEqual(deal.stage_changes.count(), 1)
+        self.assertFalse(StageDuration.objects.exists())
+
+    def test_percentiles_from_buckets(self):
+        for seconds in [30, 60, 3600, 86400, 30 * 86400]:
+            low, high = stages.bucket_bounds(stages.bucket_for(seconds))
+            self.assertTrue(low <= seconds < high, seconds)
+        stays = [(date(2030, 1, 1), 'proposal', None, day * 86400) for day in range(1, 101)]
+        stages.add_stays(stays)
+        buckets = dict(StageDuration.objects.values_list('bucket', 'count'))
+        self.assertAlmostEqual(stages.percentile(buckets, 0.5) / 86400, 50, delta=3)
+        self.assertAlmostEqual(stages.percentile(buckets, 0.9) / 86400, 90, delta=5)
+        self.assertIsNone(stages.percentile({}, 0.5))
+
+    def test_velocity_report_and_rebuild(self):
+        stages.add_stays([
+            (date(2030, 2, 1), 'negotiation', self.ann.pk, 2 * 86400),
+            (date(2030, 3, 1), 'negotiation', self.ann.pk, 4 * 86400),
+            (date(2030, 3, 1), 'negotiation', self.bob.pk, 12 * 86400),
+            (date(2029, 1, 1), 'negotiation', self.bob.pk, 86400),
+        ])
+        with self.assertNumQueries(1):
+            report = analytics.stage_velocity(months=2, today=date(2030, 3, 15))
+        negotiation = report['stages'][3]
+        self.assertEqual((negotiation['stage'], negotiation['count'], negotiation['avg_days']), ('negotiation', 3, 6.0))
+        self.assertEqual([month['stages'][3]['count'] for month in report['months']], [1, 2])
+        self.assertIsNone(report['stages'][0]['avg_days'])
+        mine = analytics.stage_velocity(months=2, today=date(2030, 3, 15), assigned_to=self.ann.pk)
+        self.assertEqual(mine['stages'][3]['avg_days'], 3.0)
+
+        deal = self.create_deal(self.contact, assigned_to=self.bob)
+        self.backdate(deal, 5)
+        deal = Deal.objects.get(pk=deal.pk)
+        deal.stage = 'negotiation'
+        deal.save()
+        incremental = self.rollup()
+        self.assertEqual(stages.rebuild(), 1)
+        self.assertEqual(self.rollup(), [('prospecting', self.bob.pk, 1)])
+        self.assertIn(('prospecting', self.bob.pk, 1), incremental)
+
+
+class APITests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.company = cls.create_company(name='Acme')
+        cls.contacts = [
+            cls.create_contact(cls.company, email=f'c{i}@example.com', last_name=f'Doe{i}', assigned_to=cls.user)
+            for i in range(5)
+        ]
+        cls.deal = cls.create_deal(cls.contacts[0], title='Renewal', stage='closed_won')
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def post_json(self, url_name, rows, method='post'):
+        return getattr(self.client, method)(reverse(url_name), json.dumps(rows), content_type='application/json')
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('contact_api')).status_code, 401)
+
+    def test_cursor_pagination_walks_every_row(self):
+        seen, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(reverse('contact_api'), {'limit': 2, 'cursor': cursor}).json()
+            seen += [row['id'] for row in data['results']]
+            cursor = data['next_cursor']
+        self.assertEqual(seen, sorted(contact.pk for contact in self.contacts))
+
+    def test_fields_projection_uses_only(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('contact_api'), {'fields': 'email'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'email'})
+        sql = queries.captured_queries[-1]['sql']
+        self.assertNotIn('"notes"', sql)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(reverse('contact_api'), {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('contact_api'), {'include': 'leads'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_include_related_in_constant_queries(self):
+        # session + user + contacts joined to company/user + prefetched deals
+        with self.assertNumQueries(4):
+            data = self.client.get(reverse('contact_api'), {
+                'fields': 'email,company', 'include': 'company,assigned_to,deals',
+            }).json()
+        first = data['results'][0]
+        self.assertEqual(first['company'], {'id': self.company.pk, 'name': 'Acme'})
+        self.assertEqual(first['assigned_to']['username'], 'tester')
+        self.assertEqual(first['deals'][0]['title'], 'Renewal')
+        self.assertEqual(data['results'][1]['deals'], [])
+
+    def test_detail(self):
+        data = self.client.get(reverse('deal_api_detail', args=[self.deal.pk]), {'include': 'contact'}).json()
+        self.assertEqual(data['amount'], '1000.00')
+        self.assertEqual(data['contact']['email'], 'c0@example.com')
+        self.assertEqual(self.client.get(reverse('deal_api_detail', args=[0])).status_code, 404)
+
+    def test_batch_create(self):
+        rows = [
+            {'title': f'Deal {i}', 'contact': self.contacts[i].pk, 'company': self.company.pk,
+             'amount': '250.00', 'stage': 'closed_won', 'expected_close_date': '2030-01-01'}
+            for i in range(3)
+        ]
+        # session + user + contact/company checks + insert (+ savepoints)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_json('deal_api_batch', rows)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['created']), 3)
+        self.assertEqual(sum('INSERT INTO "crm_deal"' in q['sql'] for q in queries.captured_queries), 1)
+        stats = DashboardStats.load()
+        self.assertEqual((stats.total_deals, stats.won_deals, stats.total_deal_value), (4, 4, Decimal('1750.00')))
+        self.assertEqual(search.search_ids('deal', 'Deal 2'), [response.json()['created'][2]])
+
+    def test_batch_create_is_all_or_nothing(self):
+        rows = [
+            {'first_name': 'New', 'last_name': 'Person', 'email': 'new@example.com', 'company': self.company.pk},
+            {'first_name': 'Dup', 'last_name': 'Person', 'email': 'c1@example.com', 'company': self.company.pk},
+            {'first_name': 'Bad', 'last_name': 'Company', 'email': 'bad@example.com', 'company': 0},
+            {'first_name': 'Bad', 'email': 'not-an-email', 'company': 'x', 'shoe_size': 9},
+        ]
+        response = self.post_json('contact_api_batch', rows)
+        self.assertEqual(response.status_code, 400)
+        errors = {error['index']: error['errors'] for error in response.json()['errors']}
+        self.assertEqual(set(errors), {1, 2, 3})
+        self.assertIn('email', errors[1])
+        self.assertIn('company', errors[2])
+        self.assertEqual(set(errors[3]), {'last_name', 'email', 'company', 'shoe_size'})
+        self.assertFalse(Contact.objects.filter(email='new@example.com').exists())
+
+    def test_batch_update(self):
+        rows = [{'id': self.deal.pk, 'stage': 'closed_lost', 'amount': '10.00'}]
+        self.client.get(reverse('deal_list'))
+        response = self.post_json('deal_api_batch', rows, method='patch')
+        self.assertEqual(response.status_code, 200)
+        self.deal.refresh_from_db()
+        self.assertEqual(self.deal.stage, 'closed_lost')
+        stats = DashboardStats.load()
+        self.assertEqual((stats.won_deals, stats.total_deal_value), (0, Decimal('10.00')))
+        self.assertContains(self.client.get(reverse('deal_list')), 'stage-closed_lost')
+
+    def test_batch_update_reindexes_dependent_documents(self):
+        self.post_json('company_api_batch', [{'id': self.company.pk, 'name': 'Globex'}], method='patch')
+        self.assertEqual(len(search.search_ids('contact', 'globex')), 5)
+
+
+class JobQueueTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.staff = cls.create_user('admin', is_staff=True)
+        company = cls.create_company()
+        contact = cls.create_contact(company, assigned_to=cls.user)
+        cls.create_deal(contact, title='Renewal', stage='proposal')
+
+    def setUp(self):
+        super().setUp()
+        self.files = TemporaryDirectory()
+        self.addCleanup(self.files.cleanup)
+        settings = override_settings(CRM_JOB_FILES_DIR=self.files.name, CRM_JOB_RETRY_BACKOFF=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_login(self.user)
+
+    def register(self, name, func):
+        jobs.TASKS[name] = func
+        self.addCleanup(jobs.TASKS.pop, name)
+
+    def test_claim_takes_oldest_due_job_once(self):
+        later = jobs.enqueue('rebuild_stats', delay=60)
+        first = jobs.enqueue('rebuild_stats')
+        claimed = jobs.claim('w1')
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual((claimed.status, claimed.attempts, claimed.locked_by), ('running', 1, 'w1'))
+        self.assertIsNone(jobs.claim('w2'))
+        later.refresh_from_db()
+        self.assertEqual(later.status, 'queued')
+
+    def test_unknown_task_is_rejected(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nope')
+
+    def test_failed_job_is_retried_with_backoff_then_fails(self):
+        calls = []
+
+        def flaky(ctx):
+            calls.append(ctx.job.attempts)
+            raise RuntimeError('boom')
+        self.register('flaky', flaky)
+        job = jobs.enqueue('flaky', max_attempts=2)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'queued')
+        self.assertIn('RuntimeError: boom', job.error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.assertEqual(jobs.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(calls, [1, 2])
+        self.assertIsNotNone(job.finished_at)
+
+    def test_progress_is_visible_while_running(self):
+        seen = []
+
+        def counting(ctx):
+            ctx.progress(5, 20, 'Quarter way')
+            seen.append(self.client.get(reverse('job_detail', args=[ctx.job.pk]), {'format': 'json'}).json())
+            return {'ok': True}
+        self.register('counting', counting)
+        job = jobs.enqueue('counting', user=self.user)
+        jobs.run_pending()
+        self.assertEqual(seen[0]['status'], 'running')
+        self.assertEqual((seen[0]['percent'], seen[0]['message']), (25, 'Quarter way'))
+        data = self.client.get(reverse('job_detail', args=[job.pk]), {'format': 'json'}).json()
+        self.assertEqual((data['status'], data['result']), ('succeeded', {'ok': True}))
+
+    def test_export_job_writes_downloadable_file(self):
+        response = self.client.post(reverse('deal_export') + '?stage=proposal')
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.pk]))
+        self.assertEqual(self.client.get(reverse('job_download', args=[job.pk])).status_code, 302)
+
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded', job.error)
+        self.assertEqual(job.result['rows'], 1)
+        response = self.client.get(reverse('job_download', args=[job.pk]))
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('Renewal', content)
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    def test_import_upload_runs_in_worker(self):
+        upload = SimpleUploadedFile(
+            'contacts.csv', b'first_name,last_name,email,company\nAnn,Lee,ann@example.com,Acme\nBad,Row,,\n',
+        )
+        response = self.client.post(reverse('import_upload'), {'entity': 'contact', 'file': upload})
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.pk]))
+        self.assertEqual(job.max_attempts, 1)
+
+        out = StringIO()
+        call_command('crm_worker', processes=0, burst=True, stdout=out)
+        self.assertIn('ran 1 job', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'succeeded', job.error)
+        self.assertEqual((job.result['created'], job.result['rejected']), (1, 1))
+        self.assertTrue(os.path.exists(job.result['rejects_path']))
+        self.assertTrue(Contact.objects.filter(email='ann@example.com').exists())
+
+    def test_reassign_job(self):
+        other = self.create_user('other')
+        job = jobs.enqueue('reassign', {'entity': 'deal', 'ids': list(Deal.objects.values_list('pk', flat=True)),
+                                        'user_id': other.pk})
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'updated': 1})
+        self.assertEqual(Deal.objects.get().assigned_to, other)
+
+    def test_stale_running_jobs_are_recovered(self):
+        stale = timezone.now() - timedelta(hours=2)
+        retry = Job.objects.create(task='rebuild_stats', status='running', attempts=1, locked_at=stale)
+        exhausted = Job.objects.create(task='rebuild_stats', status='running', attempts=3, locked_at=stale)
+        fresh = Job.objects.create(task='rebuild_stats', status='running', attempts=1, locked_at=timezone.now())
+        self.assertEqual(jobs.requeue_stale(), (1, 1))
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {retry.pk: 'queued', exhausted.pk: 'failed', fresh.pk: 'running'})
+
+    def test_jobs_are_private_to_their_owner(self):
+        job = jobs.enqueue('rebuild_stats', user=self.staff)
+        self.assertEqual(self.client.get(reverse('job_detail', args=[job.pk])).status_code, 404)
+        self.assertNotContains(self.client.get(reverse('job_list')), 'rebuild_stats')
+
+    def test_staff_can_queue_rebuilds(self):
+        self.client.force_login(self.staff)
+        self.client.post(reverse('job_rebuild'), {'task': 'rebuild_search'})
+        self.client.post(reverse('job_rebuild'), {'task': 'delete_everything'})
+        self.assertEqual(list(Job.objects.values_list('task', flat=True)), ['rebuild_search'])
+        jobs.run_pending()
+        self.assertEqual(Job.objects.get().status, 'succeeded')
+
+
+class BulkActionTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.other = cls.create_user('other')
+        contact = cls.create_contact(cls.create_company(), assigned_to=cls.user)
+        cls.deals = [cls.create_deal(contact, title=f'Deal {i}', stage=stage, assigned_to=cls.user)
+                     for i, stage in enumerate(['proposal', 'closed_won', 'negotiation'])]
+        cls.leads = [Lead.objects.create(first_name=f'L{i}', last_name='P', email=f'l{i}@example.com',
+                                         company_name='X', status=status, assigned_to=cls.user)
+                     for i, status in enumerate(['new', 'converted', 'qualified'])]
+        cls.activities = [Activity.objects.create(title=f'Call {i}', activity_type='call', contact=contact,
+                                                  assigned_to=cls.user, due_date=timezone.now())
+                          for i in range(3)]
+        DashboardStats.rebuild()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def assertStatsMatchRebuild(self):
+        stats = DashboardStats.load()
+        rebuilt = DashboardStats.rebuild()
+        self.assertEqual((stats.won_deals, stats.converted_leads), (rebuilt.won_deals, rebuilt.converted_leads))
+
+    def test_complete_activities_is_one_update(self):
+        ids = [activity.pk for activity in self.activities[:2]]
+        with CaptureQueriesContext(connection) as queries:
+            updated = bulk.apply('activity', 'complete', Activity.objects.filter(pk__in=ids))
+        self.assertEqual(updated, 2)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]['sql'].startswith('UPDATE'))
+        self.assertEqual(Activity.objects.filter(status='completed', completed_at__isnull=False).count(), 2)
+
+    def test_bulk_view_completes_selected_rows(self):
+        response = self.client.post(reverse('activity_bulk'), {
+            'action': 'complete', 'ids': [self.activities[0].pk, self.activities[2].pk], 'status': 'planned',
+        })
+        self.assertRedirects(response, reverse('activity_list') + '?status=planned', fetch_redirect_response=False)
+        self.assertEqual(list(Activity.objects.filter(status='planned').values_list('pk', flat=True)),
+                         [self.activities[1].pk])
+
+    def test_stage_change_adjusts_won_deals(self):
+        self.client.post(reverse('deal_bulk'), {
+            'action': 'stage', 'value': 'closed_won', 'ids': [deal.pk for deal in self.deals],
+        })
+        self.assertEqual(Deal.objects.filter(stage='closed_won').count(), 3)
+        self.assertEqual(DashboardStats.load().won_deals, 3)
+        self.client.post(reverse('deal_bulk'), {'action': 'stage', 'value': 'closed_lost', 'ids': [self.deals[1].pk]})
+        self.assertStatsMatchRebuild()
+
+    def test_status_change_adjusts_converted_leads(self):
+        self.client.post(reverse('lead_bulk'), {'action': 'status', 'value': 'closed_lost', 'scope': 'all'})
+        self.assertEqual(Lead.objects.filter(status='closed_lost').count(), 3)
+        self.assertEqual(DashboardStats.load().converted_leads, 0)
+        self.assertStatsMatchRebuild()
+
+    def test_scope_all_reassigns_in_a_job(self):
+        response = self.client.post(reverse('deal_bulk'), {
+            'action': 'reassign', 'assigned_to': self.other.pk, 'scope': 'all', 'stage': 'proposal',
+        })
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('job_detail', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual((job.task, job.args['filters']), ('reassign', {'stage': 'proposal'}))
+        self.assertFalse(Deal.objects.filter(assigned_to=self.other).exists())
+        jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.result, {'updated': 1})
+        self.assertEqual(list(Deal.objects.filter(assigned_to=self.other)), [self.deals[0]])
+
+    def test_update_invalidates_cached_list(self):
+        self.client.get(reverse('deal_list'))
+        self.client.post(reverse('deal_bulk'), {'action': 'stage', 'value': 'closed_lost', 'ids': [self.deals[0].pk]})
+        response = self.client.get(reverse('deal_list'))
+        self.assertContains(response, 'stage-closed_lost')
+
+    def test_rejects_invalid_input(self):
+        for entity, data in [
+            ('deal', {'action': 'stage', 'value': 'bogus', 'ids': [self.deals[0].pk]}),
+            ('lead', {'action': 'complete', 'ids': [self.leads[0].pk]}),
+            ('lead', {'action': 'reassign', 'assigned_to': '999', 'ids': [self.leads[0].pk]}),
+            ('lead', {'action': 'reassign', 'assigned_to': '999', 'scope': 'all'}),
+            ('lead', {'action': 'status', 'value': 'new'}),
+        ]:
+            with self.subTest(data=data):
+                response = self.client.post(reverse(f'{entity}_bulk'), data, follow=True)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(list(response.context['messages'])), 1)
+        self.assertEqual(Deal.objects.get(pk=self.deals[0].pk).stage, 'proposal')
+        self.assertEqual(Lead.objects.get(pk=self.leads[0].pk).assigned_to, self.user)
+        self.assertFalse(Job.objects.exists())
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.client.get(reverse('lead_bulk')).status_code, 405)
+
+
+class PerfMiddlewareTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.staff = cls.create_user('admin', is_staff=True)
+        cls.company = cls.create_company()
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_records_view_timing_and_queries(self):
+        self.client.get(reverse('company_list'))
+        sample = perf.pending()[-1]
+        self.assertEqual((sample['view'], sample['method'], sample['status']), ('company_list', 'GET', 200))
+        self.assertGreater(sample['queries'], 0)
+        self.assertGreaterEqual(sample['duration_ms'], sample['db_ms'])
+
+    async def test_records_async_views(self):
+        with override_settings(ROOT_URLCONF='crm.async_urls'):
+            await self.async_client.aforce_login(self.user)
+            await self.async_client.get(reverse('dashboard', urlconf='crm.async_urls'))
+        sample = perf.pending()[-1]
+        self.assertEqual(sample['view'], 'dashboard')
+        self.assertGreater(sample['queries'], 0)
+
+    def test_repeated_statements_share_a_signature(self):
+        recorder = perf.QueryRecorder()
+        with recorder.activate():
+            for pk in [1, 2]:
+                list(Company.objects.filter(pk=pk))
+            list(Company.objects.filter(pk__in=[1, 2, 3]))
+            list(Company.objects.filter(pk__in=[4, 5]))
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(sorted(recorder.duplicates().values()), [2, 2])
+        self.assertTrue(any('IN (...)' in sql for sql in recorder.duplicates()))
+
+    @override_settings(CRM_PERF_BUFFER_SIZE=3)
+    def test_buffer_keeps_newest_samples(self):
+        for _ in range(5):
+            self.client.get(reverse('company_detail', args=[self.company.pk]))
+        self.client.get(reverse('company_list'))
+        self.assertEqual([sample['view'] for sample in perf.pending()],
+                         ['company_detail', 'company_detail', 'company_list'])
+
+    @override_settings(CRM_PERF_FLUSH_INTERVAL=0)
+    def test_flushes_to_table_outside_transactions_only(self):
+        self.client.get(reverse('company_list'))
+        self.assertEqual(perf.maybe_flush(), 0)
+        self.assertEqual(perf.flush(), 1)
+        self.assertEqual(perf.pending(), [])
+        metric = RequestMetric.objects.get()
+        self.assertEqual(metric.view, 'company_list')
+
+    def test_flush_prunes_rows_past_retention(self):
+        old = RequestMetric.objects.create(view='company_list', method='GET', status=200, duration_ms=1, queries=1,
+                                           db_ms=1, created_at=timezone.now() - timedelta(days=8))
+        self.client.get(reverse('company_list'))
+        with override_settings(CRM_PERF_RETENTION_DAYS=7):
+            self.assertEqual(perf.flush(), 1)
+        self.assertFalse(RequestMetric.objects.filter(pk=old.pk).exists())
+        self.assertEqual(RequestMetric.objects.count(), 1)
+
+    @override_settings(CRM_PERF_REPORT_LIMIT=2)
+    def test_report_says_when_samples_were_left_out(self):
+        since = timezone.now() - timedelta(hours=1)
+        self.client.get(reverse('company_list'))
+        perf.flush()
+        self.assertFalse(perf.report(since)['truncated'])
+        for _ in range(2):
+            self.client.get(reverse('company_list'))
+        perf.flush()
+        report = perf.report(since)
+        self.assertTrue(report['truncated'])
+        self.assertEqual(report['requests'], 2)
+        self.client.force_login(self.staff)
+        self.assertContains(self.client.get(reverse('perf_report')), 'Only the newest')
+
+    def test_flushes_to_jsonl(self):
+        with TemporaryDirectory() as tmp, override_settings(CRM_PERF_JSONL=os.path.join(tmp, 'perf.jsonl')):
+            self.client.get(reverse('company_list'))
+            self.client.get(reverse('company_list'))
+            self.assertEqual(perf.flush(), 2)
+            self.client.get(reverse('company_list'))
+            report = perf.report(timezone.now() - timedelta(hours=1))
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['views'][0]['view'], 'company_list')
+        self.assertFalse(RequestMetric.objects.exists())
+
+    def test_jsonl_is_rotated_past_retention_and_read_from_the_end(self):
+        with TemporaryDirectory() as tmp, override_settings(CRM_PERF_JSONL=os.path.join(tmp, 'perf.jsonl'),
+                                                            CRM_PERF_RETENTION_DAYS=7, CRM_PERF_REPORT_LIMIT=2):
+            path = os.path.join(tmp, 'perf.jsonl')
+            old = perf.record(mock.Mock(resolver_match=None, method='GET'), mock.Mock(status_code=200), 0.1,
+                              perf.QueryRecorder())
+            old['created_at'] -= timedelta(days=8)
+            self.assertEqual(perf.flush(), 1)
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.exists(path + '.1'))
+
+            for _ in range(3):
+                self.client.get(reverse('company_list'))
+            perf.flush()
+            self.assertTrue(os.path.exists(path))
+            self.assertTrue(os.path.exists(path + '.1'))
+            report = perf.report(timezone.now() - timedelta(days=30))
+            self.assertTrue(report['truncated'])
+            self.assertEqual([row['view'] for row in report['views']], ['company_list'])
+
+            # Reading stops at the first sample older than the window.
+            with mock.patch.object(perf, '_parse', wraps=perf._parse) as parse:
+                with override_settings(CRM_PERF_REPORT_LIMIT=10):
+                    report = perf.report(timezone.now() - timedelta(days=1))
+            self.assertEqual((report['requests'], report['truncated']), (3, False))
+            self.assertEqual(parse.call_count, 4)
+
+    def test_report_is_staff_only(self):
+        self.client.get(reverse('company_list'))
+        self.assertEqual(self.client.get(reverse('perf_report')).status_code, 302)
+        self.client.force_login(self.staff)
+        perf.flush()
+        data = self.client.get(reverse('perf_report'), {'format': 'json'}).json()
+        row = next(row for row in data['views'] if row['view'] == 'company_list')
+        self.assertEqual(row['requests'], 1)
+        self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+        self.assertContains(self.client.get(reverse('perf_report')), 'company_list')
+        self.assertEqual(self.client.get(reverse('perf_report'), {'hours': 'x'}).status_code, 400)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'SQLite tuning profile')
+class SQLiteProfileTests(CRMTestMixin, TestCase):
+    def test_pragmas_applied_to_new_connections(self):
+        pragmas = {'synchronous': 'NORMAL', 'cache_size': -4096, 'temp_store': 'MEMORY'}
+        with override_settings(CRM_SQLITE_PRAGMAS=pragmas):
+            new = connections.create_connection('default')
+            try:
+                new.ensure_connection()
+                self.assertEqual(sqlite.current_pragmas(new), {'synchronous': 1, 'cache_size': -4096, 'temp_store': 2})
+            finally:
+                new.connection.close()
+
+    def test_production_profile_leaves_base_settings_alone(self):
+        from crm_project import settings_production
+        self.assertEqual(settings_production.CRM_SQLITE_PRAGMAS['journal_mode'], 'WAL')
+        self.assertEqual(settings_production.DATABASES['default']['OPTIONS']['transaction_mode'], 'IMMEDIATE')
+        self.assertGreater(settings_production.DATABASES['default']['CONN_MAX_AGE'], 0)
+        self.assertNotIn('transaction_mode', connection.settings_dict['OPTIONS'])
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 0)
+
+    def test_benchmark_command(self):
+        # Runs in a fresh process: the benchmark repoints the default database.
+        with TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'bench.json')
+            subprocess.run(
+                [sys.executable, 'manage.py', 'crm_dbbench', '-n', '60', '-c', '4', '--companies', '5', '-o', output],
+                cwd=settings.BASE_DIR, check=True, capture_output=True,
+            )
+            with open(output) as fh:
+                results = json.load(fh)
+        self.assertEqual(results['tuned']['pragmas']['journal_mode'], 'wal')
+        self.assertEqual(results['baseline']['pragmas']['journal_mode'], 'delete')
+        self.assertEqual(results['tuned']['errors'], 0)
+        self.assertEqual(results['tuned']['requests'], 60)
+        self.assertIn('speedup', results)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'The replica fixture copies SQLite databases')
+class ReplicaRoutingTests(CRMTestMixin, TransactionTestCase):
+    # The primary is the test database and the replica a second SQLite file
+    # that only changes when sync_replica() copies the primary over it, so
+    # every test controls exactly how far the replica lags. '__all__' picks
+    # up the alias setUpClass() adds, which the test runner never sees.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        cls.replica_dir = TemporaryDirectory()
+        connections.settings['replica'] = {
+            **connection.settings_dict,
+            'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3'),
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        replica_settings = override_settings(CRM_REPLICA_DATABASES=['replica'], CRM_REPLICA_STICKY_SECONDS=60)
+        replica_settings.enable()
+        self.addCleanup(replica_settings.disable)
+
+        self.user = self.create_user()
+        self.company = self.create_company()
+        self.client.force_login(self.user)
+        self.sync_replica()
+
+    def sync_replica(self):
+        connection.ensure_connection()
+        connections['replica'].ensure_connection()
+        connection.connection.backup(connections['replica'].connection)
+        # Fragments rendered from the stale copy would otherwise be served
+        # for up to CRM_REPLICA_STICKY_SECONDS.
+        cache.fragment_cache().clear()
+
+    def test_read_only_views_use_the_replica(self):
+        contact = self.create_contact(self.company, email='lagging@example.com')
+        self.assertNotContains(self.client.get(reverse('contact_list')), 'lagging@example.com')
+        self.assertEqual(self.client.get(reverse('contact_detail', args=[contact.pk])).status_code, 404)
+        self.sync_replica()
+        self.assertContains(self.client.get(reverse('contact_list')), 'lagging@example.com')
+
+    def test_other_views_and_writes_use_the_primary(self):
+        contact = self.create_contact(self.company, email='fresh@example.com')
+        self.assertEqual(self.client.get(reverse('contact_edit', args=[contact.pk])).status_code, 200)
+        self.assertEqual(Contact.objects.using('replica').filter(pk=contact.pk).count(), 0)
+
+    def test_session_sticks_to_primary_after_a_write(self):
+        response = self.client.post(reverse('contact_create'), {
+            'first_name': 'New', 'last_name': 'Person', 'email': 'new@example.com',
+            'company': self.company.pk, 'contact_type': 'prospect',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertContains(self.client.get(reverse('contact_list')), 'new@example.com')
+
+        other = Client()
+        other.force_login(self.create_user('other'))
+        self.assertNotContains(other.get(reverse('contact_list')), 'new@example.com')
+
+        session = self.client.session
+        session[routers.PIN_SESSION_KEY] = time.time() - 1
+        session.save()
+        cache.fragment_cache().clear()
+        self.assertNotContains(self.client.get(reverse('contact_list')), 'new@example.com')
+
+    def test_router_without_request_uses_primary(self):
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Contact))
+        self.assertEqual(router.db_for_write(Contact), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'crm'))
+
+
+class AutocompleteTests(CRMTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user()
+        cls.acme = cls.create_company('Acme')
+        cls.create_company('acorn Labs')
+        cls.create_company('Globex')
+        cls.contact = cls.create_contact(cls.acme, email='zed@example.com', first_name='Jane', last_name='Doe')
+        cls.create_contact(cls.acme, email='john@example.com', first_name='John', last_name='Smith')
+        cls.deal = cls.create_deal(cls.contact, title='Renewal')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def lookup(self, name, **params):
+        response = self.client.get(reverse(name), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_search_is_case_insensitive_and_paged(self):
+        data = self.lookup('company_autocomplete', q='AC', limit=1)
+        self.assertEqual(data['results'], [{'id': self.acme.pk, 'text': 'Acme'}])
+        self.assertTrue(data['more'])
+        data = self.lookup('company_autocomplete', q='ac', limit=1, page=2)
+        self.assertEqual([item['text'] for item in data['results']], ['acorn Labs'])
+        self.assertFalse(data['more'])
+        self.assertEqual(self.lookup('company_autocomplete', q='acx')['results'], [])
+
+    def test_contact_matches_name_or_email(self):
+        self.assertEqual([item['text'] for item in self.lookup('contact_autocomplete', q='zed')['results']],
+                         ['Jane Doe'])
+        self.assertEqual([item['text'] for item in self.lookup('contact_autocomplete', q='jo')['results']],
+                         ['John Smith'])
+        self.assertEqual(len(self.lookup('contact_autocomplete')['results']), 2)
+        self.assertEqual(self.lookup('deal_autocomplete', q='ren')['results'][0]['text'], 'Renewal - Acme')
+
+    def test_requires_login_and_integer_paging(self):
+        self.assertEqual(self.client.get(reverse('company_autocomplete'), {'page': 'x'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('company_autocomplete')).status_code, 302)
+
+    @skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+    def test_prefix_search_uses_lower_indexes(self):
+        for entity, indexes in [('company', ['crm_company_name_lower']),
+                                ('contact', ['crm_contact_last_name_lower', 'crm_contact_first_name_lower',
+                                             'crm_contact_email_lower'])]:
+            model, fields, _ = autocomplete.SOURCES[entity]
+            plan = (model.objects.annotate(**{f'{field}_lower': Lower(field) for field in fields})
+                    .filter(autocomplete.prefix_filter(fields, 'ab')).explain())
+            for index in indexes:
+                self.assertIn(index, plan)
+
+    def test_form_renders_only_the_selected_choice(self):
+        form = ContactForm(instance=self.contact)
+        with self.assertNumQueries(1):
+            html = str(form['company'])
+        self.assertIn('data-autocomplete-url="/companies/autocomplete/"', html)
+        self.assertIn('Acme', html)
+        self.assertNotIn('Globex', html)
+
+        with self.assertNumQueries(0):
+            html = str(ActivityForm()['deal'])
+        self.assertNotIn('Renewal', html)
+
+    def test_form_validates_the_submitted_pk(self):
+        data = {'title': 'Call', 'activity_type': 'call', 'status': 'planned',
+                'due_date': '2030-01-01T10:00', 'deal': self.deal.pk}
+        form = ActivityForm(data)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertEqual(form.cleaned_data['deal'], self.deal)
+        form = ActivityForm({**data, 'deal': self.deal.pk + 100})
+        self.assertFalse(form.is_valid())
+        self.assertIn('deal', form.errors)
+
+
+class LeadConversionTests(CRMTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        DashboardStats.rebuild()
+        self.user = self.create_user()
+        self.acme = self.create_company('Acme Corp')
+        self.existing = self.create_contact(self.acme, email='jane@example.com')
+        self.client.force_login(self.user)
+
+    def create_lead(self, email, company_name='acme corp', status='qualified', **kwargs):
+        return Lead.objects.create(first_name='Lead', last_name=email.split('@')[0], email=email,
+                                   company_name=company_name, status=status, assigned_to=self.user, **kwargs)
+
+    def assertStatsMatchRebuild(self):
+        incremental = DashboardStats.load()
+        rebuilt = DashboardStats.rebuild()
+        for field in ['total_companies', 'total_contacts', 'total_leads', 'total_deals',
+                      'won_deals', 'converted_leads', 'total_deal_value']:
+            self.assertEqual(getattr(incremental, field), getattr(rebuilt, field), field)
+
+    def test_convert_matches_existing_company_and_contact(self):
+        lead = conversion.convert(self.create_lead('JANE@example.com'), amount=Decimal('500'))
+        self.assertEqual(lead.status, 'converted')
+        self.assertEqual(lead.converted_contact, self.existing)
+        self.assertEqual((lead.converted_deal.company, lead.converted_deal.amount), (self.acme, Decimal('500')))
+        self.assertEqual(Company.objects.count(), 1)
+        self.assertEqual(Contact.objects.count(), 1)
+        self.assertStatsMatchRebuild()
+        with self.assertRaisesMessage(ValueError, 'already converted'):
+            conversion.convert(lead)
+
+    def test_convert_creates_missing_records(self):
+        lead = conversion.convert(self.create_lead('new@example.com', company_name=' Globex '), create_deal=False)
+        contact = lead.converted_contact
+        self.assertEqual((contact.email, contact.company.name, contact.assigned_to), ('new@example.com', 'Globex',
+                                                                                     self.user))
+        self.assertIsNone(lead.converted_deal)
+        self.assertEqual(search.search_ids('contact', 'globex'), [contact.pk])
+        self.assertStatsMatchRebuild()
+
+    def test_batch_conversion_bulk_inserts_and_dedupes(self):
+        for i in range(30):
+            self.create_lead(f'person{i % 20}@example.com', company_name=f'Company {i % 3}')
+        self.create_lead('jane@example.com')
+        self.create_lead('nocompany@example.com', company_name='')
+        closed = self.create_lead('lost@example.com', status='closed_lost')
+
+        with CaptureQueriesContext(connection) as queries:
+            result = conversion.convert_leads(Lead.objects.all())
+        self.assertEqual((result.converted, result.companies_created, result.contacts_created,
+                          result.contacts_matched, result.deals_created), (31, 3, 20, 1, 31))
+        self.assertEqual(set(result.skipped), {closed.pk, Lead.objects.get(email='nocompany@example.com').pk})
+        inserts = [q['sql'] for q in queries if q['sql'].startswith('INSERT INTO "crm_contact"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Lead.objects.filter(status='converted', converted_deal__isnull=False).count(), 31)
+        self.assertEqual(Lead.objects.get(email='jane@example.com').converted_contact, self.existing)
+        self.assertEqual(len(search.search_ids('deal', 'opportunity')), 31)
+        self.assertStatsMatchRebuild()
+
+    def test_batch_conversion_is_atomic(self):
+        self.create_lead('new@example.com', company_name='Globex')
+        with mock.patch.object(Deal.objects, 'bulk_create', side_effect=DatabaseError('boom')):
+            with self.assertRaises(DatabaseError):
+                conversion.convert_leads(Lead.objects.all())
+        self.assertFalse(Company.objects.filter(name='Globex').exists())
+        self.assertFalse(Contact.objects.filter(email='new@example.com').exists())
+        self.assertEqual(Lead.objects.get().status, 'qualified')
+
+    def test_convert_view_and_bulk_action(self):
+        lead = self.create_lead('view@example.com')
+        self.assertContains(self.client.get(reverse('lead_detail', args=[lead.pk])), 'Convert Lead')
+        response = self.client.post(reverse('lead_convert', args=[lead.pk]),
+                                    {'create_deal': 'on', 'amount': '1200', 'close_date': '2030-06-30'})
+        lead.refresh_from_db()
+        self.assertRedirects(response, reverse('deal_detail', args=[lead.converted_deal_id]),
+                             fetch_redirect_response=False)
+        self.assertEqual(lead.converted_deal.expected_close_date, date(2030, 6, 30))
+        self.assertNotContains(self.client.get(reverse('lead_detail', args=[lead.pk])), 'Convert Lead')
+
+        other = self.create_lead('bulk@example.com')
+        self.client.post(reverse('lead_bulk'), {'action': 'convert', 'ids': [other.pk]})
+        other.refresh_from_db()
+        self.assertEqual(other.status, 'converted')
+        self.assertStatsMatchRebuild()
+
+    @override_settings(ROOT_URLCONF='crm.async_urls')
+    def test_async_lead_detail(self):
+        lead = self.create_lead('async@example.com')
+        self.assertContains(self.client.get(reverse('lead_detail', args=[lead.pk])), 'Convert Lead')
+        lead = conversion.convert(lead)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('lead_detail', args=[lead.pk]))
+        # The lead comes with its converted contact and deal in one query.
+        self.assertEqual(len([q for q in queries.captured_queries if '"crm_' in q['sql']]), 1)
+        self.assertNotContains(response, 'Convert Lead')
+        self.assertContains(response, reverse('deal_detail', args=[lead.converted_deal_id]))
+
+    def test_command(self):
+        self.create_lead('cmd@example.com')
+        out = StringIO()
+        call_command('crm_convert_leads', '--no-deal', stdout=out, stderr=StringIO())
+        self.assertIn('1 converted', out.getvalue())
+        self.assertEqual(Deal.objects.count(), 0)
+
+
+class DedupeTests(CRMTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        DashboardStats.rebuild()
+        self.user = self.create_user(is_staff=True)
+        self.client.force_login(self.user)
+
+    def keys(self, entity, obj):
+        return dict(BlockingKey.objects.filter(entity=entity, object_id=obj.pk).values_list('kind', 'key'))
+
+    def test_normalization(self):
+        self.assertEqual([dedupe.soundex(w) for w in ['robert', 'rupert', 'ashcraft', 'tymczak', '3m']],
+                         ['R163', 'R163', 'A261', 'T522', '3m'])
+        self.assertEqual(dedupe.normalize_phone('+1 (555) 123-4567'), '5551234567')
+        self.assertEqual(dedupe.normalize_phone('123'), '')
+        self.assertEqual(dedupe.normalize_email(' J.Doe+crm@GoogleMail.com'), 'jdoe@gmail.com')
+        self.assertEqual(dedupe.email_domain('jane@gmail.com'), '')
+        self.assertEqual(dedupe.email_domain('jane@Acme.com'), 'acme.com')
+        self.assertEqual(dedupe.website_domain('https://www.acme.com/about'), 'acme.com')
+        self.assertEqual(dedupe.company_tokens('The Acme Corp.'), ['acme'])
+
+    def test_keys_follow_saves_and_deletes(self):
+        company = self.create_company('Acme Inc', website='acme.com', phone='555-123-4567')
+        self.assertEqual(self.keys('company', company), {'name': 'A250', 'domain': 'acme.com', 'phone': '5551234567'})
+        contact = self.create_contact(company, email='jon.smith@acme.com', first_name='Jon', last_name='Smith')
+        self.assertEqual(self.keys('contact', contact),
+                         {'name': 'S530j', 'email': 'jon.smith@acme.com', 'domain': 'acme.com'})
+        contact.email = 'jon@globex.com'
+        contact.save()
+        self.assertEqual(self.keys('contact', contact)['domain'], 'globex.com')
+        contact.delete()
+        self.assertEqual(self.keys('contact', contact), {})
+
+    def test_find_duplicates_scores_within_blocks(self):
+        acme = self.create_company('Acme Inc', website='https://acme.com')
+        acme2 = self.create_company('ACME Corporation', email='sales@acme.com')
+        self.create_company('Globex')
+        jon = self.create_contact(acme, email='jon@acme.com', first_name='Jon', last_name='Smith')
+        john = self.create_contact(acme, email='john.smith@acme.com', first_name='John', last_name='Smith')
+        self.create_contact(acme, email='john@globex.com', first_name='John', last_name='Smith')
+        self.create_contact(acme, email='mary@acme.com', first_name='Mary', last_name='Jones')
+        first = Lead.objects.create(first_name='Ann', last_name='Lee', email='Ann@Example.com')
+        second = Lead.objects.create(first_name='Anne', last_name='Leigh', email='ann@example.com')
+
+        self.assertEqual([(p['ids'], p['score']) for p in dedupe.find_duplicates('lead')],
+                         [((first.pk, second.pk), 1.0)])
+        company_pairs = dedupe.find_duplicates('company')
+        self.assertEqual([p['ids'] for p in company_pairs], [(acme.pk, acme2.pk)])
+        self.assertIn('domain', company_pairs[0]['reasons'])
+        self.assertEqual([p['ids'] for p in dedupe.find_duplicates('contact')], [(jon.pk, john.pk)])
+        with override_settings(CRM_DEDUPE_MAX_BLOCK_SIZE=1):
+            self.assertEqual(dedupe.find_duplicates('company'), [])
+
+    def test_limit_keeps_the_best_pairs_while_streaming(self):
+        names = ['Ann Lee', 'Anne Lee', 'Ann Leigh', 'Anna Lee', 'Annie Lea', 'Ann Lee']
+        for i, name in enumerate(names):
+            first, last = name.split()
+            # Every lead shares a phone, and some pairs also share an email.
+            Lead.objects.create(first_name=first, last_name=last, email=f'ann{i % 3}@example.com',
+                                phone='555-123-4567')
+        everything = dedupe.find_duplicates('lead', min_score=0)
+        self.assertEqual(len(everything), len({pair['ids'] for pair in everything}))
+        self.assertGreater(len(list(dedupe.scored_pairs('lead', 0))), len(everything))
+        for limit in [1, 3, len(everything)]:
+            with self.subTest(limit=limit):
+                self.assertEqual(dedupe.find_duplicates('lead', min_score=0, limit=limit), everything[:limit])
+
+    def test_merge_repoints_foreign_keys_in_bulk(self):
+        keep = self.create_company('Acme Inc')
+        duplicate = self.create_company('Acme Corp', website='https://acme.com', industry='Tools')
+        contact = self.create_contact(duplicate)
+        deal = self.create_deal(contact, amount='300.00')
+        activity = Activity.objects.create(title='Call', activity_type='call', contact=contact, deal=deal,
+                                           assigned_to=self.user,
+                                           due_date=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            result = dedupe.merge('company', keep, [duplicate.pk])
+        updates = [q['sql'] for q in queries if q['sql'].startswith(('UPDATE "crm_contact"', 'UPDATE "crm_deal"'))]
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(result['moved'], {'contact.company': 1, 'deal.company': 1})
+        self.assertEqual(result['deleted'], 1)
+        keep.refresh_from_db()
+        self.assertEqual((keep.website, keep.industry), ('https://acme.com', 'Tools'))
+        self.assertFalse(Company.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(Deal.objects.get(pk=deal.pk).company, keep)
+        self.assertEqual(search.search_ids('contact', 'acme inc'), [contact.pk])
+
+        other = self.create_contact(keep, email='jane.doe@example.com')
+        Lead.objects.create(first_name='Jane', last_name='Doe', email='jane@example.com', status='converted',
+                            converted_contact=contact)
+        dedupe.merge('contact', other, [contact.pk])
+        activity.refresh_from_db()
+        self.assertEqual((activity.contact, Deal.objects.get(pk=deal.pk).contact), (other, other))
+        self.assertEqual(Lead.objects.get().converted_contact, other)
+        self.assertEqual(Activity.objects.count(), 1)
+        stats, rebuilt = DashboardStats.load(), DashboardStats.rebuild()
+        self.assertEqual((stats.total_companies, stats.total_contacts, stats.total_deals),
+                         (rebuilt.total_companies, rebuilt.total_contacts, rebuilt.total_deals))
+        with self.assertRaises(ValueError):
+            dedupe.merge('contact', other, [other.pk])
+
+    def test_report_and_merge_views(self):
+        first = Lead.objects.create(first_name='Ann', last_name='Lee', email='ann@example.com')
+        second = Lead.objects.create(first_name='Ann', last_name='Lee', email='ANN@example.com', phone='555 0100')
+        response = self.client.get(reverse('dedupe_report'), {'entity': 'lead'})
+        self.assertContains(response, 'Keep left')
+        self.assertEqual(self.client.get(reverse('dedupe_report'), {'entity': 'deal'}).status_code, 400)
+        response = self.client.post(reverse('dedupe_merge'), {'entity': 'lead', 'keep': first.pk,
+                                                              'ids': [first.pk, second.pk]})
+        self.assertRedirects(response, reverse('dedupe_report') + '?entity=lead', fetch_redirect_response=False)
+        self.assertEqual(list(Lead.objects.values_list('pk', 'phone')), [(first.pk, '555 0100')])
+
+    def test_command_rebuilds_keys(self):
+        Company.objects.bulk_create([Company(name='Initech LLC'), Company(name='Initech')])
+        out = StringIO()
+        call_command('crm_dedupe', 'company', '--rebuild', stdout=out, stderr=StringIO())
+        self.assertIn('company: 1 likely duplicate pair(s)', out.getvalue())
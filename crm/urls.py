@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Dashboard
@@ -10,29 +10,78 @@ urlpatterns = [
     path('companies/<int:pk>/', views.company_detail, name='company_detail'),
     path('companies/add/', views.company_create, name='company_create'),
     path('companies/<int:pk>/edit/', views.company_edit, name='company_edit'),
+    path('companies/export/', views.export, {'entity': 'company'}, name='company_export'),
+    path('companies/autocomplete/', views.autocomplete_lookup, {'entity': 'company'}, name='company_autocomplete'),
     
     # Contact URLs
     path('contacts/', views.contact_list, name='contact_list'),
     path('contacts/<int:pk>/', views.contact_detail, name='contact_detail'),
     path('contacts/add/', views.contact_create, name='contact_create'),
     path('contacts/<int:pk>/edit/', views.contact_edit, name='contact_edit'),
+    path('contacts/export/', views.export, {'entity': 'contact'}, name='contact_export'),
+    path('contacts/autocomplete/', views.autocomplete_lookup, {'entity': 'contact'}, name='contact_autocomplete'),
     
     # Lead URLs
     path('leads/', views.lead_list, name='lead_list'),
     path('leads/<int:pk>/', views.lead_detail, name='lead_detail'),
     path('leads/add/', views.lead_create, name='lead_create'),
     path('leads/<int:pk>/edit/', views.lead_edit, name='lead_edit'),
+    path('leads/<int:pk>/convert/', views.lead_convert, name='lead_convert'),
+    path('leads/export/', views.export, {'entity': 'lead'}, name='lead_export'),
+    path('leads/bulk/', views.bulk_action, {'entity': 'lead'}, name='lead_bulk'),
     
     # Deal URLs
     path('deals/', views.deal_list, name='deal_list'),
     path('deals/<int:pk>/', views.deal_detail, name='deal_detail'),
     path('deals/add/', views.deal_create, name='deal_create'),
     path('deals/<int:pk>/edit/', views.deal_edit, name='deal_edit'),
+    path('deals/export/', views.export, {'entity': 'deal'}, name='deal_export'),
+    path('deals/autocomplete/', views.autocomplete_lookup, {'entity': 'deal'}, name='deal_autocomplete'),
+    path('deals/bulk/', views.bulk_action, {'entity': 'deal'}, name='deal_bulk'),
     
     # Activity URLs
     path('activities/', views.activity_list, name='activity_list'),
     path('activities/<int:pk>/', views.activity_detail, name='activity_detail'),
     path('activities/add/', views.activity_create, name='activity_create'),
     path('activities/<int:pk>/edit/', views.activity_edit, name='activity_edit'),
+    path('activities/export/', views.export, {'entity': 'activity'}, name='activity_export'),
+    path('activities/bulk/', views.bulk_action, {'entity': 'activity'}, name='activity_bulk'),
     path('activities/<int:pk>/complete/', views.activity_complete, name='activity_complete'),
+    
+    # Reports
+    path('reports/pipeline/', views.pipeline_report, name='pipeline_report'),
+    
+    # Background jobs
+    path('jobs/', views.job_list, name='job_list'),
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
+    path('jobs/rebuild/', views.job_rebuild, name='job_rebuild'),
+    path('imports/', views.import_upload, name='import_upload'),
+    
+    # JSON API
+    path('api/companies/', api.resource_list, {'entity': 'company'}, name='company_api'),
+    path('api/companies/<int:pk>/', api.resource_detail, {'entity': 'company'}, name='company_api_detail'),
+    path('api/companies/batch/', api.resource_batch, {'entity': 'company'}, name='company_api_batch'),
+    path('api/contacts/', api.resource_list, {'entity': 'contact'}, name='contact_api'),
+    path('api/contacts/<int:pk>/', api.resource_detail, {'entity': 'contact'}, name='contact_api_detail'),
+    path('api/contacts/batch/', api.resource_batch, {'entity': 'contact'}, name='contact_api_batch'),
+    path('api/leads/', api.resource_list, {'entity': 'lead'}, name='lead_api'),
+    path('api/leads/<int:pk>/', api.resource_detail, {'entity': 'lead'}, name='lead_api_detail'),
+    path('api/leads/batch/', api.resource_batch, {'entity': 'lead'}, name='lead_api_batch'),
+    path('api/deals/', api.resource_list, {'entity': 'deal'}, name='deal_api'),
+    path('api/deals/<int:pk>/', api.resource_detail, {'entity': 'deal'}, name='deal_api_detail'),
+    path('api/deals/batch/', api.resource_batch, {'entity': 'deal'}, name='deal_api_batch'),
+    path('api/activities/', api.resource_list, {'entity': 'activity'}, name='activity_api'),
+    path('api/activities/<int:pk>/', api.resource_detail, {'entity': 'activity'}, name='activity_api_detail'),
+    path('api/activities/batch/', api.resource_batch, {'entity': 'activity'}, name='activity_api_batch'),
+    
+    # Duplicates
+    path('dedupe/', views.dedupe_report, name='dedupe_report'),
+    path('dedupe/merge/', views.dedupe_merge, name='dedupe_merge'),
+    
+    # Cache URLs
+    path('cache/stats/', views.cache_stats, name='cache_stats'),
+    
+    # Performance report
+    path('perf/', views.perf_report, name='perf_report'),
 ]
\ No newline at end of file
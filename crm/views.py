@@ -1,75 +1,68 @@
+import os
+from datetime import timedelta
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.models import User
 from django.contrib import messages
-from django.db.models import Q, Sum, Count
-from django.http import JsonResponse
-from django.core.paginator import Paginator
-from datetime import datetime, timedelta
-from .models import Company, Contact, Lead, Deal, Activity
-from .forms import CompanyForm, ContactForm, LeadForm, DealForm, ActivityForm
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import require_POST
+from . import analytics, autocomplete, bulk, cache, conversion, dedupe, exporters, jobs, perf, search
+from .conditional import conditional_page
+from .pagination import paginate
+from .models import Company, Contact, Lead, Deal, Activity, BlockingKey, DashboardStats, Job
+from .forms import CompanyForm, ContactForm, LeadForm, DealForm, ActivityForm, ImportForm, LeadConversionForm
 
 @login_required
+@conditional_page('company', 'contact', 'lead', 'deal', 'activity', max_age=60)
 def dashboard(request):
-    # Get dashboard statistics
-    total_contacts = Contact.objects.count()
-    total_leads = Lead.objects.count()
-    total_deals = Deal.objects.count()
-    total_companies = Company.objects.count()
+    # Dashboard statistics are maintained incrementally by crm.signals. The
+    # context is lazy so panels served from the fragment cache skip their
+    # queries entirely.
+    stats = SimpleLazyObject(DashboardStats.load)
     
     # Recent activities
     recent_activities = Activity.objects.select_related('contact', 'deal').order_by('-created_at')[:5]
     
     # Upcoming activities
     upcoming_activities = Activity.objects.filter(
-        due_date__gte=datetime.now(),
+        due_date__gte=timezone.now(),
         status='planned'
     ).select_related('contact', 'deal').order_by('due_date')[:5]
     
-    # Deal statistics
-    total_deal_value = Deal.objects.aggregate(Sum('amount'))['amount__sum'] or 0
-    won_deals = Deal.objects.filter(stage='closed_won').count()
-    
-    # Lead conversion stats
-    converted_leads = Lead.objects.filter(status='converted').count()
-    lead_conversion_rate = (converted_leads / total_leads * 100) if total_leads > 0 else 0
-    
     context = {
-        'total_contacts': total_contacts,
-        'total_leads': total_leads,
-        'total_deals': total_deals,
-        'total_companies': total_companies,
+        'stats': stats,
         'recent_activities': recent_activities,
         'upcoming_activities': upcoming_activities,
-        'total_deal_value': total_deal_value,
-        'won_deals': won_deals,
-        'lead_conversion_rate': round(lead_conversion_rate, 1),
     }
     
     return render(request, 'crm/dashboard.html', context)
 
 # Company Views
 @login_required
+@conditional_page('company', 'contact', 'deal')
 def company_list(request):
-    companies = Company.objects.all().order_by('name')
+    companies = Company.objects.with_totals().order_by('name', 'id')
     search_query = request.GET.get('search')
+    search_capped = False
     if search_query:
-        companies = companies.filter(
-            Q(name__icontains=search_query) |
-            Q(industry__icontains=search_query) |
-            Q(city__icontains=search_query)
-        )
+        companies, search_capped = search.filter_queryset(companies, search_query)
     
-    paginator = Paginator(companies, 10)
-    page_number = request.GET.get('page')
-    companies = paginator.get_page(page_number)
+    companies = paginate(request, companies, ['name', 'id'])
     
-    return render(request, 'crm/company_list.html', {'companies': companies})
+    return render(request, 'crm/company_list.html', {'companies': companies, 'search_capped': search_capped})
 
 @login_required
+@conditional_page('company', 'contact', 'deal')
 def company_detail(request, pk):
-    company = get_object_or_404(Company, pk=pk)
-    contacts = company.contacts.all()
-    deals = company.deals.all()
+    company = get_object_or_404(Company.objects.with_totals(), pk=pk)
+    contacts = company.contacts.select_related('assigned_to').order_by('last_name', 'first_name')
+    deals = company.deals.select_related('contact').order_by('-created_at')
     return render(request, 'crm/company_detail.html', {
         'company': company,
         'contacts': contacts,
@@ -103,27 +96,23 @@ def company_edit(request, pk):
 
 # Contact Views
 @login_required
+@conditional_page('contact', 'company')
 def contact_list(request):
-    contacts = Contact.objects.select_related('company').all().order_by('last_name')
+    contacts = Contact.objects.select_related('company', 'assigned_to').all().order_by('last_name', 'id')
     search_query = request.GET.get('search')
+    search_capped = False
     if search_query:
-        contacts = contacts.filter(
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(company__name__icontains=search_query)
-        )
+        contacts, search_capped = search.filter_queryset(contacts, search_query)
     
-    paginator = Paginator(contacts, 10)
-    page_number = request.GET.get('page')
-    contacts = paginator.get_page(page_number)
+    contacts = paginate(request, contacts, ['last_name', 'id'])
     
-    return render(request, 'crm/contact_list.html', {'contacts': contacts})
+    return render(request, 'crm/contact_list.html', {'contacts': contacts, 'search_capped': search_capped})
 
 @login_required
+@conditional_page('contact', 'company', 'deal', 'activity')
 def contact_detail(request, pk):
-    contact = get_object_or_404(Contact, pk=pk)
-    activities = contact.activities.all().order_by('-created_at')
+    contact = get_object_or_404(Contact.objects.select_related('company', 'assigned_to'), pk=pk)
+    activities = contact.activities.select_related('deal').order_by('-created_at')
     deals = contact.deals.all().order_by('-created_at')
     return render(request, 'crm/contact_detail.html', {
         'contact': contact,
@@ -161,32 +150,39 @@ def contact_edit(request, pk):
 
 # Lead Views
 @login_required
+@conditional_page('lead')
 def lead_list(request):
-    leads = Lead.objects.all().order_by('-created_at')
+    leads = Lead.objects.all().order_by('-created_at', '-id')
     search_query = request.GET.get('search')
     status_filter = request.GET.get('status')
+    search_capped = False
     
-    if search_query:
-        leads = leads.filter(
-            Q(first_name__icontains=search_query) |
-            Q(last_name__icontains=search_query) |
-            Q(email__icontains=search_query) |
-            Q(company_name__icontains=search_query)
-        )
-    
+    # Filters first, so search ranks only the rows they leave.
     if status_filter:
         leads = leads.filter(status=status_filter)
     
-    paginator = Paginator(leads, 10)
-    page_number = request.GET.get('page')
-    leads = paginator.get_page(page_number)
+    if search_query:
+        leads, search_capped = search.filter_queryset(leads, search_query)
+    
+    leads = paginate(request, leads, ['-created_at', '-id'])
     
-    return render(request, 'crm/lead_list.html', {'leads': leads})
+    return render(request, 'crm/lead_list.html', {
+        'leads': leads,
+        'search_capped': search_capped,
+        'status_choices': Lead.STATUS_CHOICES,
+        **_bulk_context('lead'),
+    })
 
 @login_required
+@conditional_page('lead', 'contact', 'deal')
 def lead_detail(request, pk):
-    lead = get_object_or_404(Lead, pk=pk)
-    return render(request, 'crm/lead_detail.html', {'lead': lead})
+    lead = get_object_or_404(
+        Lead.objects.select_related('assigned_to', 'converted_contact', 'converted_deal'), pk=pk,
+    )
+    return render(request, 'crm/lead_detail.html', {
+        'lead': lead,
+        'conversion_form': LeadConversionForm() if conversion.skip_reason(lead) is None else None,
+    })
 
 @login_required
 def lead_create(request):
@@ -216,34 +212,54 @@ def lead_edit(request, pk):
         form = LeadForm(instance=lead)
     return render(request, 'crm/lead_form.html', {'form': form, 'title': 'Edit Lead'})
 
+@login_required
+@require_POST
+def lead_convert(request, pk):
+    lead = get_object_or_404(Lead, pk=pk)
+    form = LeadConversionForm(request.POST)
+    if not form.is_valid():
+        messages.warning(request, 'Enter a valid amount and close date.')
+        return redirect('lead_detail', pk=lead.pk)
+    try:
+        lead = conversion.convert(lead, **form.cleaned_data)
+    except ValueError as exc:
+        messages.warning(request, str(exc))
+        return redirect('lead_detail', pk=lead.pk)
+    messages.success(request, 'Lead converted successfully!')
+    if lead.converted_deal_id:
+        return redirect('deal_detail', pk=lead.converted_deal_id)
+    return redirect('contact_detail', pk=lead.converted_contact_id)
+
 # Deal Views
 @login_required
+@conditional_page('deal', 'company', 'contact')
 def deal_list(request):
-    deals = Deal.objects.select_related('company', 'contact').all().order_by('-created_at')
+    deals = Deal.objects.select_related('company', 'contact').all().order_by('-created_at', '-id')
     search_query = request.GET.get('search')
     stage_filter = request.GET.get('stage')
+    search_capped = False
     
-    if search_query:
-        deals = deals.filter(
-            Q(title__icontains=search_query) |
-            Q(company__name__icontains=search_query) |
-            Q(contact__first_name__icontains=search_query) |
-            Q(contact__last_name__icontains=search_query)
-        )
-    
+    # Filters first, so search ranks only the rows they leave.
     if stage_filter:
         deals = deals.filter(stage=stage_filter)
     
-    paginator = Paginator(deals, 10)
-    page_number = request.GET.get('page')
-    deals = paginator.get_page(page_number)
+    if search_query:
+        deals, search_capped = search.filter_queryset(deals, search_query)
+    
+    deals = paginate(request, deals, ['-created_at', '-id'])
     
-    return render(request, 'crm/deal_list.html', {'deals': deals})
+    return render(request, 'crm/deal_list.html', {
+        'deals': deals,
+        'search_capped': search_capped,
+        'stage_choices': Deal.STAGE_CHOICES,
+        **_bulk_context('deal'),
+    })
 
 @login_required
+@conditional_page('deal', 'company', 'contact', 'activity')
 def deal_detail(request, pk):
-    deal = get_object_or_404(Deal, pk=pk)
-    activities = deal.activities.all().order_by('-created_at')
+    deal = get_object_or_404(Deal.objects.select_related('company', 'contact', 'assigned_to'), pk=pk)
+    activities = deal.activities.select_related('contact').order_by('-created_at')
     return render(request, 'crm/deal_detail.html', {'deal': deal, 'activities': activities})
 
 @login_required
@@ -276,31 +292,33 @@ def deal_edit(request, pk):
 
 # Activity Views
 @login_required
+@conditional_page('activity', 'contact', 'deal')
 def activity_list(request):
-    activities = Activity.objects.select_related('contact', 'deal').all().order_by('-due_date')
+    activities = Activity.objects.select_related('contact', 'deal').all().order_by('-due_date', '-id')
     search_query = request.GET.get('search')
     status_filter = request.GET.get('status')
+    search_capped = False
     
-    if search_query:
-        activities = activities.filter(
-            Q(title__icontains=search_query) |
-            Q(contact__first_name__icontains=search_query) |
-            Q(contact__last_name__icontains=search_query) |
-            Q(deal__title__icontains=search_query)
-        )
-    
+    # Filters first, so search ranks only the rows they leave.
     if status_filter:
         activities = activities.filter(status=status_filter)
     
-    paginator = Paginator(activities, 10)
-    page_number = request.GET.get('page')
-    activities = paginator.get_page(page_number)
+    if search_query:
+        activities, search_capped = search.filter_queryset(activities, search_query)
     
-    return render(request, 'crm/activity_list.html', {'activities': activities})
+    activities = paginate(request, activities, ['-due_date', '-id'])
+    
+    return render(request, 'crm/activity_list.html', {
+        'activities': activities,
+        'search_capped': search_capped,
+        'status_choices': Activity.STATUS_CHOICES,
+        **_bulk_context('activity'),
+    })
 
 @login_required
+@conditional_page('activity', 'contact', 'deal')
 def activity_detail(request, pk):
-    activity = get_object_or_404(Activity, pk=pk)
+    activity = get_object_or_404(Activity.objects.select_related('contact', 'deal', 'assigned_to'), pk=pk)
     return render(request, 'crm/activity_detail.html', {'activity': activity})
 
 @login_required
@@ -336,3 +354,220 @@ def activity_complete(request, pk):
     activity.mark_completed()
     messages.success(request, 'Activity marked as completed!')
     return redirect('activity_list')
+
+# Bulk Actions
+def _bulk_context(entity):
+    return {
+        'bulk_actions': bulk.ACTIONS[entity][1],
+        'assignees': User.objects.filter(is_active=True).order_by('username').only('username'),
+    }
+
+@login_required
+@require_POST
+def bulk_action(request, entity):
+    # Applies an action to the ticked rows, or with scope=all to every row
+    # matching the list filters the form was submitted from. Reassigning
+    # every matching row can touch the whole table, so it runs as a job.
+    filters = {key: request.POST[key] for key in ('search', 'status', 'stage') if request.POST.get(key)}
+    action = request.POST.get('action')
+    value = request.POST.get('assigned_to' if action == 'reassign' else 'value')
+    scope_all = request.POST.get('scope') == 'all'
+    if scope_all:
+        queryset = exporters.filtered_queryset(entity, filters)
+    else:
+        ids = [pk for pk in request.POST.getlist('ids') if pk.isdigit()]
+        queryset = bulk.ACTIONS[entity][0].objects.filter(pk__in=ids) if ids else None
+    if queryset is None:
+        messages.warning(request, 'Select at least one row.')
+    elif scope_all and action == 'reassign' and action in bulk.ACTIONS[entity][1]:
+        try:
+            user_id = bulk.assignee(value)
+        except ValueError as exc:
+            messages.warning(request, str(exc))
+        else:
+            job = jobs.enqueue('reassign', {'entity': entity, 'user_id': user_id, 'filters': filters},
+                               user=request.user)
+            return redirect('job_detail', pk=job.pk)
+    else:
+        try:
+            updated = bulk.apply(entity, action, queryset, value)
+        except ValueError as exc:
+            messages.warning(request, str(exc))
+        else:
+            messages.success(request, f'Updated {updated} record{"s" if updated != 1 else ""}.')
+    url = reverse(f'{entity}_list')
+    return redirect(f'{url}?{urlencode(filters)}' if filters else url)
+
+# Export Views
+@login_required
+def export(request, entity):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exporters.FORMATS:
+        return HttpResponseBadRequest('Unsupported export format')
+    if request.method == 'POST':
+        # Large exports can be written by the worker and downloaded later.
+        params = {key: value for key, value in request.GET.items() if key != 'format'}
+        job = jobs.enqueue('export', {'entity': entity, 'params': params, 'format': fmt}, user=request.user)
+        return redirect('job_detail', pk=job.pk)
+    response = StreamingHttpResponse(
+        exporters.stream(entity, request.GET, fmt),
+        content_type=exporters.FORMATS[fmt][0],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exporters.filename(entity, fmt)}"'
+    return response
+
+# Autocomplete
+@login_required
+def autocomplete_lookup(request, entity):
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        limit = max(int(request.GET.get('limit', autocomplete.page_size())), 1)
+    except ValueError:
+        return HttpResponseBadRequest('page and limit must be integers')
+    return JsonResponse(autocomplete.search(entity, request.GET.get('q', ''), page, limit))
+
+# Report Views
+@login_required
+def pipeline_report(request):
+    deals, leads = Deal.objects.all(), Lead.objects.all()
+    assigned_to = None
+    try:
+        months = min(max(int(request.GET.get('months', analytics.DEFAULT_MONTHS)), 1), 36)
+        if request.GET.get('assigned_to'):
+            assigned_to = int(request.GET['assigned_to'])
+            deals = deals.filter(assigned_to_id=assigned_to)
+            leads = leads.filter(assigned_to_id=assigned_to)
+    except ValueError:
+        return HttpResponseBadRequest('months and assigned_to must be integers')
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse(analytics.pipeline_report(deals, leads, months=months, assigned_to=assigned_to))
+    # Built lazily so a cached report fragment skips the aggregate queries.
+    report = SimpleLazyObject(lambda: analytics.pipeline_report(deals, leads, months=months, assigned_to=assigned_to))
+    return render(request, 'crm/pipeline_report.html', {'report': report})
+
+# Job Views
+def _visible_jobs(user):
+    jobs_qs = Job.objects.select_related('created_by')
+    return jobs_qs if user.is_staff else jobs_qs.filter(created_by=user)
+
+@login_required
+def job_list(request):
+    return render(request, 'crm/job_list.html', {
+        'jobs': _visible_jobs(request.user).defer('args', 'result', 'error')[:50],
+    })
+
+@login_required
+def job_detail(request, pk):
+    job = get_object_or_404(_visible_jobs(request.user), pk=pk)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'id': job.pk,
+            'task': job.task,
+            'status': job.status,
+            'progress': job.progress,
+            'total': job.total,
+            'percent': job.percent,
+            'message': job.message,
+            'attempts': job.attempts,
+            'result': job.result,
+            'error': job.error.strip().splitlines()[-1] if job.error else '',
+        })
+    return render(request, 'crm/job_detail.html', {'job': job})
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(_visible_jobs(request.user), pk=pk, task='export')
+    if job.status != 'succeeded':
+        return redirect('job_detail', pk=job.pk)
+    try:
+        return FileResponse(open(job.result['path'], 'rb'), as_attachment=True, filename=job.result['filename'])
+    except OSError:
+        raise Http404('Export file is no longer available')
+
+@staff_member_required
+def job_rebuild(request):
+    if request.method == 'POST' and request.POST.get('task') in ('rebuild_stats', 'rebuild_search'):
+        job = jobs.enqueue(request.POST['task'], user=request.user)
+        messages.success(request, f'Queued {job.task} as job #{job.pk}.')
+    return redirect('job_list')
+
+@login_required
+def import_upload(request):
+    if request.method == 'POST':
+        form = ImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            path = jobs.files_dir() / f'import-{timezone.now():%Y%m%d%H%M%S%f}-{os.path.basename(upload.name)}'
+            with open(path, 'wb') as fh:
+                for chunk in upload.chunks():
+                    fh.write(chunk)
+            job = jobs.enqueue('import', {
+                'entity': form.cleaned_data['entity'],
+                'path': str(path),
+                'update': form.cleaned_data['update'],
+            }, user=request.user, max_attempts=1)
+            return redirect('job_detail', pk=job.pk)
+    else:
+        form = ImportForm()
+    return render(request, 'crm/import_form.html', {'form': form, 'title': 'Import'})
+
+# Cache Views
+@staff_member_required
+def cache_stats(request):
+    return JsonResponse(cache.stats())
+
+# Performance Views
+@staff_member_required
+def perf_report(request):
+    try:
+        hours = min(max(int(request.GET.get('hours', 24)), 1), 24 * 30)
+    except ValueError:
+        return HttpResponseBadRequest('hours must be an integer')
+    report = perf.report(timezone.now() - timedelta(hours=hours))
+    if request.GET.get('format') == 'json':
+        return JsonResponse(report)
+    return render(request, 'crm/perf_report.html', {'report': report, 'hours': hours})
+
+# Duplicates
+@staff_member_required
+def dedupe_report(request):
+    entity = request.GET.get('entity', 'contact')
+    if entity not in dedupe.ENTITIES:
+        return HttpResponseBadRequest('Unknown entity')
+    try:
+        min_score = float(request.GET.get('min_score', dedupe.threshold()))
+    except ValueError:
+        return HttpResponseBadRequest('min_score must be a number')
+    pairs = dedupe.find_duplicates(entity, min_score, limit=dedupe.REPORT_LIMIT)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'entity': entity, 'min_score': min_score, 'pairs': pairs})
+    objects = dedupe.ENTITIES[entity][0].objects.in_bulk({pk for pair in pairs for pk in pair['ids']})
+    rows = [
+        {**pair, 'first': objects[pair['ids'][0]], 'second': objects[pair['ids'][1]]}
+        for pair in pairs if pair['ids'][0] in objects and pair['ids'][1] in objects
+    ]
+    return render(request, 'crm/dedupe_report.html', {
+        'entity': entity,
+        'entities': BlockingKey.ENTITY_CHOICES,
+        'min_score': min_score,
+        'rows': rows,
+        'limit': dedupe.REPORT_LIMIT,
+    })
+
+@staff_member_required
+@require_POST
+def dedupe_merge(request):
+    entity = request.POST.get('entity')
+    keep_id = request.POST.get('keep', '')
+    if entity not in dedupe.MERGEABLE or not keep_id.isdigit():
+        return HttpResponseBadRequest('Choose the record to keep')
+    keep = get_object_or_404(dedupe.MERGEABLE[entity], pk=keep_id)
+    try:
+        result = dedupe.merge(entity, keep, [pk for pk in request.POST.getlist('ids') if pk.isdigit()])
+    except ValueError as exc:
+        messages.warning(request, str(exc))
+    else:
+        deleted = result['deleted']
+        messages.success(request, f'Merged {deleted} duplicate{"s" if deleted != 1 else ""} into {keep}.')
+    return redirect(f'{reverse("dedupe_report")}?{urlencode({"entity": entity})}')
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crm_project.settings')
+# Serve the async variants of the read-only views; set to 0 to compare.
+os.environ.setdefault('CRM_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
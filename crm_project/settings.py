@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,11 +42,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'crm.perf.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'crm.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -80,6 +83,65 @@ DATABASES = {
     }
 }
 
+# Read replicas: aliases in DATABASES that mirror 'default'. Read-only views
+# (dashboard, lists, details) read CRM data from them; a session that wrote
+# reads from the primary for CRM_REPLICA_STICKY_SECONDS afterwards.
+# CRM_REPLICA_SQLITE=/path/to/copy.sqlite3 adds one for local testing.
+DATABASE_ROUTERS = ['crm.routers.ReplicaRouter']
+CRM_REPLICA_DATABASES = []
+CRM_REPLICA_STICKY_SECONDS = 10
+
+if os.environ.get('CRM_REPLICA_SQLITE'):
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ['CRM_REPLICA_SQLITE'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    CRM_REPLICA_DATABASES.append('replica')
+
+# PRAGMAs run on each new SQLite connection (crm.sqlite.apply_pragmas);
+# crm_project/settings_production.py turns on WAL and friends.
+CRM_SQLITE_PRAGMAS = {}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; set CRM_CACHE_DIR to share fragments between
+# worker processes on one machine, or point 'default' at Redis/Memcached.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'crm',
+    }
+}
+
+if os.environ.get('CRM_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['CRM_CACHE_DIR'],
+    }
+
+# Cache alias and lifetime (seconds) for rendered template fragments
+CRM_FRAGMENT_CACHE = 'default'
+CRM_FRAGMENT_CACHE_TIMEOUT = 300
+
+# Route the dashboard, list and detail pages to crm.async_views
+# (crm_project/asgi.py turns this on)
+CRM_ASYNC_VIEWS = os.environ.get('CRM_ASYNC_VIEWS') == '1'
+
+# Per-request timing and query metrics (crm.perf.PerfMiddleware). Samples are
+# buffered in memory and flushed every CRM_PERF_FLUSH_INTERVAL seconds to the
+# RequestMetric table, or appended to CRM_PERF_JSONL when that is set.
+CRM_PERF_ENABLED = os.environ.get('CRM_PERF_ENABLED', '1') == '1'
+CRM_PERF_BUFFER_SIZE = 1000
+CRM_PERF_FLUSH_INTERVAL = 60
+CRM_PERF_JSONL = os.environ.get('CRM_PERF_JSONL')
+# Samples older than CRM_PERF_RETENTION_DAYS are dropped on flush (the JSONL
+# file is rotated); the /perf/ report summarizes at most CRM_PERF_REPORT_LIMIT.
+CRM_PERF_RETENTION_DAYS = 30
+CRM_PERF_REPORT_LIMIT = 50000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
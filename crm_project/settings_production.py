@@ -0,0 +1,39 @@
+"""
+Production profile for a single-server SQLite deployment.
+
+    DJANGO_SETTINGS_MODULE=crm_project.settings_production
+
+Compare it with the default settings using `python manage.py crm_dbbench`.
+"""
+
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DEBUG = False
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', 'localhost').split(',')
+
+DATABASES = {**DATABASES, 'default': {
+    **DATABASES['default'],
+    # Keep each worker thread's connection (and its page cache) between requests.
+    'CONN_MAX_AGE': 600,
+    'CONN_HEALTH_CHECKS': True,
+    'OPTIONS': {
+        # Take the write lock when a transaction starts, so concurrent writers
+        # wait on busy_timeout instead of failing with "database is locked"
+        # when a read lock can't be upgraded.
+        'transaction_mode': 'IMMEDIATE',
+    },
+}}
+
+# Applied to every new connection by crm.sqlite.apply_pragmas
+CRM_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',          # readers no longer block the writer or each other
+    'synchronous': 'NORMAL',        # fsync at checkpoints only; safe with WAL
+    'busy_timeout': 20000,          # ms to wait for the write lock
+    'cache_size': -65536,           # 64 MB page cache per connection
+    'mmap_size': 268435456,         # 256 MB memory-mapped reads
+    'temp_store': 'MEMORY',
+}
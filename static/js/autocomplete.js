@@ -0,0 +1,65 @@
+// Search-as-you-type for <select data-autocomplete-url> (crm.forms.AutocompleteSelect).
+// The server renders only the selected option; matches are fetched a page at a time.
+(function () {
+    function init(select) {
+        var url = select.dataset.autocompleteUrl;
+        var input = document.createElement('input');
+        input.type = 'search';
+        input.className = 'form-control form-control-sm mb-1';
+        input.placeholder = 'Type to search...';
+        input.setAttribute('aria-label', 'Search');
+        select.parentNode.insertBefore(input, select);
+
+        var more = document.createElement('button');
+        more.type = 'button';
+        more.className = 'btn btn-link btn-sm p-0 d-none';
+        more.textContent = 'Load more';
+        select.parentNode.insertBefore(more, select.nextSibling);
+
+        var term = '';
+        var page = 1;
+        var timer = null;
+
+        function load(append) {
+            var params = new URLSearchParams({q: term, page: page});
+            fetch(url + '?' + params, {credentials: 'same-origin'})
+                .then(function (response) { return response.json(); })
+                .then(function (data) {
+                    if (!append) {
+                        // Keep the blank choice and the current selection.
+                        Array.from(select.options).forEach(function (option) {
+                            if (option.value && !option.selected) {
+                                option.remove();
+                            }
+                        });
+                    }
+                    data.results.forEach(function (item) {
+                        if (!select.querySelector('option[value="' + item.id + '"]')) {
+                            select.add(new Option(item.text, item.id));
+                        }
+                    });
+                    more.classList.toggle('d-none', !data.more);
+                });
+        }
+
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                term = input.value.trim();
+                page = 1;
+                load(false);
+            }, 250);
+        });
+        more.addEventListener('click', function () {
+            page += 1;
+            load(true);
+        });
+        select.addEventListener('focus', function () {
+            if (select.options.length <= 2 && page === 1 && !term) {
+                load(false);
+            }
+        }, {once: true});
+    }
+
+    document.querySelectorAll('select[data-autocomplete-url]').forEach(init);
+})();